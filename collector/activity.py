@@ -0,0 +1,164 @@
+# collector/activity.py
+
+import time
+import argparse
+from collections import defaultdict
+from sqlalchemy import func, case, insert
+from config import ACTIVITY_BUCKET_RETENTION_HOURS
+from database import init_db, SessionLocal, Fill, ActivityBucket, upsert_insert
+from analysis_logic import summarize_position
+from logs import get_logger
+from metrics import DB_QUERY_SECONDS
+
+log = get_logger("activity")
+
+MINUTE_MS = 60 * 1000
+
+
+def minute_start(timestamp_ms):
+    return timestamp_ms - timestamp_ms % MINUTE_MS
+
+
+def window_start(now_ms, window_ms):
+    """
+    اولین bucket داخل بازه [now - window, now]؛ مرز بازه به دقیقه گرد می‌شود.
+    """
+    return minute_start(now_ms - window_ms)
+
+
+# -------------------------------------------------
+# به‌روزرسانی هنگام درج fills
+# -------------------------------------------------
+def accumulate_bucket_rows(rows):
+    """
+    ردیف‌های fill را به مجموع‌های هر (دقیقه، دارایی، سمت، تریدر) تبدیل می‌کند.
+    """
+    totals = defaultdict(lambda: {"volume": 0.0, "notional": 0.0, "fill_count": 0})
+    for row in rows:
+        data = totals[(minute_start(row["timestamp"]), row["asset"], bool(row["is_buy"]), row["user_address"])]
+        data["volume"] += row["size"]
+        data["notional"] += row["size"] * row["price"]
+        data["fill_count"] += 1
+    return totals
+
+
+def apply_fills_to_buckets(session, inserted_rows):
+    """
+    fillهای تازه درج شده را به activity_buckets اضافه می‌کند (در همان تراکنش درج fills).
+    """
+    totals = accumulate_bucket_rows(inserted_rows)
+    if not totals:
+        return
+    values = [
+        dict(data, minute=minute, asset=asset, is_buy=is_buy, user_address=user)
+        for (minute, asset, is_buy, user), data in totals.items()
+    ]
+    stmt = upsert_insert(session, ActivityBucket.__table__)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ActivityBucket.minute, ActivityBucket.asset, ActivityBucket.is_buy, ActivityBucket.user_address],
+        set_={
+            column: getattr(ActivityBucket, column) + getattr(excluded, column)
+            for column in ("volume", "notional", "fill_count")
+        }
+    )
+    session.connection().execute(stmt, values)
+
+
+def rebuild_buckets(session, hours=ACTIVITY_BUCKET_RETENTION_HOURS, now_ms=None):
+    """
+    bucketهای `hours` ساعت اخیر را از روی جدول fills از نو می‌سازد.
+    """
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    since_ms = window_start(now_ms, hours * 3600 * 1000)
+    session.query(ActivityBucket).filter(ActivityBucket.minute >= since_ms).delete(synchronize_session=False)
+
+    minute = (Fill.timestamp - Fill.timestamp % MINUTE_MS).label("minute")
+    aggregates = session.query(
+        minute,
+        Fill.asset,
+        Fill.is_buy,
+        Fill.user_address,
+        func.sum(Fill.size),
+        func.sum(Fill.size * Fill.price),
+        func.count(),
+    ).filter(Fill.timestamp >= since_ms).group_by(minute, Fill.asset, Fill.is_buy, Fill.user_address)
+
+    session.execute(insert(ActivityBucket).from_select(
+        ["minute", "asset", "is_buy", "user_address", "volume", "notional", "fill_count"],
+        aggregates.statement
+    ))
+    session.commit()
+    return session.query(func.count()).select_from(ActivityBucket).filter(ActivityBucket.minute >= since_ms).scalar()
+
+
+def ensure_buckets_built(session):
+    """
+    اگر activity_buckets خالی است ولی fills داده دارد (اولین اجرا پس از ارتقا)، بازه نگهداری را از fills می‌سازد.
+    """
+    has_buckets = session.query(session.query(ActivityBucket).exists()).scalar()
+    if has_buckets:
+        return
+    has_fills = session.query(session.query(Fill).exists()).scalar()
+    if has_fills:
+        log.info("🧮 'activity_buckets' table is empty. Rebuilding it from 'fills'...")
+        with DB_QUERY_SECONDS.time(query="rebuild_buckets"):
+            count = rebuild_buckets(session)
+        log.info("✅ Rebuilt activity buckets", extra={"rows": count})
+
+
+def prune_buckets(session, retention_hours=ACTIVITY_BUCKET_RETENTION_HOURS, now_ms=None):
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    deleted = session.query(ActivityBucket).filter(
+        ActivityBucket.minute < window_start(now_ms, retention_hours * 3600 * 1000)
+    ).delete(synchronize_session=False)
+    session.commit()
+    return deleted
+
+
+# -------------------------------------------------
+# پاسخ بازه‌ها با جمع bucketها
+# -------------------------------------------------
+def window_positions(session, window_ms, now_ms):
+    """
+    پوزیشن خالص هر (تریدر، دارایی) از معاملات داخل بازه؛ همان خروجی get_open_positions
+    روی fillهای بازه، ولی از روی bucketها.
+    """
+    buy_volume = func.sum(case((ActivityBucket.is_buy, ActivityBucket.volume), else_=0.0))
+    sell_volume = func.sum(case((ActivityBucket.is_buy, 0.0), else_=ActivityBucket.volume))
+    rows = session.query(
+        ActivityBucket.user_address,
+        ActivityBucket.asset,
+        buy_volume,
+        sell_volume,
+        func.sum(case((ActivityBucket.is_buy, ActivityBucket.notional), else_=0.0)),
+        func.sum(case((ActivityBucket.is_buy, 0.0), else_=ActivityBucket.notional))
+    ).filter(
+        ActivityBucket.minute >= window_start(now_ms, window_ms)
+    ).group_by(ActivityBucket.user_address, ActivityBucket.asset).having(
+        func.abs(buy_volume - sell_volume) > 1e-9
+    ).all()
+
+    processed_positions = []
+    for row in rows:
+        position = summarize_position(*row)
+        if position is not None:
+            processed_positions.append(position)
+    return processed_positions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the per-minute activity_buckets rollup.")
+    parser.add_argument("command", choices=["rebuild", "prune"],
+                        help="rebuild: recompute recent buckets from fills | prune: drop buckets past retention")
+    parser.add_argument("--hours", type=int, default=ACTIVITY_BUCKET_RETENTION_HOURS, help="Hours to rebuild")
+    args = parser.parse_args()
+
+    init_db()
+    with SessionLocal() as session:
+        if args.command == "rebuild":
+            log.info("🧮 Rebuilding 'activity_buckets' from 'fills'...", extra={"hours": args.hours})
+            count = rebuild_buckets(session, hours=args.hours)
+            log.info("🎉 Rebuilt activity buckets", extra={"rows": count})
+        else:
+            log.info("🧹 Pruned activity buckets", extra={"rows": prune_buckets(session)})
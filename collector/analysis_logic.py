@@ -1,17 +1,86 @@
 # collector/analysis_logic.py
 
-import requests
 from collections import defaultdict
-from sqlalchemy import func
-from database import Fill
-from config import API_URL, HEADERS
+from sqlalchemy import func, case, literal_column
+from database import Fill, Position, COMPACT_STORAGE
+from config import POSITIONS_BACKEND
+from market_context import market_context_service
 
-def get_open_positions(session, fills_query=None):
+def summarize_position(user, asset, buy_volume, sell_volume, weighted_buy_sum, weighted_sell_sum):
     """
-    پوزیشن‌های باز را بر اساس یک کوئری fills خاص محاسبه می‌کند.
+    مجموع‌های خرید/فروش یک (تریدر، دارایی) را به دیکشنری پوزیشن باز تبدیل می‌کند.
+    اگر پوزیشن بسته باشد None برمی‌گرداند.
+    """
+    net_volume = buy_volume - sell_volume
+    if abs(net_volume) <= 1e-9:
+        return None
+    if net_volume > 0:
+        side = "Long"
+        avg_price = weighted_buy_sum / buy_volume if buy_volume > 0 else 0
+    else:
+        side = "Short"
+        avg_price = weighted_sell_sum / sell_volume if sell_volume > 0 else 0
+    position_value = abs(net_volume) * avg_price
+    return {
+        "user": user, "asset": asset, "side": side, "net_volume": net_volume,
+        "avg_price": avg_price, "position_value": position_value
+    }
+
+def get_materialized_positions(session):
+    """
+    پوزیشن‌های باز را از جدول positions (که هنگام درج fills به‌روز می‌شود) می‌خواند.
+    """
+    rows = session.query(
+        Position.user_address, Position.asset, Position.buy_volume, Position.sell_volume,
+        Position.weighted_buy_sum, Position.weighted_sell_sum
+    ).filter(func.abs(Position.net_size) > 1e-9).all()
+    processed_positions = []
+    for row in rows:
+        position = summarize_position(*row)
+        if position is not None:
+            processed_positions.append(position)
+    return processed_positions
+
+def _open_positions_sql(fills_query):
+    """
+    تجمیع در خود PostgreSQL: یک GROUP BY روی (user_address, asset) با SUMهای شرطی
+    و فیلتر HAVING روی حجم خالص. فیلترهای fills_query (مثلاً بازه زمانی) حفظ می‌شوند.
+    """
+    buy_volume = func.sum(case((Fill.is_buy, Fill.size), else_=0.0))
+    sell_volume = func.sum(case((Fill.is_buy, 0.0), else_=Fill.size))
+    # در چیدمان compact گروه‌بندی روی شناسه‌های عددی ابعاد انجام می‌شود و JOINهای view حذف می‌شوند
+    user_key, asset_key = (
+        (literal_column("fills.trader_id"), literal_column("fills.asset_id")) if COMPACT_STORAGE
+        else (Fill.user_address, Fill.asset)
+    )
+    rows = fills_query.order_by(None).with_entities(
+        user_key,
+        asset_key,
+        buy_volume,
+        sell_volume,
+        func.sum(case((Fill.is_buy, Fill.size * Fill.price), else_=0.0)),
+        func.sum(case((Fill.is_buy, 0.0), else_=Fill.size * Fill.price))
+    ).group_by(user_key, asset_key).having(
+        func.abs(buy_volume - sell_volume) > 1e-9
+    ).all()
+    if COMPACT_STORAGE:
+        from compact import dimension_cache
+        addresses, assets = dimension_cache.names(
+            fills_query.session, [row[0] for row in rows], [row[1] for row in rows]
+        )
+        rows = [(addresses[row[0]], assets[row[1]], *row[2:]) for row in rows]
+
+    processed_positions = []
+    for row in rows:
+        position = summarize_position(*row)
+        if position is not None:
+            processed_positions.append(position)
+    return processed_positions
+
+def _open_positions_python(fills_query):
+    """
+    تجمیع سطر به سطر در پایتون (پیاده‌سازی مرجع).
     """
-    if fills_query is None:
-        fills_query = session.query(Fill)
     all_fills = fills_query.all()
     if not all_fills:
         return []
@@ -31,25 +100,52 @@ def get_open_positions(session, fills_query=None):
     
     processed_positions = []
     for (user, asset), data in positions_data.items():
-        net_volume = data["buy_volume"] - data["sell_volume"]
-        if abs(net_volume) > 1e-9:
-            if net_volume > 0:
-                side = "Long"
-                avg_price = data["weighted_buy_sum"] / data["buy_volume"] if data["buy_volume"] > 0 else 0
-            else:
-                side = "Short"
-                avg_price = data["weighted_sell_sum"] / data["sell_volume"] if data["sell_volume"] > 0 else 0
-            position_value = abs(net_volume) * avg_price
-            processed_positions.append({
-                "user": user, "asset": asset, "side": side, "net_volume": net_volume, 
-                "avg_price": avg_price, "position_value": position_value
-            })
+        position = summarize_position(
+            user, asset, data["buy_volume"], data["sell_volume"],
+            data["weighted_buy_sum"], data["weighted_sell_sum"]
+        )
+        if position is not None:
+            processed_positions.append(position)
     return processed_positions
 
-def aggregate_sentiment(processed_positions, weights_map=None):
+def _open_positions_numpy(fills_query):
+    """
+    موتور ستونی NumPy برای تحلیل‌های آفلاین (numpy فقط در صورت استفاده import می‌شود).
+    """
+    from columnar import open_positions_numpy
+    return open_positions_numpy(fills_query)
+
+POSITION_BACKENDS = {
+    "sql": _open_positions_sql,
+    "python": _open_positions_python,
+    "numpy": _open_positions_numpy,
+}
+
+def get_open_positions(session, fills_query=None, backend=None):
+    """
+    پوزیشن‌های باز را بر اساس یک کوئری fills خاص محاسبه می‌کند.
+    بدون fills_query و backend، وضعیت کل تاریخچه از جدول positions خوانده می‌شود.
+    backend: "sql"، "python" یا "numpy" (پیش‌فرض: POSITIONS_BACKEND)
+    """
+    if fills_query is None:
+        if backend is None:
+            return get_materialized_positions(session)
+        fills_query = session.query(Fill)
+    backend = backend or POSITIONS_BACKEND
+    if backend not in POSITION_BACKENDS:
+        raise ValueError(f"Unknown positions backend: {backend}")
+    return POSITION_BACKENDS[backend](fills_query)
+
+def aggregate_sentiment(processed_positions, weights_map=None, backend="python"):
     """
     لیست پوزیشن‌های باز را به سنتیمنت تجمیعی تبدیل می‌کند.
+    backend: "python" یا "numpy"
     """
+    if backend == "numpy":
+        from columnar import aggregate_sentiment_numpy
+        return aggregate_sentiment_numpy(processed_positions, weights_map=weights_map)
+    if backend != "python":
+        raise ValueError(f"Unknown sentiment backend: {backend}")
     sentiment_data = defaultdict(lambda: {
         "weighted_long_count": 0.0, "weighted_short_count": 0.0,
         "long_value": 0.0, "short_value": 0.0,
@@ -84,30 +180,10 @@ def aggregate_sentiment(processed_positions, weights_map=None):
 
 def get_market_context():
     """
-    داده‌های متا و تغییرات ۲۴ ساعته را از API HyperLiquid می‌گیرد.
-    """
-    print("Fetching market context from API...")
-    try:
-        payload = {"type": "meta"}
-        response = requests.post(API_URL, headers=HEADERS, json=payload, timeout=10)
-        response.raise_for_status()
-        
-        context_map = {}
-        for asset_data in response.json().get('universe', []):
-            try:
-                asset_name = asset_data.get('name')
-                prev_px_str = asset_data.get('dayNtlVlm', {}).get('24h')
-                mark_px_str = asset_data.get('markPx')
-
-                if asset_name and prev_px_str and mark_px_str:
-                    mark_px = float(mark_px_str)
-                    prev_px = float(prev_px_str)
-                    if prev_px > 0:
-                        change_percent = ((mark_px - prev_px) / prev_px) * 100
-                        context_map[asset_name] = change_percent
-            except (ValueError, TypeError):
-                continue
-        return context_map
-    except Exception as e:
-        print(f"❌ Error fetching market context: {e}")
-        return {}
\ No newline at end of file
+    تغییرات ۲۴ ساعته قیمت هر دارایی را (از کش سرویس market_context) برمی‌گرداند.
+    """
+    return {
+        asset: context["change_percent"]
+        for asset, context in market_context_service.get_all().items()
+        if context.get("change_percent") is not None
+    }
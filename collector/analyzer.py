@@ -1,200 +1,208 @@
 # collector/analyzer.py
 
-import time
 import os
 import asyncio
 from datetime import datetime
 from collections import defaultdict
-from sqlalchemy import func
 
 # وارد کردن توابع از ماژول‌های جدا شده
-from database import SessionLocal, Fill, TrackedTrader
 from analysis_logic import (
-    get_open_positions, 
     aggregate_sentiment, 
     get_market_context
 )
+from market_context import market_context_service
+from snapshot import (
+    AnalysisSnapshot,
+    requires,
+    filter_new_fills
+)
 from reporting import (
     print_sentiment_table, 
+    wait_for_reports,
     OUTPUT_DIR
 )
 from telegram_sender import (
     init_bot, 
-    send_telegram_message
+    escape_markdown_v2 as md,
+    escape_markdown_v2_code as code
 )
+from outbox import emit_signals, deliver_pending
+from logs import get_logger
+from metrics import ANALYSIS_SECONDS, JOB_RUN_SECONDS, dump_metrics
+
+log = get_logger("analyzer")
 
 # -------------------------------------------------
 # تحلیل‌گرهای تصویری (خلاصه)
 # -------------------------------------------------
-def analyze_recent_activity(timestamp_str, theme='light'):
-    session = SessionLocal()
-    try:
-        cutoff_ms = (time.time() - 86400) * 1000 # 24h
-        recent_fills_query = session.query(Fill).filter(Fill.timestamp >= cutoff_ms)
-        positions = get_open_positions(session, fills_query=recent_fills_query)
-        if not positions:
-            print("No recent (24h) fills found.")
-            return
-        sentiment = aggregate_sentiment(positions, weights_map=None)
-        print_sentiment_table(sentiment, "📈 سطح ۲: سنتیمنت فعالیت اخیر (۲۴ ساعت گذشته)",
-                              base_filename="sentiment_recent_24h", timestamp_str=timestamp_str, theme=theme)
-    finally:
-        session.close()
-
-def analyze_weighted_sentiment(timestamp_str, theme='light'):
-    session = SessionLocal()
-    try:
-        positions = get_open_positions(session)
-        if not positions:
-            return
-        traders = session.query(TrackedTrader).all()
-        weights_map = {t.user_address: t.pnl for t in traders if t.pnl and t.pnl > 0}
-        if not weights_map:
-            print("No trader PNL data found. Skipping weighted sentiment.")
-            return
-        sentiment = aggregate_sentiment(positions, weights_map=weights_map)
-        print_sentiment_table(sentiment, "👑 سطح ۳: سنتیمنت وزن‌دهی شده (بر اساس PNL)",
-                              base_filename="sentiment_weighted_pnl", timestamp_str=timestamp_str, theme=theme)
-    finally:
-        session.close()
+@requires("recent_positions_24h")
+def analyze_recent_activity(snapshot, timestamp_str, theme='light'):
+    positions = snapshot["recent_positions_24h"]
+    if not positions:
+        log.info("No recent (24h) fills found.")
+        return
+    sentiment = aggregate_sentiment(positions, weights_map=None)
+    print_sentiment_table(sentiment, "📈 سطح ۲: سنتیمنت فعالیت اخیر (۲۴ ساعت گذشته)",
+                          base_filename="sentiment_recent_24h", timestamp_str=timestamp_str, theme=theme)
+
+@requires("open_positions", "trader_pnl")
+def analyze_weighted_sentiment(snapshot, timestamp_str, theme='light'):
+    positions = snapshot["open_positions"]
+    if not positions:
+        return
+    weights_map = snapshot["trader_pnl"]
+    if not weights_map:
+        log.warning("No trader PNL data found. Skipping weighted sentiment.")
+        return
+    sentiment = aggregate_sentiment(positions, weights_map=weights_map)
+    print_sentiment_table(sentiment, "👑 سطح ۳: سنتیمنت وزن‌دهی شده (بر اساس PNL)",
+                          base_filename="sentiment_weighted_pnl", timestamp_str=timestamp_str, theme=theme)
 
 # -------------------------------------------------
 # تحلیل‌گرهای متنی (سیگنال‌های فوری)
 # -------------------------------------------------
-async def track_new_trades(bot, timestamp_str, theme='light'):
-    session = SessionLocal()
-    try:
-        minutes_ago = 10
-        cutoff_ms = (time.time() - (minutes_ago * 60)) * 1000
-        new_trades_query = session.query(Fill).filter(
-            Fill.timestamp >= cutoff_ms,
-            Fill.direction.like('Open %')
-        ).order_by(Fill.timestamp.desc())
-        new_trades = new_trades_query.all()
-        
-        if not new_trades:
-            print(f"\n--- 🛰️ No new trades found in the last {minutes_ago} minutes ---")
-            return
-
-        print(f"\n--- 🛰️ New Trades Opened in Last {minutes_ago} Minutes ---")
-        
-        for trade in new_trades:
-            trade_time = datetime.fromtimestamp(trade.timestamp / 1000).strftime('%H:%M')
-            position_value = trade.size * trade.price
-            direction_emoji = "🟢" if "Long" in trade.direction else "🔴"
-            
-            message = (
-                f"{direction_emoji} *New Trade Signal* {direction_emoji}\n"
-                f"*Asset:* `{trade.asset}`\n"
-                f"*Direction:* `{trade.direction}`\n"
-                f"*Price:* `${trade.price:,.2f}`\n"
-                f"*Value:* `${position_value:,.2f}`\n"
-                f"*Time:* `{trade_time} (UTC)`\n"
-                f"*Source:* `{trade.user_address}`"
-            )
-            
-            print(f"Sending signal to Telegram: {trade.direction} {trade.asset}")
-            await send_telegram_message(bot, message)
-            await asyncio.sleep(0.5)
-            
-    finally:
-        session.close()
-
-async def analyze_trade_consensus(bot, timestamp_str, theme='light'):
-    session = SessionLocal()
-    try:
-        print(f"\n--- ⚡️ TOP 10: Signal Consensus Analysis (Last 10 Min) ---")
-        market_context = get_market_context()
-        traders = session.query(TrackedTrader).all()
-        trader_pnl_map = {t.user_address: t.pnl for t in traders if t.pnl and t.pnl > 0}
-        if not trader_pnl_map:
-            print("No trader PNL data found. Skipping consensus analysis.")
-            return
-
-        minutes_ago = 10
-        cutoff_ms = (time.time() - (minutes_ago * 60)) * 1000
-        new_trades_query = session.query(Fill).filter(
-            Fill.timestamp >= cutoff_ms,
-            Fill.direction.like('Open %')
+@requires("signal_fills")
+def track_new_trades(snapshot, timestamp_str, theme='light'):
+    signal_fills = snapshot["signal_fills"]
+    new_trades = filter_new_fills(signal_fills, "new_trades")
+
+    signals = []
+    for trade in new_trades:
+        trade_time = datetime.fromtimestamp(trade.timestamp / 1000).strftime('%H:%M')
+        position_value = trade.size * trade.price
+        direction_emoji = "🟢" if "Long" in trade.direction else "🔴"
+
+        message = (
+            f"{direction_emoji} *New Trade Signal* {direction_emoji}\n"
+            f"*Asset:* `{code(trade.asset)}`\n"
+            f"*Direction:* `{code(trade.direction)}`\n"
+            f"*Price:* `${trade.price:,.2f}`\n"
+            f"*Value:* `${position_value:,.2f}`\n"
+            f"*Time:* `{trade_time} (UTC)`\n"
+            f"*Source:* `{code(trade.user_address)}`"
+        )
+        trade_key = trade.tid if trade.tid is not None else f"id{trade.id}"
+        signals.append((f"trade:{trade.user_address}:{trade_key}", message))
+
+    emitted = emit_signals("new_trades", signals, signal_fills["max_fill_id"])
+    if not new_trades:
+        log.info("🛰️ No new trades found since the last run")
+    else:
+        log.info("🛰️ New trade signals queued", extra={"signals": emitted, "fills_checked": len(new_trades)})
+
+@requires("signal_fills", "trader_pnl")
+def analyze_trade_consensus(snapshot, timestamp_str, theme='light'):
+    market_context = get_market_context()
+    trader_pnl_map = snapshot["trader_pnl"]
+    if not trader_pnl_map:
+        log.warning("No trader PNL data found. Skipping consensus analysis.")
+        return
+
+    signal_fills = snapshot["signal_fills"]
+    watermark = signal_fills["watermarks"].get("trade_consensus", 0)
+    new_trades = filter_new_fills(signal_fills, "trade_consensus")
+    if not new_trades:
+        log.info("⚡️ No new trades found since the last run.")
+        emit_signals("trade_consensus", [], signal_fills["max_fill_id"])
+        return
+
+    MIN_TRADE_VALUE = 10000
+    consensus_data = defaultdict(lambda: {"traders": set(), "pnl_backing": 0.0, "total_value": 0.0, "direction": ""})
+
+    for trade in new_trades:
+        trade_value = trade.size * trade.price
+        if trade.user_address in trader_pnl_map and trade_value >= MIN_TRADE_VALUE:
+            key = (trade.asset, "Long" if "Long" in trade.direction else "Short")
+            trader_pnl = trader_pnl_map[trade.user_address]
+            consensus_data[key]["traders"].add(trade.user_address)
+            consensus_data[key]["pnl_backing"] += trader_pnl
+            consensus_data[key]["total_value"] += trade_value
+            consensus_data[key]["direction"] = key[1]
+
+    if not consensus_data:
+        log.info("⚡️ No consensus signals found above min value threshold.")
+        emit_signals("trade_consensus", [], signal_fills["max_fill_id"])
+        return
+
+    processed_consensus = []
+    for (asset, direction), data in consensus_data.items():
+        processed_consensus.append({"asset": asset, "direction": direction, "trader_count": len(data["traders"]),
+                                   "pnl_backing": data["pnl_backing"], "total_value": data["total_value"]})
+    sorted_consensus = sorted(processed_consensus, key=lambda x: x["pnl_backing"], reverse=True)
+
+    signals = []
+    for signal in sorted_consensus[:10]:
+        direction_emoji = "🟢" if "Long" in signal['direction'] else "🔴"
+        change_percent = market_context.get(signal["asset"])
+        change_str = "N/A"
+        if change_percent is not None:
+            change_str = f"{change_percent:+.2f}%"
+
+        message = (
+            f"⚡️ *Consensus Signal* ⚡️\n"
+            f"{direction_emoji} *{md(signal['direction'])}* on *{md(signal['asset'])}*\n\n"
+            f"*Trader Count:* `{signal['trader_count']}`\n"
+            f"*Total Value:* `${signal['total_value']:,.0f}`\n"
+            f"*Smart Money:* `${signal['pnl_backing']:,.0f} (PNL)`\n"
+            f"*24h Change:* `{change_str}`"
         )
-        new_trades = new_trades_query.all()
-        if not new_trades:
-            print(f"No new trades found in the last {minutes_ago} minutes.")
-            return
-
-        MIN_TRADE_VALUE = 10000
-        consensus_data = defaultdict(lambda: {"traders": set(), "pnl_backing": 0.0, "total_value": 0.0, "direction": ""})
-
-        for trade in new_trades:
-            trade_value = trade.size * trade.price
-            if trade.user_address in trader_pnl_map and trade_value >= MIN_TRADE_VALUE:
-                key = (trade.asset, "Long" if "Long" in trade.direction else "Short")
-                trader_pnl = trader_pnl_map[trade.user_address]
-                consensus_data[key]["traders"].add(trade.user_address)
-                consensus_data[key]["pnl_backing"] += trader_pnl
-                consensus_data[key]["total_value"] += trade_value
-                consensus_data[key]["direction"] = key[1]
-
-        if not consensus_data:
-            print("No consensus signals found above min value threshold.")
-            return
-
-        processed_consensus = []
-        for (asset, direction), data in consensus_data.items():
-            processed_consensus.append({"asset": asset, "direction": direction, "trader_count": len(data["traders"]),
-                                       "pnl_backing": data["pnl_backing"], "total_value": data["total_value"]})
-        sorted_consensus = sorted(processed_consensus, key=lambda x: x["pnl_backing"], reverse=True)
-
-        for signal in sorted_consensus[:10]:
-            direction_emoji = "🟢" if "Long" in signal['direction'] else "🔴"
-            change_percent = market_context.get(signal["asset"])
-            change_str = "N/A"
-            if change_percent is not None:
-                change_str = f"{change_percent:+.2f}%"
-
-            message = (
-                f"⚡️ *Consensus Signal* ⚡️\n"
-                f"{direction_emoji} *{signal['direction']}* on *{signal['asset']}*\n\n"
-                f"*Trader Count:* `{signal['trader_count']}`\n"
-                f"*Total Value:* `${signal['total_value']:,.0f}`\n"
-                f"*Smart Money:* `${signal['pnl_backing']:,.0f} (PNL)`\n"
-                f"*24h Change:* `{change_str}`"
-            )
-
-            print(f"Sending consensus signal to Telegram: {signal['direction']} {signal['asset']}")
-            await send_telegram_message(bot, message)
-            await asyncio.sleep(0.5)
-            
-    finally:
-        session.close()
+        # کلید: بازه fill.id بررسی شده (watermark تا max_fill_id)؛ اجرای دوباره همین بازه سیگنال تکراری نمی‌سازد
+        dedup_key = f"consensus:{signal['asset']}:{signal['direction']}:{watermark}-{signal_fills['max_fill_id']}"
+        signals.append((dedup_key, message))
+
+    emitted = emit_signals("trade_consensus", signals, signal_fills["max_fill_id"])
+    log.info("⚡️ Consensus signals queued", extra={"signals": emitted, "candidates": len(sorted_consensus)})
 
 # -------------------------------------------------
 # تابع Main (ارکستراتور)
 # -------------------------------------------------
-async def main():
-    print("Starting automated analysis...")
+async def main(bot_instance=None):
+    """
+    یک دور کامل تحلیل. scheduler.py نمونه Bot را یک بار می‌سازد و به هر دور پاس می‌دهد.
+    """
+    log.info("Starting automated analysis...")
     timestamp_str = datetime.now().strftime('%Y-%m-%d_%H-%M')
     try:
         os.makedirs(OUTPUT_DIR, exist_ok=True)
     except Exception as e:
-        print(f"❌ Error creating output directory '{OUTPUT_DIR}': {e}")
+        log.error("❌ Error creating output directory", extra={"path": OUTPUT_DIR, "error": str(e)})
         return
 
-    # ۱. ساخت نمونه Bot با تنظیمات پروکسی
-    bot_instance = init_bot()
+    # ۱. ساخت نمونه Bot با تنظیمات پروکسی (اگر از بیرون داده نشده باشد)
+    if bot_instance is None:
+        bot_instance = init_bot()
 
-    # ۲. اجرای تحلیل‌های متنی (ارسال به تلگرام)
-    if bot_instance:
-        await analyze_trade_consensus(bot_instance, timestamp_str=timestamp_str, theme='dark')
-        await track_new_trades(bot_instance, timestamp_str=timestamp_str, theme='dark')
-    else:
-        print("Skipping Telegram send functions as bot is not configured.")
+    telegram_analyses = [analyze_trade_consensus, track_new_trades]
+    image_analyses = [analyze_weighted_sentiment, analyze_recent_activity]
+    if not bot_instance:
+        log.warning("Skipping Telegram send functions as bot is not configured.")
+        telegram_analyses = []
+
+    # به‌روزرسانی کش داده‌های بازار در پس‌زمینه، همزمان با بارگذاری داده‌ها
+    market_context_service.get_all()
 
-    # ۳. اجرای تحلیل‌های تصویری (ذخیره در فایل)
-    analyze_weighted_sentiment(timestamp_str=timestamp_str, theme='dark')
-    analyze_recent_activity(timestamp_str=timestamp_str, theme='dark')
+    # ۲. بارگذاری یک‌باره داده‌های مورد نیاز همه تحلیل‌ها (یک تراکنش سازگار)
+    snapshot = AnalysisSnapshot().load(AnalysisSnapshot.required_by(telegram_analyses + image_analyses))
+
+    # ۳. اجرای تحلیل‌های متنی؛ سیگنال‌ها در outbox ثبت و سپس (با تلاش مجدد) ارسال می‌شوند
+    for analysis in telegram_analyses:
+        _run_analysis(analysis, snapshot, timestamp_str)
+    if telegram_analyses:
+        await deliver_pending(bot_instance)
+
+    # ۴. اجرای تحلیل‌های تصویری (ذخیره در فایل در thread pool گزارش‌ها)
+    for analysis in image_analyses:
+        _run_analysis(analysis, snapshot, timestamp_str)
+    wait_for_reports()
     
-    print(f"✅ All analyses complete for timestamp {timestamp_str}.")
+    log.info("✅ All analyses complete", extra={"run": timestamp_str})
+
+def _run_analysis(analysis, snapshot, timestamp_str):
+    with ANALYSIS_SECONDS.time(analysis=analysis.__name__) as timer:
+        analysis(snapshot, timestamp_str=timestamp_str, theme='dark')
+    log.info("Analysis finished", extra={"analysis": analysis.__name__, "seconds": round(timer.elapsed, 3)})
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    with JOB_RUN_SECONDS.time(job="analyzer"):
+        asyncio.run(main())
+    dump_metrics()
\ No newline at end of file
@@ -0,0 +1,314 @@
+# collector/benchmark.py
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from config import DATABASE_URL, INGEST_BATCH_SIZE
+from database import Base, Fill, init_db, is_sqlite, engine_url
+from ingest import FillIngestBuffer
+from partitions import ensure_partitions
+from analysis_logic import get_open_positions, aggregate_sentiment
+from synthetic import SyntheticFillGenerator
+import reporting
+
+# اجرای ۱ میلیونی روی SQLite حدود ۱۱ دقیقه طول می‌کشد؛ ۱۰ میلیون (چند ساعت) فقط با --sizes
+DEFAULT_SIZES = "10000,100000,1000000"
+DEFAULT_DATABASE_URL = "sqlite:///benchmark.db"
+DUPLICATE_SAMPLE = 100_000
+# محدودیت تعداد پارامتر هر دستور در SQLite
+SQLITE_BATCH_SIZE = 2000
+
+
+class StageTimer:
+    """
+    زمان و بیشترین حافظه تخصیص یافته (tracemalloc) یک مرحله را اندازه می‌گیرد.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    def run(self, name, items, function, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            # خروجی‌های چاپی مسیرهای اصلی (مثلاً هر batch درج) در زمان‌سنجی دخالت نکنند
+            with redirect_stdout(io.StringIO()):
+                result = function(*args, **kwargs)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        finally:
+            if self.trace_memory:
+                tracemalloc.stop()
+        self.record(name, elapsed, items, peak)
+        return result
+
+    def record(self, name, seconds, items, peak_bytes=None, **extra):
+        stage = {
+            "seconds": round(seconds, 4),
+            "items": items,
+            "throughput_per_sec": round(items / seconds, 1) if seconds > 0 else None,
+            "peak_memory_mb": round(peak_bytes / 1024 / 1024, 2) if peak_bytes is not None else None,
+        }
+        stage.update(extra)
+        self.stages[name] = stage
+        print(f"   ⏱️  {name:<32} {stage['seconds']:>10.3f}s  {stage['throughput_per_sec'] or 0:>14,.0f}/s  "
+              f"peak={stage['peak_memory_mb']} MB")
+
+    def skip(self, name, reason):
+        self.stages[name] = {"skipped": reason}
+        print(f"   ⏭️  {name:<32} skipped ({reason})")
+
+
+def _reset_schema(bench_engine, session_factory, start_ms):
+    Base.metadata.drop_all(bind=bench_engine)
+    init_db(bind=bench_engine)
+    if not is_sqlite(bench_engine):
+        with session_factory() as session:
+            ensure_partitions(session, start_ms=start_ms)
+
+
+def _ingest(session, generator, fill_count, batch_size):
+    """
+    fillهای مصنوعی را از همان مسیر collector (FillIngestBuffer) درج می‌کند.
+    زمان تولید داده جدا شمرده می‌شود تا فقط درج اندازه‌گیری شود.
+    """
+    buffer = FillIngestBuffer(session, batch_size=batch_size)
+    generation_seconds = 0.0
+    batches = generator.iter_batches(fill_count)
+    while True:
+        started = time.perf_counter()
+        batch = next(batches, None)
+        generation_seconds += time.perf_counter() - started
+        if batch is None:
+            break
+        for address, fills in batch.items():
+            buffer.add(address, fills)
+    buffer.flush()
+    return buffer.total_inserted, generation_seconds
+
+
+def _position_key_map(positions):
+    return {(p["user"], p["asset"]): (p["side"], p["net_volume"], p["avg_price"]) for p in positions}
+
+
+def _same_position(first, second):
+    # ترتیب جمع اعشاری در backendها فرق دارد؛ مقایسه با خطای نسبی
+    if first is None or second is None:
+        return first is second
+    return first[0] == second[0] and all(
+        math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9) for a, b in zip(first[1:], second[1:])
+    )
+
+
+def _parity(reference, candidate):
+    """
+    تعداد (تریدر، دارایی)هایی که نتیجه دو backend در آن‌ها متفاوت است.
+    """
+    keys = set(reference) | set(candidate)
+    return sum(1 for key in keys if not _same_position(reference.get(key), candidate.get(key)))
+
+
+def _numpy_available():
+    try:
+        import numpy  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def run_size(fill_count, args, bench_engine, session_factory):
+    print(f"\n--- 🏁 {fill_count:,} fills ---")
+    timer = StageTimer(trace_memory=not args.no_tracemalloc)
+    end_ms = int(time.time() * 1000)
+
+    def make_generator():
+        return SyntheticFillGenerator(
+            traders=args.traders, assets=args.assets, fills_per_day=args.fills_per_day,
+            open_ratio=args.open_ratio, seed=args.seed, end_ms=end_ms
+        )
+
+    start_ms = end_ms - int(fill_count * 86_400_000 / max(args.fills_per_day, 1)) - 86_400_000
+    _reset_schema(bench_engine, session_factory, start_ms)
+    batch_size = min(args.batch_size, SQLITE_BATCH_SIZE) if is_sqlite(bench_engine) else args.batch_size
+
+    # ۱. درج (dedup + positions) از مسیر collector
+    # (timer.run استفاده نمی‌شود چون زمان تولید داده باید کم شود)
+    peak = None
+    with session_factory() as session:
+        if timer.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            inserted, generation_seconds = _ingest(session, make_generator(), fill_count, batch_size)
+        elapsed = time.perf_counter() - started - generation_seconds
+        if timer.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    timer.record("ingest", elapsed, fill_count, peak,
+                 inserted=inserted, generation_seconds=round(generation_seconds, 4))
+
+    # ۲. درج دوباره همان fillها: فقط مسیر تشخیص تکراری (ON CONFLICT DO NOTHING)
+    duplicate_count = min(fill_count, DUPLICATE_SAMPLE)
+    with session_factory() as session:
+        duplicates, _ = timer.run(
+            "ingest_duplicates", duplicate_count, _ingest, session, make_generator(), duplicate_count, batch_size
+        )
+    timer.stages["ingest_duplicates"]["inserted"] = duplicates
+
+    # ۳. محاسبه پوزیشن‌های باز با هر backend
+    backend_results = {}
+    with session_factory() as session:
+        backend_results["materialized"] = timer.run(
+            "open_positions_materialized", fill_count, get_open_positions, session
+        )
+        for backend in args.backends:
+            stage = f"open_positions_{backend}"
+            if backend == "numpy" and not _numpy_available():
+                timer.skip(stage, "numpy not installed")
+                continue
+            if backend == "python" and fill_count > args.max_python_fills:
+                timer.skip(stage, f"more than {args.max_python_fills:,} fills")
+                continue
+            backend_results[backend] = timer.run(
+                stage, fill_count, get_open_positions, session, fills_query=session.query(Fill), backend=backend
+            )
+
+    reference = _position_key_map(backend_results["materialized"])
+    parity = {name: _parity(reference, _position_key_map(result)) for name, result in backend_results.items()}
+    if any(parity.values()):
+        print(f"   ⚠️ Backend mismatch (positions differing from materialized): {parity}")
+
+    # ۴. سنتیمنت وزن‌دار
+    positions = backend_results["materialized"]
+    weights = random.Random(args.seed)
+    weights_map = {p["user"]: weights.uniform(1e4, 1e7) for p in positions}
+    sentiment = timer.run(
+        "aggregate_sentiment_python", len(positions), aggregate_sentiment, positions, weights_map=weights_map
+    )
+    if _numpy_available():
+        timer.run("aggregate_sentiment_numpy", len(positions), aggregate_sentiment,
+                  positions, weights_map=weights_map, backend="numpy")
+    else:
+        timer.skip("aggregate_sentiment_numpy", "numpy not installed")
+
+    # ۵. ساخت جدول کنسول، عکس و CSV
+    with tempfile.TemporaryDirectory() as output_dir:
+        previous_dir = reporting.OUTPUT_DIR
+        reporting.OUTPUT_DIR = output_dir
+        try:
+            timer.run("print_sentiment_table", len(sentiment), reporting.print_sentiment_table, sentiment,
+                      "benchmark", base_filename="benchmark", timestamp_str=str(fill_count), wait=True)
+        finally:
+            reporting.OUTPUT_DIR = previous_dir
+
+    return {"fills": fill_count, "open_positions": len(positions), "parity_mismatches": parity, "stages": timer.stages}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    """
+    throughput هر مرحله را با یک فایل نتیجه قبلی مقایسه می‌کند (نسبت > ۱ یعنی سریع‌تر شده).
+    """
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    baseline_runs = {run["fills"]: run for run in baseline.get("runs", [])}
+    print(f"\n--- 📊 Compared with {baseline_path} ({baseline.get('git_revision')}) ---")
+    for run in current["runs"]:
+        previous = baseline_runs.get(run["fills"])
+        if previous is None:
+            continue
+        for stage, result in run["stages"].items():
+            old = previous["stages"].get(stage, {}).get("throughput_per_sec")
+            new = result.get("throughput_per_sec")
+            if old and new:
+                ratio = new / old
+                marker = "🔻" if ratio < 0.9 else ("🔺" if ratio > 1.1 else "  ")
+                print(f"{marker} {run['fills']:>12,} {stage:<32} {ratio:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest, positions, sentiment and reporting on synthetic fills.")
+    parser.add_argument("--database-url", default=os.getenv("BENCHMARK_DATABASE_URL", DEFAULT_DATABASE_URL),
+                        help="Scratch database (tables are dropped!). SQLite or PostgreSQL.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated fill counts (default: {DEFAULT_SIZES}). "
+                             "10M is opt-in (hours), e.g. --sizes 10000000 --no-tracemalloc")
+    parser.add_argument("--traders", type=int, default=500)
+    parser.add_argument("--assets", type=int, default=30)
+    parser.add_argument("--fills-per-day", type=int, default=50000)
+    parser.add_argument("--open-ratio", type=float, default=0.6)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--backends", default="sql,python,numpy", help="Positions backends to benchmark")
+    parser.add_argument("--max-python-fills", type=int, default=1_000_000,
+                        help="Skip the row-by-row python backend above this many fills")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Do not trace memory (cleaner timings)")
+    parser.add_argument("--output", help="JSON result file (default: results/benchmarks/benchmark_<time>.json)")
+    parser.add_argument("--compare", metavar="BASELINE_JSON", help="Compare throughput with a previous result file")
+    args = parser.parse_args()
+
+    if args.database_url == DATABASE_URL:
+        parser.error("Refusing to benchmark against DATABASE_URL: the benchmark drops all tables.")
+    # لاگ‌های هر دسته درج روی stdout اصلی نوشته می‌شوند (redirect_stdout آن‌ها را نمی‌گیرد) و زمان‌سنجی را خراب می‌کنند
+    logging.disable(logging.INFO)
+    args.backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+
+    bench_engine = create_engine(engine_url(args.database_url))
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=bench_engine)
+
+    result = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": bench_engine.dialect.name,
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "database_url")},
+        "runs": [],
+    }
+    for fill_count in sizes:
+        result["runs"].append(run_size(fill_count, args, bench_engine, session_factory))
+    # حافظه کل پروسه (شامل کتابخانه‌های C)، برحسب مگابایت
+    result["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    output = args.output or os.path.join(
+        reporting.OUTPUT_DIR, "benchmarks", f"benchmark_{datetime.now():%Y-%m-%d_%H-%M}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(result, output_file, indent=2)
+    print(f"\n💾 Benchmark results saved to {output}")
+
+    if args.compare:
+        compare(result, args.compare)
+    mismatches = sum(sum(run["parity_mismatches"].values()) for run in result["runs"])
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
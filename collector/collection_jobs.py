@@ -0,0 +1,236 @@
+# collector/collection_jobs.py
+
+import os
+import time
+import socket
+from contextlib import contextmanager
+from sqlalchemy import select, update, bindparam, literal, or_, text, func
+from config import (
+    COLLECTOR_WORKER_ID,
+    COLLECTOR_LEASE_SECONDS,
+    COLLECTOR_MIN_POLL_SECONDS,
+    COLLECTOR_MAX_POLL_SECONDS,
+    COLLECTOR_ACTIVITY_WINDOW_HOURS,
+    COLLECTOR_REQUEST_BUDGET_PER_HOUR,
+    COLLECTOR_FAILURE_BACKOFF_MAX_SECONDS,
+    ACTIVITY_BUCKET_RETENTION_HOURS
+)
+from database import CollectionJob, TrackedTrader, TraderCursor, ActivityBucket, is_sqlite, upsert_insert
+from metrics import COLLECTION_JOBS, COLLECTOR_POLL_DEMAND, COLLECTOR_POLL_SCALE
+
+# کارهایی که تا این مقدار بعد از زمان برداشتن موعدشان می‌رسد هم برداشته می‌شوند
+DUE_SLACK_MS = 5000
+# کلید pg_advisory_lock نگهداری دوره‌ای (فقط یکی از workerها در هر نوبت انجامش می‌دهد)
+MAINTENANCE_LOCK_KEY = 720_260_002
+# تریدر بدون fill در بازه فعالیت: فاصله دریافت = (زمان از آخرین fill) / این مقدار
+IDLE_BACKOFF_DIVISOR = 4
+
+
+def default_worker_id():
+    return COLLECTOR_WORKER_ID or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def sync_jobs(session, now_ms=None):
+    """
+    برای هر تریدر tracked_traders یک کار می‌سازد (کار جدید بلافاصله آماده است)
+    و کار تریدرهایی که دیگر دنبال نمی‌شوند را حذف می‌کند. تعداد کارها را برمی‌گرداند.
+    """
+    now_ms = now_ms if now_ms is not None else _now_ms()
+    tracked = select(TrackedTrader.user_address, literal(now_ms), literal(0)).where(
+        TrackedTrader.user_address.isnot(None)
+    )
+    session.execute(
+        upsert_insert(session, CollectionJob).from_select(["user_address", "next_run_at", "failures"], tracked)
+        .on_conflict_do_nothing(index_elements=[CollectionJob.user_address])
+    )
+    session.query(CollectionJob).filter(
+        ~CollectionJob.user_address.in_(select(TrackedTrader.user_address))
+    ).delete(synchronize_session=False)
+    session.commit()
+    return session.query(CollectionJob).count()
+
+
+def mark_all_due(session, now_ms=None):
+    """
+    همه کارها را آماده می‌کند (حالت backfill که باید همه تریدرها را یک بار دریافت کند).
+    """
+    session.query(CollectionJob).update({"next_run_at": now_ms if now_ms is not None else _now_ms()})
+    session.commit()
+
+
+def claim_jobs(session, worker_id, limit, now_ms=None, lease_seconds=COLLECTOR_LEASE_SECONDS):
+    """
+    حداکثر `limit` کار آماده (زودترین موعد اول) را برای این worker lease می‌کند و آدرس‌ها را برمی‌گرداند.
+    ردیف‌هایی که worker دیگری همزمان قفل کرده با SKIP LOCKED رد می‌شوند؛
+    کار با lease منقضی شده (worker از کار افتاده) دوباره قابل برداشتن است.
+    """
+    now_ms = now_ms if now_ms is not None else _now_ms()
+    candidates = select(CollectionJob.user_address).where(
+        CollectionJob.next_run_at <= now_ms + DUE_SLACK_MS,
+        or_(CollectionJob.lease_expires_at.is_(None), CollectionJob.lease_expires_at < now_ms)
+    ).order_by(CollectionJob.next_run_at).limit(limit).with_for_update(skip_locked=True)
+    addresses = session.execute(candidates).scalars().all()
+    if addresses:
+        session.execute(
+            update(CollectionJob).where(CollectionJob.user_address.in_(addresses)).values(
+                lease_owner=worker_id, lease_expires_at=now_ms + lease_seconds * 1000
+            )
+        )
+    session.commit()
+    COLLECTION_JOBS.inc(len(addresses), result="claimed")
+    return addresses
+
+
+def failure_backoff_seconds(failures, max_seconds=COLLECTOR_FAILURE_BACKOFF_MAX_SECONDS):
+    """
+    کمترین فاصله تلاش بعدی (ثانیه) پس از `failures` شکست پشت سر هم: نمایی از COLLECTOR_MIN_POLL_SECONDS
+    و محدود به max_seconds، تا آدرس خراب یا API در حال خطا هر دقیقه درخواست نگیرد.
+    """
+    if failures <= 0:
+        return 0
+    return min(max_seconds, COLLECTOR_MIN_POLL_SECONDS * 2 ** min(failures - 1, 32))
+
+
+def complete_jobs(session, worker_id, next_runs, failed=(), now_ms=None):
+    """
+    lease کارهای این worker را آزاد و نوبت بعدی هر تریدر را ثبت می‌کند.
+    next_runs: {آدرس: زمان نوبت بعدی (ms)} | failed: آدرس‌هایی که دریافتشان ناموفق بود.
+    نوبت بعدی آدرس ناموفق دست‌کم به اندازه failure_backoff_seconds(شکست‌های پشت سر هم) عقب می‌افتد.
+    اگر lease در این فاصله منقضی و توسط worker دیگری برداشته شده باشد، ردیف تغییر نمی‌کند.
+    """
+    if not next_runs:
+        return
+    now_ms = now_ms if now_ms is not None else _now_ms()
+    jobs = CollectionJob.__table__
+    failed = set(failed) & set(next_runs)
+    params = [
+        {"address": address, "next_run": next_run, "failures": 0}
+        for address, next_run in next_runs.items() if address not in failed
+    ]
+    if failed:
+        previous_failures = session.execute(
+            select(jobs.c.user_address, jobs.c.failures).where(
+                jobs.c.user_address.in_(failed), jobs.c.lease_owner == worker_id
+            )
+        ).all()
+        for address, failures in previous_failures:
+            failures += 1
+            params.append({
+                "address": address, "failures": failures,
+                "next_run": max(next_runs[address], now_ms + failure_backoff_seconds(failures) * 1000),
+            })
+    if params:
+        session.connection().execute(
+            update(jobs).where(
+                jobs.c.user_address == bindparam("address"), jobs.c.lease_owner == worker_id
+            ).values(
+                next_run_at=bindparam("next_run"), failures=bindparam("failures"), last_run_at=now_ms,
+                lease_owner=None, lease_expires_at=None,
+            ),
+            params
+        )
+    session.commit()
+    COLLECTION_JOBS.inc(len(next_runs) - len(failed), result="ok")
+    COLLECTION_JOBS.inc(len(failed), result="failed")
+
+
+def release_jobs(session, worker_id):
+    """
+    lease همه کارهای این worker را آزاد می‌کند (هنگام توقف) تا بقیه بدون انتظار برای انقضا برشان دارند.
+    """
+    released = session.query(CollectionJob).filter(CollectionJob.lease_owner == worker_id).update(
+        {"lease_owner": None, "lease_expires_at": None}, synchronize_session=False
+    )
+    session.commit()
+    return released
+
+
+# -------------------------------------------------
+# 🔽 (جدید) زمان‌بندی تطبیقی: فاصله دریافت هر تریدر از فعالیت اخیرش 🔽
+# -------------------------------------------------
+def poll_interval(fill_count, last_fill_ms, now_ms, window_hours=COLLECTOR_ACTIVITY_WINDOW_HOURS):
+    """
+    فاصله دریافت بعدی یک تریدر (ثانیه): کمترینِ میانگین فاصله fillهایش در بازه فعالیت
+    و کسری از مدتی که از آخرین fill گذشته، محدود به [COLLECTOR_MIN_POLL_SECONDS, COLLECTOR_MAX_POLL_SECONDS].
+    تریدری که تازه معامله کرده یا مدام معامله می‌کند هر دقیقه و تریدر خاموش هر ساعت دریافت می‌شود.
+    """
+    if last_fill_ms is None:
+        return COLLECTOR_MAX_POLL_SECONDS
+    mean_gap = window_hours * 3600 / fill_count if fill_count else float("inf")
+    idle_backoff = max(now_ms - last_fill_ms, 0) / 1000 / IDLE_BACKOFF_DIVISOR
+    return max(COLLECTOR_MIN_POLL_SECONDS, min(mean_gap, idle_backoff, COLLECTOR_MAX_POLL_SECONDS))
+
+
+def poll_intervals(session, now_ms=None, addresses=None):
+    """
+    {آدرس: فاصله دریافت (ثانیه)} برای کارهای صف (یا فقط addresses)،
+    از مجموع fill_count در bucketهای فعالیت و cursor هر تریدر.
+    """
+    now_ms = now_ms if now_ms is not None else _now_ms()
+    window_hours = min(COLLECTOR_ACTIVITY_WINDOW_HOURS, ACTIVITY_BUCKET_RETENTION_HOURS)
+    recent = select(
+        ActivityBucket.user_address, func.sum(ActivityBucket.fill_count).label("fill_count")
+    ).where(ActivityBucket.minute >= now_ms - window_hours * 3600 * 1000)
+    query = session.query(CollectionJob.user_address)
+    if addresses is not None:
+        recent = recent.where(ActivityBucket.user_address.in_(addresses))
+        query = query.filter(CollectionJob.user_address.in_(addresses))
+    recent = recent.group_by(ActivityBucket.user_address).subquery()
+    rows = query.add_columns(recent.c.fill_count, TraderCursor.last_fill_time).outerjoin(
+        recent, recent.c.user_address == CollectionJob.user_address
+    ).outerjoin(TraderCursor, TraderCursor.user_address == CollectionJob.user_address).all()
+    return {
+        address: poll_interval(fill_count or 0, last_fill_ms, now_ms, window_hours)
+        for address, fill_count, last_fill_ms in rows
+    }
+
+
+class PollSchedule:
+    """
+    نوبت بعدی تریدرها در یک دور دریافت. ضریب بودجه یک بار برای کل صف حساب می‌شود:
+    اگر مجموع دریافت‌های ساعتی همه تریدرها از COLLECTOR_REQUEST_BUDGET_PER_HOUR بیشتر باشد
+    همه فاصله‌ها (حتی بیش از COLLECTOR_MAX_POLL_SECONDS) به یک نسبت بزرگ می‌شوند.
+    """
+
+    def __init__(self, session, now_ms=None, budget_per_hour=COLLECTOR_REQUEST_BUDGET_PER_HOUR):
+        self.session = session
+        demand = sum(3600 / interval for interval in poll_intervals(session, now_ms).values())
+        self.scale = max(1.0, demand / budget_per_hour) if budget_per_hour > 0 else 1.0
+        COLLECTOR_POLL_DEMAND.set(round(demand, 1))
+        COLLECTOR_POLL_SCALE.set(round(self.scale, 3))
+
+    def next_runs(self, addresses, now_ms=None):
+        """
+        {آدرس: زمان نوبت بعدی (ms)}؛ پس از ذخیره fillهای دریافت شده صدا زده می‌شود تا فعالیت تازه هم حساب شود.
+        """
+        now_ms = now_ms if now_ms is not None else _now_ms()
+        intervals = poll_intervals(self.session, now_ms, addresses)
+        return {
+            address: now_ms + int(intervals.get(address, COLLECTOR_MIN_POLL_SECONDS) * self.scale * 1000)
+            for address in addresses
+        }
+
+
+@contextmanager
+def maintenance_lock(session):
+    """
+    True اگر این worker قفل نگهداری دوره‌ای را گرفت.
+    قفل روی یک اتصال جدا گرفته می‌شود چون session بین commitها اتصالش را به pool برمی‌گرداند.
+    """
+    if is_sqlite(session):
+        yield True
+        return
+    with session.get_bind().connect() as lock_connection:
+        acquired = lock_connection.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}
+        ).scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+            lock_connection.commit()
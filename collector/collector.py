@@ -1,137 +1,495 @@
 # collector/collector.py
 
+import time
+import signal
+import asyncio
+import argparse
 import requests
-import time # 🔽 (جدید) ماژول زمان را برای تاخیر اضافه می‌کنیم
+import httpx
 # 🔽 (جدید) خطاهای خاص requests را برای مدیریت بهتر وارد می‌کنیم
-from requests.exceptions import HTTPError, RequestException
-from config import API_URL, HEADERS
-from database import Base, engine, SessionLocal, Fill, TrackedTrader
-from sqlalchemy.dialects.postgresql import insert
+from requests.exceptions import RequestException
+from config import (
+    API_URL,
+    HEADERS,
+    COLLECTOR_FETCH_MODE,
+    COLLECTOR_CONCURRENCY,
+    API_RATE_LIMIT_PER_SEC,
+    API_RATE_LIMIT_BURST,
+    API_MAX_RETRIES,
+    COLLECTOR_INITIAL_LOOKBACK_HOURS,
+    COLLECTOR_INTERVAL_SECONDS,
+    COLLECTOR_CLAIM_BATCH,
+    COLLECTOR_WORKER_POLL_SECONDS,
+    FILLS_PAGE_SIZE
+)
+from database import init_db, SessionLocal, Fill, TraderCursor, CollectionJob
+from collection_jobs import (
+    default_worker_id, sync_jobs, mark_all_due, claim_jobs, complete_jobs, release_jobs, maintenance_lock,
+    PollSchedule
+)
+from ingest import FillIngestBuffer
+from positions import ensure_positions_built
+from activity import ensure_buckets_built, prune_buckets
+from partitions import maintain_partitions
+from rate_limiter import TokenBucket
+from logs import get_logger
+from metrics import (
+    API_REQUEST_SECONDS,
+    API_REQUESTS,
+    API_RETRIES,
+    TRADER_FETCH_SECONDS,
+    FILLS_FETCHED,
+    DB_QUERY_SECONDS,
+    JOB_RUN_SECONDS,
+    dump_metrics,
+    start_metrics_exporters
+)
+from sqlalchemy import func
+
+log = get_logger("collector")
+
+# -------------------------------------------------
+# 🔽 (جدید) محدودکننده نرخ مشترک به جای sleep ثابت 🔽
+# -------------------------------------------------
+# همه درخواست‌ها (sync و async) از یک سطل توکن مشترک استفاده می‌کنند
+rate_limiter = TokenBucket(API_RATE_LIMIT_PER_SEC, API_RATE_LIMIT_BURST, name="hyperliquid_api")
+
+# اتصال keep-alive برای حالت sync (به جای ساخت اتصال جدید در هر درخواست)
+http_session = requests.Session()
+http_session.headers.update(HEADERS)
+
+
+def _retry_after_seconds(retry_after_header, attempt):
+    """
+    مدت انتظار پس از خطای 429: هدر Retry-After در صورت وجود، در غیر این صورت backoff نمایی.
+    """
+    if retry_after_header:
+        try:
+            return max(float(retry_after_header), 0.0)
+        except ValueError:
+            pass
+    return min(2 ** attempt, 30)
+
+
+def _log_request_error(request_type, user_address, error):
+    API_REQUESTS.inc(request_type=request_type, status="network_error")
+    log.error("❌ Request error fetching fills", extra={"user": user_address, "error": str(error)})
+
+
+def _log_retries_exhausted(request_type, user_address):
+    API_REQUESTS.inc(request_type=request_type, status="gave_up")
+    log.error("❌ Rate limit retries exhausted. Skipping trader.",
+              extra={"user": user_address, "attempts": API_MAX_RETRIES})
+
+
+def _handle_response(request_type, user_address, attempt, status_code, headers, read_json):
+    """
+    پاسخ یک درخواست (sync یا async) را بررسی می‌کند و (نتیجه، آیا تلاش مجدد لازم است) برمی‌گرداند.
+    """
+    # بررسی دقیق خطای 429 (Too Many Requests)
+    if status_code == 429:
+        delay = _retry_after_seconds(headers.get("Retry-After"), attempt)
+        API_REQUESTS.inc(request_type=request_type, status="429")
+        API_RETRIES.inc(reason="rate_limited")
+        log.warning("⚠️ Rate limit hit. Backing off.", extra={
+            "user": user_address, "delay_seconds": round(delay, 1), "attempt": attempt + 1,
+            "max_attempts": API_MAX_RETRIES
+        })
+        rate_limiter.penalize(delay)
+        return None, True
+
+    if status_code >= 400:
+        # یک خطای HTTP دیگر رخ داده (مثل 404, 500)
+        API_REQUESTS.inc(request_type=request_type, status="http_error")
+        log.error("❌ HTTP error fetching fills", extra={"user": user_address, "status_code": status_code})
+        return None, False
+
+    try:
+        data = read_json()
+    except ValueError as e:
+        API_REQUESTS.inc(request_type=request_type, status="invalid_json")
+        log.error("❌ Invalid JSON in fills response", extra={"user": user_address, "error": str(e)})
+        return None, False
+    API_REQUESTS.inc(request_type=request_type, status="ok")
+    return data, False
+
 
 # -------------------------------------------------
 # 🔽 (بازنویسی شده) تابع دریافت اطلاعات با مکانیزم تلاش مجدد 🔽
 # -------------------------------------------------
-def get_user_fills(user_address):
+def post_info(payload, user_address):
     """
-    اطلاعات معاملات کاربر را با مکانیزم تلاش مجدد برای خطای 429 (Rate Limit) دریافت می‌کند.
+    یک درخواست به info API را با مکانیزم تلاش مجدد برای خطای 429 (Rate Limit) ارسال می‌کند.
     """
-    payload = {"type": "userFills", "user": user_address}
-    
-    MAX_RETRIES = 3
-    RETRY_DELAY_SECONDS = 5 # 5 ثانیه صبر پس از خطای 429
-    
-    for attempt in range(MAX_RETRIES):
+    request_type = payload.get("type")
+    for attempt in range(API_MAX_RETRIES):
+        rate_limiter.acquire()
         try:
-            response = requests.post(API_URL, headers=HEADERS, json=payload, timeout=30)
-            response.raise_for_status() # این دستور برای خطاهای 4xx/5xx خطا صادر می‌کند
-            return response.json()
-        
-        except HTTPError as e:
-            # بررسی دقیق خطای 429 (Too Many Requests)
-            if e.response.status_code == 429:
-                if attempt < MAX_RETRIES - 1:
-                    print(f"⚠️ Rate limit hit for {user_address}. Retrying in {RETRY_DELAY_SECONDS}s... (Attempt {attempt + 1}/{MAX_RETRIES})")
-                    time.sleep(RETRY_DELAY_SECONDS) # صبر کردن قبل از تلاش مجدد
-                else:
-                    print(f"❌ Rate limit failed for {user_address} after {MAX_RETRIES} attempts. Skipping.")
-                    return None # پس از 3 بار تلاش، از این کاربر صرف نظر کن
-            else:
-                # یک خطای HTTP دیگر رخ داده (مثل 404, 500)
-                print(f"❌ HTTP Error fetching fills for {user_address}: {e}")
-                return None
-        
+            with API_REQUEST_SECONDS.time(request_type=request_type):
+                response = http_session.post(API_URL, json=payload, timeout=30)
         except RequestException as e:
             # خطای کلی‌تر (مثل قطع اتصال، تایم‌اوت)
-            print(f"❌ Request Error fetching fills for {user_address}: {e}")
+            _log_request_error(request_type, user_address, e)
             return None # در این موارد تلاش مجدد نکن
+        return_value, retry = _handle_response(
+            request_type, user_address, attempt, response.status_code, response.headers, response.json
+        )
+        if not retry:
+            return return_value
+
+    _log_retries_exhausted(request_type, user_address)
+    return None
+
+
+async def post_info_async(client, payload, user_address):
+    """
+    نسخه async از post_info که از یک httpx.AsyncClient مشترک (اتصال‌های pooled) استفاده می‌کند.
+    """
+    request_type = payload.get("type")
+    for attempt in range(API_MAX_RETRIES):
+        await rate_limiter.acquire_async()
+        try:
+            with API_REQUEST_SECONDS.time(request_type=request_type):
+                response = await client.post(API_URL, json=payload)
+        except httpx.HTTPError as e:
+            _log_request_error(request_type, user_address, e)
+            return None
+        return_value, retry = _handle_response(
+            request_type, user_address, attempt, response.status_code, response.headers, response.json
+        )
+        if not retry:
+            return return_value
+
+    _log_retries_exhausted(request_type, user_address)
+    return None
+
+
+def get_user_fills(user_address):
+    """
+    آخرین معاملات کاربر (بدون محدودیت زمانی) را از userFills می‌گیرد.
+    """
+    return post_info({"type": "userFills", "user": user_address}, user_address)
+
+
+# -------------------------------------------------
+# 🔽 (جدید) دریافت افزایشی با userFillsByTime 🔽
+# -------------------------------------------------
+def _fills_by_time_payload(user_address, start_time, end_time=None):
+    payload = {
+        "type": "userFillsByTime",
+        "user": user_address,
+        "startTime": int(start_time),
+        "aggregateByTime": False
+    }
+    if end_time is not None:
+        payload["endTime"] = int(end_time)
+    return payload
+
+
+def _next_page_start(page, start_time):
+    """
+    اگر صفحه پر بوده، زمان شروع صفحه بعد را برمی‌گرداند؛ در غیر این صورت None.
+    (شروع صفحه بعد شامل آخرین میلی‌ثانیه است تا معاملات هم‌زمان از دست نروند)
+    """
+    if len(page) < FILLS_PAGE_SIZE:
+        return None
+    last_time = max(int(fill.get('time', 0)) for fill in page)
+    if last_time <= start_time:
+        return None
+    return last_time
+
+
+def get_user_fills_since(user_address, start_time, end_time=None):
+    """
+    معاملات کاربر از start_time به بعد را صفحه به صفحه دریافت می‌کند.
+    اگر صفحه‌ای با خطا مواجه شود، صفحات موفق قبلی برگردانده می‌شوند.
+    """
+    all_fills = []
+    while start_time is not None:
+        page = post_info(_fills_by_time_payload(user_address, start_time, end_time), user_address)
+        if page is None:
+            return all_fills or None
+        all_fills.extend(page)
+        start_time = _next_page_start(page, start_time)
+    return all_fills
+
+
+async def get_user_fills_since_async(client, user_address, start_time, end_time=None):
+    """
+    نسخه async از get_user_fills_since.
+    """
+    all_fills = []
+    while start_time is not None:
+        payload = _fills_by_time_payload(user_address, start_time, end_time)
+        page = await post_info_async(client, payload, user_address)
+        if page is None:
+            return all_fills or None
+        all_fills.extend(page)
+        start_time = _next_page_start(page, start_time)
+    return all_fills
 
-    return None # اگر حلقه تمام شد و موفقیتی نبود
 
+def load_start_times(session, addresses_list, backfill_days=None):
+    """
+    زمان شروع دریافت را برای هر تریدر محاسبه می‌کند:
+    cursor ذخیره شده، یا آخرین معامله موجود در fills، یا بازه پیش‌فرض (INITIAL_LOOKBACK).
+    در حالت backfill همه تریدرها از backfill_days روز قبل دریافت می‌شوند.
+    """
+    now_ms = int(time.time() * 1000)
+    if backfill_days:
+        backfill_start = now_ms - int(backfill_days * 86400 * 1000)
+        return {address: backfill_start for address in addresses_list}
+
+    cursors = dict(
+        session.query(TraderCursor.user_address, TraderCursor.last_fill_time).filter(
+            TraderCursor.user_address.in_(addresses_list)
+        ).all()
+    )
+    # cursor بدون زمان (ساخته شده توسط stream_collector): هنوز هیچ دریافت کاملی نداشته، از بازه پیش‌فرض
+    start_times = {address: last_time for address, last_time in cursors.items() if last_time is not None}
+
+    # تریدرهایی که cursor ندارند: از آخرین معامله ذخیره شده شروع می‌کنیم (مهاجرت از حالت قبلی)
+    # (+1: ردیف‌های قدیمی tid ندارند و کلید یکتا نمی‌تواند تکراری بودنشان را تشخیص دهد)
+    missing = [address for address in addresses_list if address not in cursors]
+    if missing:
+        start_times.update({
+            address: last_time + 1
+            for address, last_time in session.query(Fill.user_address, func.max(Fill.timestamp)).filter(
+                Fill.user_address.in_(missing)
+            ).group_by(Fill.user_address).all()
+        })
+
+    default_start = now_ms - COLLECTOR_INITIAL_LOOKBACK_HOURS * 3600 * 1000
+    return {address: start_times.get(address) or default_start for address in addresses_list}
+
+
+def collect_sync(buffer, addresses_list, start_times):
+    """
+    دریافت ترتیبی (حالت قدیمی)؛ فاصله بین درخواست‌ها را سطل توکن تعیین می‌کند.
+    مجموعه آدرس‌هایی که دریافتشان ناموفق بود را برمی‌گرداند.
+    """
+    failed = set()
+    # 🔽 (جدید) استفاده از enumerate برای شماره‌گذاری
+    for i, address in enumerate(addresses_list):
+        # 🔽 (جدید) اضافه کردن لاگ برای ردیابی پیشرفت
+        log.debug("Fetching fills", extra={"progress": f"{i+1}/{len(addresses_list)}", "user": address})
+        with TRADER_FETCH_SECONDS.time(mode="sync"):
+            fills_data = get_user_fills_since(address, start_times[address])
+        if fills_data is None:
+            failed.add(address)
+        elif fills_data:
+            FILLS_FETCHED.inc(len(fills_data), source="poll")
+            buffer.add(address, fills_data)
+    return failed
+
+
+def make_async_client():
+    """
+    یک httpx.AsyncClient با اتصال‌های keep-alive برای COLLECTOR_CONCURRENCY درخواست همزمان می‌سازد.
+    """
+    limits = httpx.Limits(
+        max_connections=COLLECTOR_CONCURRENCY,
+        max_keepalive_connections=COLLECTOR_CONCURRENCY
+    )
+    return httpx.AsyncClient(headers=HEADERS, timeout=30, limits=limits)
+
+
+async def collect_async(buffer, addresses_list, start_times, client):
+    """
+    دریافت همزمان معاملات همه تریدرها با تعداد محدود درخواست همزمان (COLLECTOR_CONCURRENCY).
+    نتایج به محض رسیدن به بافر درج دسته‌ای اضافه می‌شوند.
+    مجموعه آدرس‌هایی که دریافتشان ناموفق بود را برمی‌گرداند.
+    """
+    total = len(addresses_list)
+    semaphore = asyncio.Semaphore(COLLECTOR_CONCURRENCY)
+
+    async def fetch_one(i, address):
+        async with semaphore:
+            log.debug("Fetching fills", extra={"progress": f"{i+1}/{total}", "user": address})
+            with TRADER_FETCH_SECONDS.time(mode="async"):
+                return address, await get_user_fills_since_async(client, address, start_times[address])
+
+    failed = set()
+    tasks = [fetch_one(i, address) for i, address in enumerate(addresses_list)]
+    for next_done in asyncio.as_completed(tasks):
+        address, fills_data = await next_done
+        if fills_data is None:
+            failed.add(address)
+        elif fills_data:
+            FILLS_FETCHED.inc(len(fills_data), source="poll")
+            buffer.add(address, fills_data)
+    return failed
+
+
+def run_maintenance(session, backfill_days=None):
+    """
+    نگهداری دوره‌ای پیش از دریافت؛ با چند worker فقط یکی (دارنده قفل) انجامش می‌دهد.
+    """
+    with maintenance_lock(session) as acquired:
+        if not acquired:
+            log.debug("Maintenance is running on another worker. Skipping.")
+            return
+        # اولین اجرا پس از ارتقا: ساخت جدول positions و bucketهای فعالیت از تاریخچه موجود
+        ensure_positions_built(session)
+        ensure_buckets_built(session)
+        with DB_QUERY_SECONDS.time(query="prune_buckets"):
+            prune_buckets(session)
+        # ساخت پارتیشن‌های لازم (از قدیمی‌ترین زمان شروع دریافت) و اعمال سیاست نگهداری
+        with DB_QUERY_SECONDS.time(query="load_start_times"):
+            addresses_list = [address for address, in session.query(CollectionJob.user_address)]
+            start_times = load_start_times(session, addresses_list, backfill_days=backfill_days)
+        with DB_QUERY_SECONDS.time(query="maintain_partitions"):
+            maintain_partitions(session, start_ms=min(start_times.values(), default=None))
+
+
+async def process_due_jobs(session, worker_id, client=None, backfill_days=None):
+    """
+    کارهای آماده را دسته به دسته (COLLECTOR_CLAIM_BATCH تریدر) برمی‌دارد، معاملاتشان را دریافت و ذخیره می‌کند
+    و نوبت بعدی هر تریدر را از فعالیت اخیرش (PollSchedule) ثبت می‌کند، تا وقتی کار آماده‌ای نماند.
+    (تعداد کار، تعداد fill درج شده) را برمی‌گرداند.
+    """
+    schedule = None
+    buffer = FillIngestBuffer(session)
+    processed = 0
+    while True:
+        with DB_QUERY_SECONDS.time(query="claim_jobs"):
+            addresses_list = claim_jobs(session, worker_id, COLLECTOR_CLAIM_BATCH)
+        if not addresses_list:
+            break
+        with DB_QUERY_SECONDS.time(query="load_start_times"):
+            start_times = load_start_times(session, addresses_list, backfill_days=backfill_days)
+        if schedule is None:
+            with DB_QUERY_SECONDS.time(query="poll_schedule"):
+                schedule = PollSchedule(session)
+        session.rollback()
+
+        if COLLECTOR_FETCH_MODE == "sync":
+            failed = collect_sync(buffer, addresses_list, start_times)
+        else:
+            failed = await collect_async(buffer, addresses_list, start_times, client)
+        # fills و cursorها قبل از آزاد کردن lease ذخیره می‌شوند؛ اگر worker بین این دو از کار بیفتد
+        # کار پس از انقضای lease دوباره برداشته می‌شود و از cursor ادامه می‌دهد
+        buffer.flush()
+        with DB_QUERY_SECONDS.time(query="complete_jobs"):
+            complete_jobs(session, worker_id, schedule.next_runs(addresses_list), failed)
+        processed += len(addresses_list)
+    return processed, buffer.total_inserted
+
+
+async def collect_once(client=None, backfill_days=None, worker_id=None):
+    """
+    یک دور کامل جمع‌آوری. اگر client داده شود (مثلاً از scheduler.py) اتصال‌ها بین دورها گرم می‌مانند.
+    تریدرها از صف collection_jobs برداشته می‌شوند، پس چند نمونه collector می‌توانند همزمان اجرا شوند.
+    """
+    if client is None and COLLECTOR_FETCH_MODE != "sync":
+        async with make_async_client() as own_client:
+            return await collect_once(client=own_client, backfill_days=backfill_days, worker_id=worker_id)
+
+    worker_id = worker_id or default_worker_id()
+    mode_label = f"backfill {backfill_days}d" if backfill_days else "incremental"
+    log.info("🚀 Collector started", extra={"fetch_mode": COLLECTOR_FETCH_MODE, "mode": mode_label, "worker": worker_id})
 
-def run_collector():
-    print("🚀 Collector started... (Append-Only Mode)")
-    Base.metadata.create_all(bind=engine)
-    
     with SessionLocal() as session:
         try:
-            print("Fetching trader addresses from 'tracked_traders' table...")
-            traders_to_track = session.query(TrackedTrader).all()
-            
-            if not traders_to_track:
-                print("🤷 No traders found in 'tracked_traders' table. Did you run discover_traders.py first?")
+            round_started_ms = int(time.time() * 1000)
+            with DB_QUERY_SECONDS.time(query="sync_collection_jobs"):
+                job_count = sync_jobs(session, round_started_ms)
+
+            if not job_count:
+                log.warning("🤷 No traders found in 'tracked_traders' table. Did you run discover_traders.py first?")
                 return
 
-            addresses_list = [trader.user_address for trader in traders_to_track]
-            print(f"✅ Found {len(addresses_list)} traders to collect data for.")
-            
-            total_inserted_count = 0
-            
-            # 🔽 (جدید) استفاده از enumerate برای شماره‌گذاری
-            for i, address in enumerate(addresses_list):
-                # 🔽 (جدید) اضافه کردن لاگ برای ردیابی پیشرفت
-                print(f"[{i+1}/{len(addresses_list)}] Fetching fills for: {address}")
-                fills_data = get_user_fills(address)
-                
-                if not fills_data:
-                    # get_user_fills خودش دلیل خطا را پرینت می‌کند
-                    continue
-
-                api_hashes = {fill.get('hash') for fill in fills_data if fill.get('hash')}
-                if not api_hashes:
-                    continue 
-
-                existing_hashes = session.query(Fill.hash).filter(
-                    Fill.user_address == address,
-                    Fill.hash.in_(api_hashes)
-                ).all()
-                existing_hashes_set = {h[0] for h in existing_hashes}
-
-                fills_to_insert = []
-                for fill in fills_data:
-                    fill_hash = fill.get('hash')
-                    if fill_hash not in existing_hashes_set:
-                        pnl_str = fill.get('closedPnl')
-                        direction_str = fill.get('dir', '')
-                        
-                        new_fill = Fill(
-                            hash=fill.get('hash'),
-                            oid=fill.get('oid'),
-                            user_address=address,
-                            asset=fill.get('coin'),
-                            price=float(fill.get('px')),
-                            size=float(fill.get('sz')),
-                            direction=direction_str,
-                            is_buy="Open Long" in direction_str or "Close Short" in direction_str,
-                            pnl=float(pnl_str) if pnl_str else None,
-                            timestamp=int(fill.get('time'))
-                        )
-                        fills_to_insert.append(new_fill)
-
-                if not fills_to_insert:
-                    print(f"No new fills for user {address}.")
-                    continue
-                
-                session.add_all(fills_to_insert)
-                session.commit() 
-                
-                total_inserted_count += len(fills_to_insert)
-                print(f"✅ Inserted {len(fills_to_insert)} new fill records for user {address}.")
-
-                # -------------------------------------------------
-                # 🔽 (جدید) تاخیر پیشگیرانه 🔽
-                # -------------------------------------------------
-                # 0.5 ثانیه مکث بین هر درخواست برای جلوگیری از فشار به API
-                time.sleep(0.5) 
-                # -------------------------------------------------
-
-
-            print(f"🎉 Successfully inserted a total of {total_inserted_count} new records across all users.")
-            
-        except Exception as e:
-            print(f"❌ An unexpected error occurred: {e}")
+            log.info("✅ Found traders to collect data for", extra={"traders": job_count})
+            run_maintenance(session, backfill_days=backfill_days)
+            if backfill_days:
+                mark_all_due(session, round_started_ms)
+
+            processed, total_inserted_count = await process_due_jobs(
+                session, worker_id, client, backfill_days=backfill_days
+            )
+            log.info("🎉 Collector run complete", extra={"traders": processed, "inserted": total_inserted_count})
+
+        except Exception:
+            log.exception("❌ An unexpected error occurred in the collector")
             session.rollback()
-        finally:
-            print("Collector finished run.")
+            release_jobs(session, worker_id)
+
+
+async def collect_due(client=None, worker_id=None):
+    """
+    فقط تریدرهایی که نوبتشان رسیده (بدون همگام‌سازی صف و نگهداری)؛ بین دورهای کامل اجرا می‌شود.
+    """
+    worker_id = worker_id or default_worker_id()
+    with SessionLocal() as session:
+        try:
+            processed, inserted = await process_due_jobs(session, worker_id, client)
+        except Exception:
+            log.exception("❌ An unexpected error occurred in the collector")
+            session.rollback()
+            release_jobs(session, worker_id)
+        else:
+            if processed:
+                log.info("✅ Processed due traders", extra={"traders": processed, "inserted": inserted})
+
+
+async def run_worker(worker_id=None, stop_event=None):
+    """
+    حالت worker ماندگار (برای چند نمونه همزمان): هر COLLECTOR_WORKER_POLL_SECONDS کارهای آماده را برمی‌دارد
+    و هر COLLECTOR_INTERVAL_SECONDS یک دور کامل (همگام‌سازی صف و نگهداری) اجرا می‌کند.
+    """
+    worker_id = worker_id or default_worker_id()
+    stop_event = stop_event or asyncio.Event()
+    # SIGTERM (docker stop): پایان نوبت جاری و آزاد کردن leaseها به جای انتظار برای انقضا
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
+    except (NotImplementedError, RuntimeError):
+        pass
+    client = make_async_client() if COLLECTOR_FETCH_MODE != "sync" else None
+    last_full_round = None
+    log.info("👷 Collector worker started", extra={"worker": worker_id})
+    try:
+        while not stop_event.is_set():
+            if last_full_round is None or time.monotonic() - last_full_round >= COLLECTOR_INTERVAL_SECONDS:
+                last_full_round = time.monotonic()
+                await collect_once(client=client, worker_id=worker_id)
+            else:
+                await collect_due(client=client, worker_id=worker_id)
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=COLLECTOR_WORKER_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        if client is not None:
+            await client.aclose()
+        with SessionLocal() as session:
+            release_jobs(session, worker_id)
+        log.info("🛑 Collector worker stopped.", extra={"worker": worker_id})
+
+
+def run_collector(backfill_days=None):
+    init_db()
+    with JOB_RUN_SECONDS.time(job="collector"):
+        asyncio.run(collect_once(backfill_days=backfill_days))
+    dump_metrics()
 
 if __name__ == "__main__":
-    run_collector()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Collect new fills for tracked traders.")
+    parser.add_argument(
+        "--backfill-days", type=float, default=None,
+        help="Cold backfill: page through the last N days of history instead of resuming from cursors."
+    )
+    parser.add_argument(
+        "--worker", action="store_true",
+        help="Run as a long-lived worker sharing the collection_jobs queue with other replicas."
+    )
+    args = parser.parse_args()
+    if args.worker:
+        init_db()
+        start_metrics_exporters()
+        try:
+            asyncio.run(run_worker())
+        except KeyboardInterrupt:
+            pass
+        dump_metrics()
+    else:
+        run_collector(backfill_days=args.backfill_days)
@@ -0,0 +1,139 @@
+# collector/columnar.py
+
+from array import array
+import numpy as np
+from database import Fill
+
+
+class FillColumns:
+    """
+    fillها به صورت ستونی: کد عددی تریدر و دارایی (factorized) به همراه آرایه‌های NumPy.
+    user_labels[i] / asset_labels[i] نام متناظر با کد i هستند.
+    """
+
+    def __init__(self, user_labels, asset_labels, user_codes, asset_codes, size, price, is_buy):
+        self.user_labels = user_labels
+        self.asset_labels = asset_labels
+        self.user_codes = user_codes
+        self.asset_codes = asset_codes
+        self.size = size
+        self.price = price
+        self.is_buy = is_buy
+
+    def __len__(self):
+        return len(self.size)
+
+
+def load_fill_columns(fills_query, chunk_size=50000):
+    """
+    فقط ستون‌های لازم را (بدون ساختن آبجکت ORM) به صورت دسته‌ای می‌خواند
+    و نام تریدر/دارایی را هنگام خواندن به کد عددی تبدیل می‌کند.
+    """
+    users, assets = {}, {}
+    user_codes, asset_codes = array('q'), array('q')
+    sizes, prices, is_buys = array('d'), array('d'), array('b')
+
+    rows = fills_query.order_by(None).with_entities(
+        Fill.user_address, Fill.asset, Fill.size, Fill.price, Fill.is_buy
+    ).yield_per(chunk_size)
+    for user, asset, size, price, is_buy in rows:
+        user_codes.append(users.setdefault(user, len(users)))
+        asset_codes.append(assets.setdefault(asset, len(assets)))
+        sizes.append(size)
+        prices.append(price)
+        is_buys.append(1 if is_buy else 0)
+
+    return FillColumns(
+        user_labels=list(users),
+        asset_labels=list(assets),
+        user_codes=np.frombuffer(user_codes, dtype=np.int64) if user_codes else np.empty(0, dtype=np.int64),
+        asset_codes=np.frombuffer(asset_codes, dtype=np.int64) if asset_codes else np.empty(0, dtype=np.int64),
+        size=np.frombuffer(sizes, dtype=np.float64) if sizes else np.empty(0),
+        price=np.frombuffer(prices, dtype=np.float64) if prices else np.empty(0),
+        is_buy=np.frombuffer(is_buys, dtype=np.int8).astype(bool) if is_buys else np.empty(0, dtype=bool)
+    )
+
+
+def open_positions_from_columns(columns):
+    """
+    معادل ستونی get_open_positions: جمع‌های هر (تریدر، دارایی) با کلید گروه factorized و np.bincount.
+    """
+    if len(columns) == 0:
+        return []
+
+    n_assets = len(columns.asset_labels)
+    group_keys = columns.user_codes.astype(np.int64) * n_assets + columns.asset_codes
+    unique_keys, group_index = np.unique(group_keys, return_inverse=True)
+    n_groups = len(unique_keys)
+
+    notional = columns.size * columns.price
+    buy_volume = np.bincount(group_index, weights=np.where(columns.is_buy, columns.size, 0.0), minlength=n_groups)
+    sell_volume = np.bincount(group_index, weights=np.where(columns.is_buy, 0.0, columns.size), minlength=n_groups)
+    weighted_buy_sum = np.bincount(group_index, weights=np.where(columns.is_buy, notional, 0.0), minlength=n_groups)
+    weighted_sell_sum = np.bincount(group_index, weights=np.where(columns.is_buy, 0.0, notional), minlength=n_groups)
+
+    net_volume = buy_volume - sell_volume
+    is_long = net_volume > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_price = np.where(
+            is_long,
+            np.where(buy_volume > 0, weighted_buy_sum / buy_volume, 0.0),
+            np.where(sell_volume > 0, weighted_sell_sum / sell_volume, 0.0)
+        )
+    position_value = np.abs(net_volume) * avg_price
+
+    processed_positions = []
+    for i in np.flatnonzero(np.abs(net_volume) > 1e-9):
+        user_code, asset_code = divmod(int(unique_keys[i]), n_assets)
+        processed_positions.append({
+            "user": columns.user_labels[user_code], "asset": columns.asset_labels[asset_code],
+            "side": "Long" if is_long[i] else "Short", "net_volume": float(net_volume[i]),
+            "avg_price": float(avg_price[i]), "position_value": float(position_value[i])
+        })
+    return processed_positions
+
+
+def open_positions_numpy(fills_query):
+    return open_positions_from_columns(load_fill_columns(fills_query))
+
+
+def aggregate_sentiment_numpy(processed_positions, weights_map=None):
+    """
+    معادل ستونی aggregate_sentiment (شامل حالت وزن‌دار با weights_map بر اساس PNL).
+    """
+    if not processed_positions:
+        return []
+
+    assets = {}
+    n = len(processed_positions)
+    asset_codes = np.empty(n, dtype=np.int64)
+    is_long = np.empty(n, dtype=bool)
+    values = np.empty(n, dtype=np.float64)
+    weights = np.ones(n, dtype=np.float64)
+    for i, pos in enumerate(processed_positions):
+        asset_codes[i] = assets.setdefault(pos["asset"], len(assets))
+        is_long[i] = pos["side"] == "Long"
+        values[i] = pos["position_value"]
+        if weights_map:
+            weights[i] = weights_map.get(pos["user"], 1.0)
+
+    n_assets = len(assets)
+    weighted_long = np.bincount(asset_codes, weights=np.where(is_long, weights, 0.0), minlength=n_assets)
+    weighted_short = np.bincount(asset_codes, weights=np.where(is_long, 0.0, weights), minlength=n_assets)
+    long_value = np.bincount(asset_codes, weights=np.where(is_long, values, 0.0), minlength=n_assets)
+    short_value = np.bincount(asset_codes, weights=np.where(is_long, 0.0, values), minlength=n_assets)
+    long_traders = np.bincount(asset_codes[is_long], minlength=n_assets)
+    short_traders = np.bincount(asset_codes[~is_long], minlength=n_assets)
+
+    total_weight = weighted_long + weighted_short
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sentiment_percent = np.where(total_weight > 0, (weighted_long - weighted_short) / total_weight * 100, 0.0)
+    net_value = long_value - short_value
+
+    processed_sentiment = []
+    for asset, code in assets.items():
+        processed_sentiment.append({
+            "asset": asset, "net_value": float(net_value[code]), "sentiment_percent": float(sentiment_percent[code]),
+            "long_traders_raw": int(long_traders[code]), "short_traders_raw": int(short_traders[code])
+        })
+    return sorted(processed_sentiment, key=lambda s: s["long_traders_raw"] + s["short_traders_raw"], reverse=True)
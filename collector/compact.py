@@ -0,0 +1,301 @@
+# collector/compact.py
+
+import argparse
+import threading
+from sqlalchemy import text, select
+from sqlalchemy.dialects.postgresql import insert
+from config import FILLS_PARTITIONS_AHEAD, FILLS_PARTITION_INTERVAL
+from database import (
+    SessionLocal, CompactBase, TraderDim, AssetDim, CompactFill,
+    COMPACT_STORAGE, COMPACT_SCALE, FILLS_COMPAT_VIEW_SQL, fills_relation_kind
+)
+from logs import get_logger
+
+log = get_logger("compact")
+
+# حداکثر مقدار قابل ذخیره پس از ضرب در COMPACT_SCALE (BIGINT)
+MAX_SCALED = 2 ** 63 - 1
+
+
+# -------------------------------------------------
+# تبدیل مقادیر
+# -------------------------------------------------
+def encode_hex(value):
+    """
+    رشته "0x..." (آدرس یا hash) را به bytes تبدیل می‌کند؛ مقدار نامعتبر None می‌شود.
+    """
+    if not value or not value.startswith("0x"):
+        return None
+    try:
+        return bytes.fromhex(value[2:])
+    except ValueError:
+        return None
+
+
+def decode_hex(value):
+    return "0x" + value.hex() if value is not None else None
+
+
+def to_scaled(value):
+    if value is None:
+        return None
+    scaled = round(value * COMPACT_SCALE)
+    if abs(scaled) > MAX_SCALED:
+        raise ValueError(f"Value {value} does not fit the compact fixed-point range")
+    return scaled
+
+
+def from_scaled(value):
+    return value / COMPACT_SCALE if value is not None else None
+
+
+# -------------------------------------------------
+# کش جداول ابعاد
+# -------------------------------------------------
+class DimensionCache:
+    """
+    نگاشت آدرس/نام دارایی ← شناسه عددی (و برعکس) که در حافظه پروسه نگه داشته می‌شود.
+    مقادیر جدید با یک INSERT ... ON CONFLICT DO NOTHING برای هر دسته ساخته می‌شوند.
+    """
+
+    def __init__(self):
+        self.trader_ids = {}
+        self.asset_ids = {}
+        self.trader_addresses = {}
+        self.asset_names = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, connection, model, key_column, keys, ids, reverse):
+        missing = [key for key in keys if key not in ids]
+        if not missing:
+            return
+        column = getattr(model, key_column)
+        connection.execute(
+            insert(model.__table__).on_conflict_do_nothing(index_elements=[key_column]),
+            [{key_column: key} for key in missing]
+        )
+        for dim_id, key in connection.execute(select(model.id, column).where(column.in_(missing))):
+            ids[key] = dim_id
+            reverse[dim_id] = key
+
+    def resolve(self, session, addresses, assets):
+        """
+        شناسه همه آدرس‌ها (bytes) و دارایی‌ها را تضمین می‌کند.
+        ردیف‌های ابعاد جدید در یک تراکنش کوتاه جدا commit می‌شوند تا کش حتی با rollback درج fills معتبر بماند.
+        """
+        with self._lock:
+            addresses, assets = set(addresses), set(assets)
+            if addresses <= self.trader_ids.keys() and assets <= self.asset_ids.keys():
+                return
+            with session.get_bind().connect() as connection:
+                self._resolve(connection, TraderDim, "address", addresses, self.trader_ids, self.trader_addresses)
+                self._resolve(connection, AssetDim, "name", assets, self.asset_ids, self.asset_names)
+                connection.commit()
+
+    def names(self, session, trader_ids, asset_ids):
+        """
+        شناسه‌ها را به (آدرس "0x..."، نام دارایی) برمی‌گرداند.
+        """
+        with self._lock:
+            missing_traders = [dim_id for dim_id in set(trader_ids) if dim_id not in self.trader_addresses]
+            if missing_traders:
+                for dim_id, address in session.query(TraderDim.id, TraderDim.address).filter(TraderDim.id.in_(missing_traders)):
+                    self.trader_addresses[dim_id] = address
+                    self.trader_ids[address] = dim_id
+            missing_assets = [dim_id for dim_id in set(asset_ids) if dim_id not in self.asset_names]
+            if missing_assets:
+                for dim_id, name in session.query(AssetDim.id, AssetDim.name).filter(AssetDim.id.in_(missing_assets)):
+                    self.asset_names[dim_id] = name
+                    self.asset_ids[name] = dim_id
+            return (
+                {dim_id: decode_hex(self.trader_addresses.get(dim_id)) for dim_id in trader_ids},
+                {dim_id: self.asset_names.get(dim_id) for dim_id in asset_ids},
+            )
+
+    def clear(self):
+        with self._lock:
+            self.trader_ids.clear()
+            self.asset_ids.clear()
+            self.trader_addresses.clear()
+            self.asset_names.clear()
+
+
+dimension_cache = DimensionCache()
+
+
+# -------------------------------------------------
+# درج
+# -------------------------------------------------
+def insert_compact_fills(session, rows):
+    """
+    ردیف‌های fill (همان خروجی fill_row_from_api) را در fills_compact درج می‌کند.
+    ردیف‌های واقعاً درج شده را با آدرس و نام دارایی رشته‌ای برمی‌گرداند (برای positions و activity_buckets).
+    """
+    encoded = []
+    for row in rows:
+        address = encode_hex((row["user_address"] or "").lower())
+        if address is None or not row["asset"]:
+            log.warning("⚠️ Skipping fill with invalid address or asset",
+                        extra={"user": row["user_address"], "asset": row["asset"]})
+            continue
+        encoded.append((address, row))
+    if not encoded:
+        return []
+
+    dimension_cache.resolve(session, (address for address, _ in encoded), (row["asset"] for _, row in encoded))
+    values = [
+        {
+            "timestamp": row["timestamp"],
+            "tid": row["tid"],
+            "oid": row["oid"],
+            "price": to_scaled(row["price"]),
+            "size": to_scaled(row["size"]),
+            "pnl": to_scaled(row["pnl"]),
+            "trader_id": dimension_cache.trader_ids[address],
+            "asset_id": dimension_cache.asset_ids[row["asset"]],
+            "is_buy": row["is_buy"],
+            "direction": row["direction"],
+            "hash": encode_hex(row["hash"]),
+        }
+        for address, row in encoded
+    ]
+    stmt = insert(CompactFill.__table__).on_conflict_do_nothing(
+        index_elements=["trader_id", "tid", "timestamp"]
+    ).returning(
+        CompactFill.trader_id, CompactFill.asset_id, CompactFill.size, CompactFill.price,
+        CompactFill.is_buy, CompactFill.direction, CompactFill.timestamp
+    )
+    inserted = session.connection().execute(stmt, values).all()
+    addresses, assets = dimension_cache.names(
+        session, [row.trader_id for row in inserted], [row.asset_id for row in inserted]
+    )
+    return [
+        {
+            "user_address": addresses[row.trader_id], "asset": assets[row.asset_id],
+            "size": from_scaled(row.size), "price": from_scaled(row.price),
+            "is_buy": row.is_buy, "direction": row.direction, "timestamp": row.timestamp,
+        }
+        for row in inserted
+    ]
+
+
+# -------------------------------------------------
+# مهاجرت از چیدمان wide
+# -------------------------------------------------
+_COPY_SQL = f"""
+    INSERT INTO fills_compact (id, timestamp, tid, oid, price, size, pnl, trader_id, asset_id, is_buy, direction, hash)
+    SELECT
+        f.id, f.timestamp, f.tid, f.oid,
+        round(f.price * {COMPACT_SCALE})::bigint,
+        round(f.size * {COMPACT_SCALE})::bigint,
+        round(f.pnl * {COMPACT_SCALE})::bigint,
+        t.id, a.id, f.is_buy, f.direction,
+        CASE WHEN f.hash ~ '^0x([0-9a-fA-F]{{2}})*$' THEN decode(substr(f.hash, 3), 'hex') END
+    FROM fills_wide f
+    JOIN traders t ON t.address = decode(substr(lower(f.user_address), 3), 'hex')
+    JOIN assets a ON a.name = f.asset
+    WHERE f.timestamp IS NOT NULL AND f.user_address ~ '^0x[0-9a-fA-F]{{40}}$'
+"""
+
+
+def migrate_to_compact(session):
+    """
+    جدول fills فعلی را به چیدمان فشرده منتقل می‌کند (همه در یک تراکنش):
+    ۱. تغییر نام fills به fills_wide  ۲. ساخت traders، assets و fills_compact (پارتیشن‌بندی شده)
+    ۳. پر کردن ابعاد و کپی ردیف‌ها  ۴. ساخت view سازگار "fills"
+    جدول fills_wide برای بازگشت نگه داشته می‌شود (حذف: python compact.py drop-wide).
+    """
+    from partitions import _create_partitions
+
+    kind = fills_relation_kind(session.connection())
+    if kind == "view":
+        log.info("✅ 'fills' is already a view over the compact layout.")
+        return False
+    if kind is None:
+        raise RuntimeError("No 'fills' table to migrate.")
+
+    log.info("🚚 Migrating 'fills' to the compact layout...")
+    session.execute(text("LOCK TABLE fills IN ACCESS EXCLUSIVE MODE"))
+    session.execute(text("ALTER TABLE fills RENAME TO fills_wide"))
+    CompactBase.metadata.create_all(bind=session.connection())
+
+    min_timestamp = session.execute(text("SELECT MIN(timestamp) FROM fills_wide")).scalar()
+    _create_partitions(session, min_timestamp, FILLS_PARTITIONS_AHEAD, FILLS_PARTITION_INTERVAL, table="fills_compact")
+
+    session.execute(text("""
+        INSERT INTO traders (address)
+        SELECT DISTINCT decode(substr(lower(user_address), 3), 'hex') FROM fills_wide
+        WHERE user_address ~ '^0x[0-9a-fA-F]{40}$'
+        ON CONFLICT (address) DO NOTHING
+    """))
+    session.execute(text("""
+        INSERT INTO assets (name) SELECT DISTINCT asset FROM fills_wide WHERE asset IS NOT NULL
+        ON CONFLICT (name) DO NOTHING
+    """))
+    copied = session.execute(text(_COPY_SQL)).rowcount
+    total = session.execute(text("SELECT COUNT(*) FROM fills_wide")).scalar()
+    session.execute(text(
+        "SELECT setval(pg_get_serial_sequence('fills_compact', 'id'), "
+        "COALESCE((SELECT MAX(id) FROM fills_compact), 0) + 1, false)"
+    ))
+    session.execute(text(FILLS_COMPAT_VIEW_SQL))
+    # جداول جدید آمار ندارند؛ بدون ANALYZE پلن کوئری‌ها تا اجرای autovacuum ایندکس‌ها را نادیده می‌گیرد
+    for table in ("fills_compact", "traders", "assets"):
+        session.execute(text(f"ANALYZE {table}"))
+    session.commit()
+    dimension_cache.clear()
+    log.info("🎉 Migrated fills into the compact layout", extra={"rows": copied, "skipped": total - copied})
+    if total != copied:
+        log.warning("⚠️ Some rows had an invalid address or missing asset/timestamp and stay only in fills_wide",
+                    extra={"skipped": total - copied})
+    return True
+
+
+def drop_wide(session):
+    session.execute(text("DROP TABLE IF EXISTS fills_wide CASCADE"))
+    session.commit()
+    log.info("🗑️ Dropped fills_wide")
+
+
+def relation_sizes(session):
+    """
+    اندازه داده و ایندکس هر دو چیدمان (شامل همه پارتیشن‌ها) برای مقایسه.
+    فقط جداول برگ جمع زده می‌شوند: reltuples جدول پارتیشن‌بندی شده پس از ANALYZE مجموع پارتیشن‌هاست
+    و جدولی که هنوز ANALYZE نشده reltuples = -1 دارد.
+    """
+    sizes = {}
+    for name in ("fills_wide", "fills_compact", "traders", "assets"):
+        row = session.execute(text("""
+            SELECT
+                COALESCE(SUM(pg_relation_size(c.oid)), 0),
+                COALESCE(SUM(pg_indexes_size(c.oid)), 0),
+                COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)
+            FROM pg_class c
+            WHERE c.relkind = 'r' AND (
+                c.relname = :name
+                OR c.oid IN (SELECT inhrelid FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :name)
+            )
+        """), {"name": name}).one()
+        sizes[name] = {"table_bytes": int(row[0]), "index_bytes": int(row[1]), "rows_estimate": int(row[2])}
+    return sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate fills to the compact layout (FILLS_STORAGE=compact).")
+    parser.add_argument("command", choices=["migrate", "sizes", "drop-wide"],
+                        help="migrate: copy fills into the compact layout | sizes: compare table/index sizes | "
+                             "drop-wide: drop the old fills_wide table after checking the migration")
+    args = parser.parse_args()
+
+    if args.command == "migrate" and not COMPACT_STORAGE:
+        parser.error("Set FILLS_STORAGE=compact for every service before migrating.")
+
+    with SessionLocal() as session:
+        if args.command == "migrate":
+            migrate_to_compact(session)
+        elif args.command == "drop-wide":
+            drop_wide(session)
+        else:
+            for name, size in relation_sizes(session).items():
+                print(f"{name:<14} table={size['table_bytes'] / 2**20:>10.1f} MB  "
+                      f"indexes={size['index_bytes'] / 2**20:>10.1f} MB  rows≈{size['rows_estimate']:,}")
@@ -26,4 +26,187 @@ TOP_TRADERS_ADDRESSES = [
     "0x044d0932b02f5045bc00e0a6818b7f98ef504681",
     "0x020ca66c30bec2c4fe3861a94e4db4a498a35872",
     "0x8e096995c3e4a3f0bc5b3ea1cba94de2aa4d70c9"
-]
\ No newline at end of file
+]
+
+# -------------------------------------------------
+# 🔽 (جدید) تنظیمات دریافت همزمان معاملات و محدودیت نرخ API 🔽
+# -------------------------------------------------
+# حالت دریافت: "async" (همزمان با اتصال‌های keep-alive) یا "sync" (ترتیبی، مثل قبل)
+COLLECTOR_FETCH_MODE = os.getenv("COLLECTOR_FETCH_MODE", "async")
+# حداکثر تعداد درخواست‌های همزمان در حالت async
+COLLECTOR_CONCURRENCY = int(os.getenv("COLLECTOR_CONCURRENCY", "8"))
+# سطل توکن مشترک: تعداد درخواست مجاز در ثانیه و ظرفیت انفجاری (burst)
+API_RATE_LIMIT_PER_SEC = float(os.getenv("API_RATE_LIMIT_PER_SEC", "2"))
+API_RATE_LIMIT_BURST = int(os.getenv("API_RATE_LIMIT_BURST", "10"))
+# تعداد تلاش مجدد پس از خطای 429
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "5"))
+
+# -------------------------------------------------
+# 🔽 (جدید) دریافت افزایشی معاملات (userFillsByTime) 🔽
+# -------------------------------------------------
+# برای تریدری که هنوز cursor ندارد، چند ساعت به عقب نگاه کنیم
+COLLECTOR_INITIAL_LOOKBACK_HOURS = int(os.getenv("COLLECTOR_INITIAL_LOOKBACK_HOURS", "24"))
+# حداکثر تعداد معاملاتی که API در هر صفحه از userFillsByTime برمی‌گرداند
+FILLS_PAGE_SIZE = 2000
+# تعداد ردیف در هر دسته درج (هر دسته = یک INSERT ... ON CONFLICT)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+
+# -------------------------------------------------
+# 🔽 (جدید) صف کارهای جمع‌آوری (چند نمونه collector همزمان) 🔽
+# -------------------------------------------------
+# شناسه این worker در جدول collection_jobs (پیش‌فرض: hostname-pid)
+COLLECTOR_WORKER_ID = os.getenv("COLLECTOR_WORKER_ID", "")
+# مدت lease هر کار؛ کار worker از کار افتاده پس از این مدت دوباره قابل برداشتن است
+COLLECTOR_LEASE_SECONDS = int(os.getenv("COLLECTOR_LEASE_SECONDS", "300"))
+# تعداد تریدری که هر worker در هر نوبت برمی‌دارد
+COLLECTOR_CLAIM_BATCH = int(os.getenv("COLLECTOR_CLAIM_BATCH", "32"))
+# فاصله بررسی کارهای آماده در حالت python collector.py --worker
+COLLECTOR_WORKER_POLL_SECONDS = float(os.getenv("COLLECTOR_WORKER_POLL_SECONDS", "5"))
+
+# -------------------------------------------------
+# 🔽 (جدید) زمان‌بندی تطبیقی دریافت هر تریدر 🔽
+# -------------------------------------------------
+# کوتاه‌ترین و بلندترین فاصله دریافت یک تریدر (تریدر فعال / تریدر خاموش)
+COLLECTOR_MIN_POLL_SECONDS = int(os.getenv("COLLECTOR_MIN_POLL_SECONDS", "60"))
+COLLECTOR_MAX_POLL_SECONDS = int(os.getenv("COLLECTOR_MAX_POLL_SECONDS", "3600"))
+# بازه‌ای (ساعت) که نرخ fill هر تریدر از bucketهای فعالیت در آن حساب می‌شود (حداکثر ACTIVITY_BUCKET_RETENTION_HOURS)
+COLLECTOR_ACTIVITY_WINDOW_HOURS = int(os.getenv("COLLECTOR_ACTIVITY_WINDOW_HOURS", "24"))
+# سقف کل دریافت‌های برنامه‌ریزی شده در ساعت برای همه تریدرها؛ اگر مجموع بیشتر شود فاصله‌ها به یک نسبت بزرگ می‌شوند
+# (پیش‌فرض: نصف ظرفیت API_RATE_LIMIT_PER_SEC تا برای صفحه‌های اضافه و discover جا بماند)
+COLLECTOR_REQUEST_BUDGET_PER_HOUR = int(os.getenv(
+    "COLLECTOR_REQUEST_BUDGET_PER_HOUR", str(int(API_RATE_LIMIT_PER_SEC * 3600 / 2))
+))
+# سقف backoff نمایی (ثانیه) تریدری که دریافتش پشت سر هم شکست می‌خورد: MIN_POLL × 2^(شکست‌ها - 1)
+COLLECTOR_FAILURE_BACKOFF_MAX_SECONDS = int(os.getenv("COLLECTOR_FAILURE_BACKOFF_MAX_SECONDS", "3600"))
+
+# موتور محاسبه پوزیشن‌های باز برای کوئری‌های fills فیلتر شده: "sql" (تجمیع در PostgreSQL) یا "python"
+POSITIONS_BACKEND = os.getenv("POSITIONS_BACKEND", "sql")
+
+# -------------------------------------------------
+# 🔽 (جدید) پارتیشن‌بندی جدول fills و سیاست نگهداری 🔽
+# -------------------------------------------------
+# بازه هر پارتیشن: "month" یا "day"
+FILLS_PARTITION_INTERVAL = os.getenv("FILLS_PARTITION_INTERVAL", "month")
+# چند پارتیشن آینده از قبل ساخته شود
+FILLS_PARTITIONS_AHEAD = int(os.getenv("FILLS_PARTITIONS_AHEAD", "2"))
+# پارتیشن‌های قدیمی‌تر از این تعداد روز حذف می‌شوند (0 = غیرفعال)
+FILLS_RETENTION_DAYS = int(os.getenv("FILLS_RETENTION_DAYS", "0"))
+# "rollup": قبل از حذف، تجمیع روزانه (user, asset, day) ذخیره شود | "drop": فقط حذف
+FILLS_RETENTION_MODE = os.getenv("FILLS_RETENTION_MODE", "rollup")
+# چیدمان ذخیره fills: "wide" (جدول اصلی با رشته‌ها و Float) یا "compact"
+# (جداول ابعاد traders/assets با شناسه عددی کوچک، آدرس باینری ۲۰ بایتی و قیمت/حجم به صورت عدد صحیح مقیاس‌دار)
+# حالت compact فقط روی PostgreSQL و پس از اجرای python compact.py migrate
+FILLS_STORAGE = os.getenv("FILLS_STORAGE", "wide").lower()
+
+# -------------------------------------------------
+# 🔽 (جدید) زمان‌بندی سرویس scheduler.py (ثانیه) 🔽
+# -------------------------------------------------
+DISCOVER_INTERVAL_SECONDS = int(os.getenv("DISCOVER_INTERVAL_SECONDS", "86400"))
+# دور کامل collector (همگام‌سازی صف و نگهداری)؛ بین دورها هر COLLECTOR_MIN_POLL_SECONDS فقط تریدرهای آماده دریافت می‌شوند
+COLLECTOR_INTERVAL_SECONDS = int(os.getenv("COLLECTOR_INTERVAL_SECONDS", "600"))
+ANALYZER_INTERVAL_SECONDS = int(os.getenv("ANALYZER_INTERVAL_SECONDS", "600"))
+# تاخیر اولین اجرای analyzer تا collector فرصت پر کردن داده‌ها را داشته باشد
+ANALYZER_START_OFFSET_SECONDS = int(os.getenv("ANALYZER_START_OFFSET_SECONDS", "60"))
+
+# -------------------------------------------------
+# 🔽 (جدید) جمع‌آوری استریم (WebSocket) 🔽
+# -------------------------------------------------
+# برای تست می‌توان آن را به سرور محلی ws_replay_server.py اشاره داد
+HYPERLIQUID_WS_URL = os.getenv("HYPERLIQUID_WS_URL", "wss://api.hyperliquid.xyz/ws")
+# حداکثر تعداد تریدر روی هر اتصال WebSocket
+WS_MAX_USERS_PER_CONNECTION = int(os.getenv("WS_MAX_USERS_PER_CONNECTION", "100"))
+# fillهای دریافتی هر چند ثانیه یا پس از رسیدن به این تعداد در دیتابیس ذخیره می‌شوند
+STREAM_FLUSH_INTERVAL_SECONDS = float(os.getenv("STREAM_FLUSH_INTERVAL_SECONDS", "2"))
+STREAM_FLUSH_MAX_FILLS = int(os.getenv("STREAM_FLUSH_MAX_FILLS", "500"))
+# هر چند ثانیه لیست tracked_traders دوباره خوانده شود
+STREAM_TRADERS_REFRESH_SECONDS = int(os.getenv("STREAM_TRADERS_REFRESH_SECONDS", "60"))
+
+# -------------------------------------------------
+# 🔽 (جدید) کش داده‌های بازار (metaAndAssetCtxs) 🔽
+# -------------------------------------------------
+MARKET_CONTEXT_TTL_SECONDS = int(os.getenv("MARKET_CONTEXT_TTL_SECONDS", "60"))
+MARKET_CONTEXT_CACHE_PATH = os.getenv("MARKET_CONTEXT_CACHE_PATH", "cache/market_context.json")
+# اگر هیچ کشی وجود ندارد، حداکثر چند ثانیه برای اولین دریافت صبر شود
+MARKET_CONTEXT_COLD_WAIT_SECONDS = float(os.getenv("MARKET_CONTEXT_COLD_WAIT_SECONDS", "5"))
+
+# -------------------------------------------------
+# 🔽 (جدید) ارسال دسته‌ای پیام‌های تلگرام 🔽
+# -------------------------------------------------
+# محدودیت نرخ هر چت (تلگرام حدود ۱ پیام در ثانیه برای هر چت را مجاز می‌داند)
+TELEGRAM_RATE_PER_SEC = float(os.getenv("TELEGRAM_RATE_PER_SEC", "1"))
+TELEGRAM_RATE_BURST = int(os.getenv("TELEGRAM_RATE_BURST", "3"))
+TELEGRAM_SEND_CONCURRENCY = int(os.getenv("TELEGRAM_SEND_CONCURRENCY", "3"))
+TELEGRAM_MAX_SEND_ATTEMPTS = int(os.getenv("TELEGRAM_MAX_SEND_ATTEMPTS", "5"))
+
+# -------------------------------------------------
+# 🔽 (جدید) صندوق خروجی سیگنال‌ها (outbox) 🔽
+# -------------------------------------------------
+# fillهای قدیمی‌تر از این (مثلاً حاصل backfill) سیگنال تولید نمی‌کنند
+SIGNAL_MAX_FILL_AGE_MINUTES = int(os.getenv("SIGNAL_MAX_FILL_AGE_MINUTES", "60"))
+# سیگنال‌های ارسال نشده قدیمی‌تر از این دیگر ارسال نمی‌شوند
+SIGNAL_OUTBOX_MAX_AGE_MINUTES = int(os.getenv("SIGNAL_OUTBOX_MAX_AGE_MINUTES", "60"))
+SIGNAL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("SIGNAL_OUTBOX_MAX_ATTEMPTS", "5"))
+# مدت lease ردیف‌های در حال ارسال (باید از طولانی‌ترین انتظار flood control تلگرام بیشتر باشد)؛
+# اگر ارسال‌کننده در این مدت نتیجه را ثبت نکند، ردیف دوباره قابل برداشتن است
+SIGNAL_OUTBOX_CLAIM_SECONDS = int(os.getenv("SIGNAL_OUTBOX_CLAIM_SECONDS", "600"))
+OUTBOX_DELIVERY_INTERVAL_SECONDS = int(os.getenv("OUTBOX_DELIVERY_INTERVAL_SECONDS", "30"))
+
+# -------------------------------------------------
+# 🔽 (جدید) ساخت گزارش‌ها (reporting.py) 🔽
+# -------------------------------------------------
+# تعداد threadهای ساخت عکس/CSV/خروجی کنسول
+REPORT_RENDER_WORKERS = int(os.getenv("REPORT_RENDER_WORKERS", "3"))
+# اگر محتوای جدول تغییری نکرده باشد، فایل جدید فقط یک hardlink به فایل قبلی است
+REPORT_SKIP_UNCHANGED = os.getenv("REPORT_SKIP_UNCHANGED", "true").lower() == "true"
+
+# -------------------------------------------------
+# 🔽 (جدید) خروجی استریم query_example.py 🔽
+# -------------------------------------------------
+# تعداد ردیفی که در هر نوبت از cursor سمت سرور خوانده می‌شود (حافظه ثابت مستقل از حجم تاریخچه)
+QUERY_YIELD_PER = int(os.getenv("QUERY_YIELD_PER", "2000"))
+# حداکثر ردیف جدول کنسول و عکس (CSV و JSON Lines محدودیتی ندارند)
+QUERY_TABLE_LIMIT = int(os.getenv("QUERY_TABLE_LIMIT", "200"))
+
+# -------------------------------------------------
+# 🔽 (جدید) لاگ ساخت‌یافته و متریک‌ها 🔽
+# -------------------------------------------------
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" (key=value خوانا) یا "json" (یک شیء JSON در هر خط)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# endpoint محلی /metrics (فرمت Prometheus) و /metrics.json؛ 0 یعنی غیرفعال
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_DUMP_PATH = os.getenv("METRICS_DUMP_PATH", "results/metrics.json")
+METRICS_DUMP_INTERVAL_SECONDS = int(os.getenv("METRICS_DUMP_INTERVAL_SECONDS", "60"))
+
+# -------------------------------------------------
+# 🔽 (جدید) کشف تریدرها (discover_traders.py) 🔽
+# -------------------------------------------------
+# تعداد تریدرهای برتر (بر اساس PNL کل) که دنبال می‌شوند
+MAX_TRADERS_TO_TRACK = int(os.getenv("MAX_TRADERS_TO_TRACK", "5"))
+# لیدربورد به صورت جریانی و در تکه‌هایی به این اندازه (بایت) خوانده می‌شود
+LEADERBOARD_CHUNK_BYTES = int(os.getenv("LEADERBOARD_CHUNK_BYTES", "65536"))
+# برای رتبه‌بندی از PNL کدام بازه استفاده شود: day، week، month یا allTime
+LEADERBOARD_WINDOW = os.getenv("LEADERBOARD_WINDOW", "allTime")
+# حداقل PNL (در همان بازه) برای دنبال شدن یک تریدر
+MIN_TRADER_PNL = float(os.getenv("MIN_TRADER_PNL", "0"))
+# هر دانلود لیدربورد به صورت فشرده (gzip) با زمان دانلود در این پوشه نگه داشته می‌شود
+LEADERBOARD_SNAPSHOT_DIR = os.getenv("LEADERBOARD_SNAPSHOT_DIR", "results/leaderboard")
+LEADERBOARD_SNAPSHOTS_TO_KEEP = int(os.getenv("LEADERBOARD_SNAPSHOTS_TO_KEEP", "14"))
+
+# -------------------------------------------------
+# 🔽 (جدید) API داشبورد (dashboard.py) 🔽
+# -------------------------------------------------
+DASHBOARD_HOST = os.getenv("DASHBOARD_HOST", "0.0.0.0")
+DASHBOARD_PORT = int(os.getenv("DASHBOARD_PORT", "8080"))
+# هر چند ثانیه fillهای جدید (دسته‌های جدید collector) بررسی و کش به‌روز شود
+DASHBOARD_REFRESH_SECONDS = float(os.getenv("DASHBOARD_REFRESH_SECONDS", "5"))
+# بارگذاری کامل دوره‌ای برای همگام ماندن با بازسازی جدول positions یا حذف پارتیشن‌ها
+DASHBOARD_FULL_RELOAD_SECONDS = int(os.getenv("DASHBOARD_FULL_RELOAD_SECONDS", "3600"))
+DASHBOARD_SIGNALS_LIMIT = int(os.getenv("DASHBOARD_SIGNALS_LIMIT", "200"))
+
+# -------------------------------------------------
+# 🔽 (جدید) bucketهای دقیقه‌ای فعالیت (activity.py) 🔽
+# -------------------------------------------------
+# bucketهای قدیمی‌تر از این (ساعت) حذف می‌شوند؛ باید از طولانی‌ترین بازه تحلیل‌ها بیشتر باشد
+ACTIVITY_BUCKET_RETENTION_HOURS = int(os.getenv("ACTIVITY_BUCKET_RETENTION_HOURS", "48"))
@@ -0,0 +1,312 @@
+# collector/dashboard.py
+
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from sqlalchemy import func, tuple_, text
+from config import (
+    DASHBOARD_HOST, DASHBOARD_PORT, DASHBOARD_REFRESH_SECONDS,
+    DASHBOARD_FULL_RELOAD_SECONDS, DASHBOARD_SIGNALS_LIMIT
+)
+from database import init_db, SessionLocal, Fill, Position, TrackedTrader, SignalOutbox
+from ingest import ingest_barrier
+from analysis_logic import get_open_positions, aggregate_sentiment, summarize_position
+from logs import get_logger
+from metrics import DASHBOARD_REQUESTS, DASHBOARD_CACHE_REFRESH_SECONDS, start_metrics_exporters
+
+log = get_logger("dashboard")
+
+# تعداد کلیدهای (تریدر، دارایی) در هر کوئری IN
+KEY_CHUNK_SIZE = 500
+# سقف تعداد پاسخ‌های آماده (ترکیب‌های مسیر و پارامتر) در حافظه
+MAX_CACHED_RESPONSES = 1024
+
+
+class DashboardCache:
+    """
+    تصویر درون‌حافظه‌ای پوزیشن‌های باز، سنتیمنت، سیگنال‌های اخیر و خلاصه تریدرها.
+    هر refresh فقط fillهایی را می‌بیند که بعد از آخرین fill.id دیده شده درج شده‌اند
+    (یعنی دسته‌های جدید collector) و فقط پوزیشن‌های (تریدر، دارایی) تغییرکرده را دوباره می‌خواند؛
+    درخواست‌های کلاینت‌ها فقط از همین کش پاسخ داده می‌شوند و به دیتابیس نمی‌رسند.
+    """
+
+    def __init__(self, signals_limit=DASHBOARD_SIGNALS_LIMIT, full_reload_seconds=DASHBOARD_FULL_RELOAD_SECONDS):
+        self.signals_limit = signals_limit
+        self.full_reload_seconds = full_reload_seconds
+        self.positions = {}
+        self.trader_pnl = {}
+        self.signals = []
+        self.views = {}
+        self.last_fill_id = None
+        self.last_full_reload = 0.0
+        self.refreshed_at = None
+        self.version = 0
+        self._lock = threading.Lock()
+        self._responses = {}
+
+    # -------------------------------------------------
+    # بارگذاری از دیتابیس
+    # -------------------------------------------------
+    def _load_changed_positions(self, session, keys):
+        changed = {key: None for key in keys}
+        keys = list(keys)
+        for start in range(0, len(keys), KEY_CHUNK_SIZE):
+            rows = session.query(
+                Position.user_address, Position.asset, Position.buy_volume, Position.sell_volume,
+                Position.weighted_buy_sum, Position.weighted_sell_sum
+            ).filter(tuple_(Position.user_address, Position.asset).in_(keys[start:start + KEY_CHUNK_SIZE])).all()
+            for row in rows:
+                changed[(row[0], row[1])] = summarize_position(*row)
+        return changed
+
+    def refresh(self):
+        """
+        کش را به‌روز می‌کند و True برمی‌گرداند اگر چیزی تغییر کرده باشد.
+        """
+        full = self.last_fill_id is None or time.monotonic() - self.last_full_reload >= self.full_reload_seconds
+        with SessionLocal() as session, DASHBOARD_CACHE_REFRESH_SECONDS.time(mode="full" if full else "incremental"):
+            connection = session.connection(execution_options={
+                "isolation_level": "REPEATABLE READ",
+                "postgresql_readonly": True
+            })
+            # مثل AnalysisSnapshot: snapshot پس از commit همه درج‌های در جریان گرفته می‌شود تا fill با id
+            # کوچک‌تر که دیرتر commit می‌شود پشت max_fill_id جا نماند (و پوزیشن‌ها با همان fills سازگار باشند)
+            with ingest_barrier(session.get_bind()):
+                connection.execute(text("SELECT 1"))
+            max_fill_id = session.query(func.max(Fill.id)).scalar() or 0
+            if full:
+                positions = {(pos["user"], pos["asset"]): pos for pos in get_open_positions(session)}
+                changed_positions = None
+            elif max_fill_id > self.last_fill_id:
+                keys = session.query(Fill.user_address, Fill.asset).filter(
+                    Fill.id > self.last_fill_id, Fill.id <= max_fill_id
+                ).distinct().all()
+                changed_positions = self._load_changed_positions(session, {tuple(key) for key in keys})
+            else:
+                changed_positions = {}
+            trader_pnl = dict(session.query(TrackedTrader.user_address, TrackedTrader.pnl).all())
+            signals = [
+                {
+                    "id": signal.id, "analysis": signal.analysis, "created_at": signal.created_at,
+                    "sent_at": signal.sent_at, "message": signal.message,
+                }
+                for signal in session.query(SignalOutbox).order_by(SignalOutbox.id.desc()).limit(self.signals_limit)
+            ]
+            session.rollback()
+
+        with self._lock:
+            if full:
+                self.positions = positions
+                self.last_full_reload = time.monotonic()
+            for key, position in changed_positions.items() if changed_positions else ():
+                if position is None:
+                    self.positions.pop(key, None)
+                else:
+                    self.positions[key] = position
+            changed = full or bool(changed_positions) or trader_pnl != self.trader_pnl or signals != self.signals
+            self.trader_pnl = trader_pnl
+            self.signals = signals
+            self.last_fill_id = max_fill_id
+            self.refreshed_at = int(time.time() * 1000)
+            if changed:
+                self.views = self._build_views()
+                self.version += 1
+                self._responses = {}
+        if changed:
+            log.info("🔄 Dashboard cache refreshed", extra={
+                "mode": "full" if full else "incremental", "last_fill_id": max_fill_id,
+                "changed_positions": len(self.positions) if full else len(changed_positions),
+            })
+        return changed
+
+    # -------------------------------------------------
+    # نماهای آماده (یک بار پس از هر تغییر محاسبه می‌شوند)
+    # -------------------------------------------------
+    def _build_views(self):
+        positions = sorted(self.positions.values(), key=lambda pos: pos["position_value"], reverse=True)
+        weights_map = {address: pnl for address, pnl in self.trader_pnl.items() if pnl and pnl > 0}
+
+        traders = {}
+        for address, pnl in self.trader_pnl.items():
+            traders[address] = {
+                "user": address, "pnl": pnl, "tracked": True, "open_positions": 0,
+                "long_value": 0.0, "short_value": 0.0, "net_value": 0.0,
+            }
+        for pos in positions:
+            summary = traders.setdefault(pos["user"], {
+                "user": pos["user"], "pnl": None, "tracked": False, "open_positions": 0,
+                "long_value": 0.0, "short_value": 0.0, "net_value": 0.0,
+            })
+            summary["open_positions"] += 1
+            if pos["side"] == "Long":
+                summary["long_value"] += pos["position_value"]
+                summary["net_value"] += pos["position_value"]
+            else:
+                summary["short_value"] += pos["position_value"]
+                summary["net_value"] -= pos["position_value"]
+
+        return {
+            "positions": positions,
+            "sentiment": {
+                "raw": aggregate_sentiment(positions, weights_map=None),
+                "weighted": aggregate_sentiment(positions, weights_map=weights_map) if weights_map else [],
+            },
+            "traders": sorted(traders.values(), key=lambda trader: trader["pnl"] or 0, reverse=True),
+        }
+
+    def _status(self):
+        return {
+            "version": self.version,
+            "refreshed_at": self.refreshed_at,
+            "last_fill_id": self.last_fill_id,
+            "open_positions": len(self.positions),
+            "tracked_traders": len(self.trader_pnl),
+        }
+
+    def _payload(self, path, params):
+        """
+        داده هر endpoint؛ None یعنی مسیر پیدا نشد.
+        """
+        if path == "/api/positions":
+            positions = self.views["positions"]
+            if "user" in params:
+                positions = [pos for pos in positions if pos["user"] == params["user"]]
+            if "asset" in params:
+                positions = [pos for pos in positions if pos["asset"] == params["asset"]]
+            return positions
+        if path == "/api/sentiment":
+            return self.views["sentiment"]
+        if path == "/api/signals":
+            signals = self.signals
+            if "analysis" in params:
+                signals = [signal for signal in signals if signal["analysis"] == params["analysis"]]
+            return signals[:int(params.get("limit", self.signals_limit))]
+        if path == "/api/traders":
+            return self.views["traders"]
+        if path.startswith("/api/traders/"):
+            address = path[len("/api/traders/"):]
+            summary = next((trader for trader in self.views["traders"] if trader["user"] == address), None)
+            if summary is None:
+                return None
+            return dict(summary, positions=[pos for pos in self.views["positions"] if pos["user"] == address])
+        return None
+
+    def response(self, path, params):
+        """
+        (بدنه JSON، ETag) را برمی‌گرداند؛ پاسخ هر (مسیر، پارامترها) تا تغییر بعدی کش نگه داشته می‌شود.
+        """
+        key = (path, tuple(sorted(params.items())))
+        with self._lock:
+            if path == "/api/status":
+                body = json.dumps(self._status(), separators=(",", ":")).encode("utf-8")
+                return body, None
+            cached = self._responses.get(key)
+            if cached is not None:
+                return cached
+            if not self.views:
+                return None
+            payload = self._payload(path, params)
+            if payload is None:
+                return None
+            body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+            # ETag از محتوا ساخته می‌شود تا تغییر یک endpoint پاسخ 304 بقیه را باطل نکند
+            etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+            if len(self._responses) >= MAX_CACHED_RESPONSES:
+                self._responses.clear()
+            self._responses[key] = (body, etag)
+            return body, etag
+
+
+# -------------------------------------------------
+# سرور HTTP
+# -------------------------------------------------
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def _endpoint_label(path):
+    return "/api/traders/:address" if path.startswith("/api/traders/") else path
+
+
+class _DashboardHandler(BaseHTTPRequestHandler):
+    cache = None
+
+    def _send(self, status, body=b"", etag=None, content_type="application/json"):
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        if status != 304:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/") or "/"
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            result = self.cache.response(path, params)
+        except ValueError:
+            result, status = None, 400
+        else:
+            status = 404 if result is None else 200
+
+        if result is None:
+            if status == 404 and not self.cache.views:
+                status = 503
+            self._send(status, json.dumps({"error": self.responses[status][0]}).encode("utf-8"))
+        else:
+            body, etag = result
+            if _etag_matches(self.headers.get("If-None-Match"), etag):
+                status = 304
+            self._send(status, body, etag)
+        DASHBOARD_REQUESTS.inc(endpoint=_endpoint_label(path) if status != 404 else "unknown", status=status)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_dashboard_server(cache, port=DASHBOARD_PORT, host=DASHBOARD_HOST):
+    handler = type("DashboardHandler", (_DashboardHandler,), {"cache": cache})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="dashboard-http", daemon=True).start()
+    log.info("🖥️  Dashboard API listening", extra={"host": host, "port": port})
+    return server
+
+
+def refresh_forever(cache, interval=DASHBOARD_REFRESH_SECONDS, stop_event=None):
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            cache.refresh()
+        except Exception:
+            log.exception("❌ Dashboard cache refresh failed")
+        stop_event.wait(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve open positions, sentiment, signals and trader summaries as JSON.")
+    parser.add_argument("--host", default=DASHBOARD_HOST)
+    parser.add_argument("--port", type=int, default=DASHBOARD_PORT)
+    parser.add_argument("--refresh", type=float, default=DASHBOARD_REFRESH_SECONDS, help="Seconds between cache refreshes")
+    args = parser.parse_args()
+
+    init_db()
+    start_metrics_exporters()
+    dashboard_cache = DashboardCache()
+    start_dashboard_server(dashboard_cache, args.port, args.host)
+    try:
+        refresh_forever(dashboard_cache, args.refresh)
+    except KeyboardInterrupt:
+        log.info("🛑 Dashboard stopped.")
@@ -4,35 +4,86 @@ from sqlalchemy import (
     create_engine,
     Column,
     Integer,  # برای ستون id
+    SmallInteger,
+    LargeBinary,
     String,
     Float,
     BigInteger,
-    Boolean
+    Boolean,
+    Index,
+    Text,
+    text,
+    func,
+    MetaData
 )
 from sqlalchemy.orm import sessionmaker, declarative_base
-from config import DATABASE_URL
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from config import DATABASE_URL, FILLS_STORAGE
 
-engine = create_engine(DATABASE_URL)
+
+def engine_url(url):
+    """
+    درایور PostgreSQL را psycopg2 (requirements.txt) تعیین می‌کند؛ SQLAlchemy 2.1 برای آدرس
+    postgresql:// به طور پیش‌فرض psycopg نسخه ۳ را بارگذاری می‌کند که نصب نیست.
+    """
+    url = make_url(url)
+    if url.drivername == "postgresql":
+        url = url.set(drivername="postgresql+psycopg2")
+    return url
+
+
+engine = create_engine(engine_url(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+# جداول چیدمان فشرده fills جدا نگه داشته می‌شوند تا فقط در حالت FILLS_STORAGE=compact ساخته شوند
+CompactBase = declarative_base()
+
+COMPACT_STORAGE = FILLS_STORAGE == "compact"
+# جدول فیزیکی fills (پارتیشن‌بندی شده)؛ در حالت compact نام "fills" یک view سازگار با چیدمان قدیمی است
+FILLS_TABLE = "fills_compact" if COMPACT_STORAGE else "fills"
+# قیمت، حجم و PNL در حالت compact به صورت عدد صحیح ضرب در این مقیاس ذخیره می‌شوند
+COMPACT_SCALE = 10 ** 8
 
 class Fill(Base):
     __tablename__ = "fills"
 
     # راه حل نهایی: یک id عددی و خودکار به عنوان کلید اصلی 🔑
-    id = Column(Integer, primary_key=True, index=True)
+    # (در جدول پارتیشن‌بندی شده، کلید اصلی باید ستون پارتیشن یعنی timestamp را هم شامل شود)
+    # (کلید اصلی (id, timestamp) کوئری‌های بازه id را پوشش می‌دهد و ایندکس جدا لازم ندارد)
+    id = Column(Integer, primary_key=True, autoincrement=True)
 
     # بقیه ستون‌ها به عنوان داده‌های معمولی ذخیره می‌شوند
-    hash = Column(String, index=True)
-    oid = Column(BigInteger, index=True)
-    user_address = Column(String, index=True)
-    asset = Column(String, index=True)
+    hash = Column(String)
+    oid = Column(BigInteger)
+    user_address = Column(String)
+    asset = Column(String)
     price = Column(Float)
     size = Column(Float)
     is_buy = Column(Boolean)
     direction = Column(String)
     pnl = Column(Float, nullable=True)
-    timestamp = Column(BigInteger, index=True)
+    timestamp = Column(BigInteger, primary_key=True, index=True)
+    # شناسه یکتای معامله در صرافی؛ hash برای هر fill یکتا نیست (یک تراکنش چند fill دارد)
+    tid = Column(BigInteger, nullable=True)
+
+    __table_args__ = (
+        # کلید طبیعی: یک معامله (tid) برای هر کاربر فقط یک بار ذخیره می‌شود
+        # (timestamp هر tid ثابت است و ایندکس یکتای جدول پارتیشن‌بندی شده باید آن را شامل شود)
+        Index("uq_fills_user_tid_time", "user_address", "tid", "timestamp", unique=True),
+        # 🔽 (جدید) ایندکس‌های متناسب با کوئری‌های واقعی (migrations.py؛ بررسی: python migrations.py explain) 🔽
+        # آخرین معامله هر تریدر (collector) و تاریخچه یک تریدر به ترتیب زمان
+        Index("ix_fills_user_time", "user_address", "timestamp"),
+        # fillهای باز کننده اخیر (تحلیل new_trades)؛ فقط بخش کوچکی از جدول را شامل می‌شود
+        Index("ix_fills_open_time", "timestamp", "id", postgresql_where=text("direction LIKE 'Open %'")),
+        # تجمیع کامل پوزیشن‌ها بر اساس (تریدر، دارایی) با index-only scan
+        Index(
+            "ix_fills_user_asset_cover", "user_address", "asset",
+            postgresql_include=["is_buy", "size", "price", "timestamp"]
+        ),
+        # پارتیشن‌بندی بازه‌ای بر اساس زمان (پارتیشن‌ها توسط partitions.py ساخته می‌شوند)
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
 class TrackedTrader(Base):
     """
@@ -46,4 +97,294 @@ class TrackedTrader(Base):
     pnl = Column(Float, nullable=True) # برای ذخیره سود تریدر در زمان کشف شدن
 
     def __repr__(self):
-        return f"<TrackedTrader(user_address='{self.user_address}', pnl={self.pnl})>"
\ No newline at end of file
+        return f"<TrackedTrader(user_address='{self.user_address}', pnl={self.pnl})>"
+
+
+class TraderCursor(Base):
+    """
+    نشانگر پیشرفت (high-water mark) دریافت معاملات برای هر تریدر.
+    جدا از tracked_traders نگه داشته می‌شود چون آن جدول هر ۲۴ ساعت بازسازی می‌شود.
+    """
+    __tablename__ = "trader_cursors"
+
+    user_address = Column(String, primary_key=True)
+    # زمان (میلی‌ثانیه) آخرین معامله‌ای که ذخیره شده
+    last_fill_time = Column(BigInteger, nullable=True)
+
+    def __repr__(self):
+        return f"<TraderCursor(user_address='{self.user_address}', last_fill_time={self.last_fill_time})>"
+
+
+class Position(Base):
+    """
+    وضعیت تجمیعی معاملات هر (تریدر، دارایی) که هنگام درج fills به‌روز می‌شود
+    تا تحلیل‌گر مجبور به خواندن کل جدول fills نباشد. (بازسازی: python positions.py rebuild)
+    """
+    __tablename__ = "positions"
+
+    user_address = Column(String, primary_key=True)
+    asset = Column(String, primary_key=True)
+    buy_volume = Column(Float, nullable=False, default=0.0)
+    sell_volume = Column(Float, nullable=False, default=0.0)
+    weighted_buy_sum = Column(Float, nullable=False, default=0.0)
+    weighted_sell_sum = Column(Float, nullable=False, default=0.0)
+    # حجم خالص = buy_volume - sell_volume
+    net_size = Column(Float, nullable=False, default=0.0)
+    last_fill_time = Column(BigInteger, nullable=True)
+
+    def __repr__(self):
+        return f"<Position(user_address='{self.user_address}', asset='{self.asset}', net_size={self.net_size})>"
+
+
+class FillRollup(Base):
+    """
+    تجمیع روزانه fillهای پارتیشن‌هایی که توسط سیاست نگهداری حذف شده‌اند،
+    تا بازسازی جدول positions پس از حذف داده‌های خام هم درست بماند.
+    """
+    __tablename__ = "fill_rollups_daily"
+
+    user_address = Column(String, primary_key=True)
+    asset = Column(String, primary_key=True)
+    # شروع روز (UTC) به میلی‌ثانیه
+    day = Column(BigInteger, primary_key=True)
+    buy_volume = Column(Float, nullable=False, default=0.0)
+    sell_volume = Column(Float, nullable=False, default=0.0)
+    weighted_buy_sum = Column(Float, nullable=False, default=0.0)
+    weighted_sell_sum = Column(Float, nullable=False, default=0.0)
+    pnl_sum = Column(Float, nullable=False, default=0.0)
+    fill_count = Column(Integer, nullable=False, default=0)
+    last_fill_time = Column(BigInteger, nullable=True)
+
+
+class ActivityBucket(Base):
+    """
+    تجمیع دقیقه‌ای fillهای هر (دارایی، سمت، تریدر) که هنگام درج fills به‌روز می‌شود.
+    فقط تحلیل recent_positions_24h (پوزیشن خالص ۲۴ ساعت اخیر) از جمع bucketها پاسخ داده می‌شود؛
+    زمان‌بندی poll در collection_jobs هم fill_count آن‌ها را می‌خواند. (بازسازی: python activity.py rebuild)
+    """
+    __tablename__ = "activity_buckets"
+
+    # شروع دقیقه (UTC) به میلی‌ثانیه؛ ستون اول کلید تا کوئری بازه زمانی از ایندکس استفاده کند
+    minute = Column(BigInteger, primary_key=True)
+    asset = Column(String, primary_key=True)
+    is_buy = Column(Boolean, primary_key=True)
+    user_address = Column(String, primary_key=True)
+    volume = Column(Float, nullable=False, default=0.0)
+    notional = Column(Float, nullable=False, default=0.0)
+    fill_count = Column(Integer, nullable=False, default=0)
+
+
+class SignalOutbox(Base):
+    """
+    صندوق خروجی سیگنال‌های تلگرام: هر سیگنال با dedup_key یکتا فقط یک بار ثبت
+    و توسط outbox.py (جدا از تحلیل) با تلاش مجدد ارسال می‌شود.
+    """
+    __tablename__ = "signal_outbox"
+
+    id = Column(Integer, primary_key=True)
+    analysis = Column(String, nullable=False)
+    dedup_key = Column(String, unique=True, nullable=False)
+    # متن آماده MarkdownV2
+    message = Column(Text, nullable=False)
+    created_at = Column(BigInteger, nullable=False)
+    sent_at = Column(BigInteger, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    # ردیف برداشته شده برای ارسال تا این زمان (ms) به ارسال‌کننده دیگری داده نمی‌شود
+    claimed_until = Column(BigInteger, nullable=True)
+
+    __table_args__ = (
+        Index("ix_signal_outbox_pending", "id", postgresql_where=text("sent_at IS NULL")),
+    )
+
+
+class CollectionJob(Base):
+    """
+    صف کارهای جمع‌آوری: یک ردیف برای هر تریدر دنبال شده (collection_jobs.py).
+    workerها کارهای آماده را با FOR UPDATE SKIP LOCKED و یک lease زمان‌دار برمی‌دارند.
+    """
+    __tablename__ = "collection_jobs"
+
+    user_address = Column(String, primary_key=True)
+    # زمان (میلی‌ثانیه) نوبت بعدی دریافت
+    next_run_at = Column(BigInteger, nullable=False, default=0)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(BigInteger, nullable=True)
+    last_run_at = Column(BigInteger, nullable=True)
+    # تعداد شکست‌های پشت سر هم؛ نوبت بعدی را نمایی عقب می‌اندازد (failure_backoff_seconds)
+    failures = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_collection_jobs_next_run", "next_run_at"),
+    )
+
+
+class SchemaMigration(Base):
+    """
+    مهاجرت‌های اعمال شده روی schema (migrations.py)؛ هر نسخه فقط یک بار اجرا می‌شود.
+    """
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(BigInteger, nullable=False)
+
+
+class AnalysisWatermark(Base):
+    """
+    آخرین fill.id پردازش شده توسط هر تحلیل سیگنال؛ هر اجرا فقط fillهای جدیدتر را بررسی می‌کند.
+    """
+    __tablename__ = "analysis_watermarks"
+
+    analysis = Column(String, primary_key=True)
+    last_fill_id = Column(BigInteger, nullable=False, default=0)
+
+
+# -------------------------------------------------
+# 🔽 (جدید) چیدمان فشرده fills (compact.py) 🔽
+# -------------------------------------------------
+class TraderDim(CompactBase):
+    """
+    جدول ابعاد تریدرها: آدرس ۲۰ بایتی باینری ← شناسه عددی کوچک.
+    """
+    __tablename__ = "traders"
+
+    id = Column(Integer, primary_key=True)
+    address = Column(LargeBinary(20), unique=True, nullable=False)
+
+
+class AssetDim(CompactBase):
+    """
+    جدول ابعاد دارایی‌ها: نام دارایی ← شناسه SMALLINT.
+    """
+    __tablename__ = "assets"
+
+    id = Column(SmallInteger, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
+class CompactFill(CompactBase):
+    """
+    fills با ستون‌های کوچک: شناسه تریدر و دارایی به جای رشته، hash باینری و
+    قیمت/حجم/PNL به صورت BIGINT مقیاس‌دار (مقدار × COMPACT_SCALE).
+    ایندکس‌ها همان ایندکس‌های fills هستند ولی روی شناسه‌های عددی.
+    (ستون‌های ۸ بایتی اول آمده‌اند تا padding ردیف کم شود)
+    """
+    __tablename__ = "fills_compact"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    timestamp = Column(BigInteger, primary_key=True)
+    tid = Column(BigInteger, nullable=True)
+    oid = Column(BigInteger, nullable=True)
+    price = Column(BigInteger)
+    size = Column(BigInteger)
+    pnl = Column(BigInteger, nullable=True)
+    trader_id = Column(Integer, nullable=False)
+    asset_id = Column(SmallInteger, nullable=False)
+    is_buy = Column(Boolean)
+    direction = Column(String)
+    hash = Column(LargeBinary, nullable=True)
+
+    __table_args__ = (
+        Index("uq_fills_compact_trader_tid_time", "trader_id", "tid", "timestamp", unique=True),
+        Index("ix_fills_compact_trader_time", "trader_id", "timestamp"),
+        Index("ix_fills_compact_open_time", "timestamp", "id", postgresql_where=text("direction LIKE 'Open %'")),
+        Index(
+            "ix_fills_compact_trader_asset_cover", "trader_id", "asset_id",
+            postgresql_include=["is_buy", "size", "price", "timestamp"]
+        ),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+
+# view سازگار با مدل Fill؛ خواندن‌های موجود بدون تغییر کار می‌کنند.
+# LEFT JOIN روی کلید یکتا باعث می‌شود PostgreSQL وقتی ستون‌های رشته‌ای خواسته نشده‌اند join را حذف کند.
+FILLS_COMPAT_VIEW_SQL = f"""
+    CREATE OR REPLACE VIEW fills AS
+    SELECT
+        f.id,
+        '0x' || encode(f.hash, 'hex') AS hash,
+        f.oid,
+        '0x' || encode(t.address, 'hex') AS user_address,
+        a.name AS asset,
+        f.price::float8 / {COMPACT_SCALE} AS price,
+        f.size::float8 / {COMPACT_SCALE} AS size,
+        f.is_buy,
+        f.direction,
+        f.pnl::float8 / {COMPACT_SCALE} AS pnl,
+        f.timestamp,
+        f.tid,
+        f.trader_id,
+        f.asset_id
+    FROM fills_compact f
+    LEFT JOIN traders t ON t.id = f.trader_id
+    LEFT JOIN assets a ON a.id = f.asset_id
+"""
+
+
+def fills_relation_kind(bind):
+    """
+    نوع رابطه "fills" در PostgreSQL: "table" (معمولی یا پارتیشن‌بندی شده)، "view" یا None.
+    """
+    kind = bind.execute(text("SELECT relkind FROM pg_class WHERE relname = 'fills' AND relkind IN ('r', 'p', 'v')")).scalar()
+    if kind is None:
+        return None
+    return "view" if kind == "v" else "table"
+
+
+def is_sqlite(session_or_bind):
+    bind = session_or_bind.get_bind() if hasattr(session_or_bind, "get_bind") else session_or_bind
+    return bind.dialect.name == "sqlite"
+
+
+def upsert_insert(session, table):
+    """
+    دستور INSERT با پشتیبانی ON CONFLICT برای dialect همین session.
+    محیط اصلی PostgreSQL است؛ SQLite فقط برای benchmark و آزمایش محلی پشتیبانی می‌شود.
+    """
+    if is_sqlite(session):
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+def sql_greatest(session, *values):
+    # SQLite تابع GREATEST ندارد ولی MAX چند آرگومانی همان کار را می‌کند
+    return func.max(*values) if is_sqlite(session) else func.greatest(*values)
+
+
+def init_db(bind=engine):
+    """
+    جداول را می‌سازد و مهاجرت‌های schema را اعمال می‌کند
+    (create_all ستون یا ایندکس جدید را به جدول موجود اضافه نمی‌کند؛ این کار migrations.py است).
+    """
+    from migrations import run_migrations
+
+    if is_sqlite(bind):
+        # SQLite برای کلید اصلی ترکیبی autoincrement ندارد؛ fills از یک کپی بدون autoincrement
+        # ساخته می‌شود و id هنگام درج مقداردهی می‌شود (ingest._with_sqlite_ids)
+        fills_table = Fill.__table__.to_metadata(MetaData())
+        fills_table.c.id.autoincrement = False
+        fills_table.create(bind=bind, checkfirst=True)
+        Base.metadata.create_all(bind=bind)
+        return
+    if COMPACT_STORAGE:
+        _init_compact(bind)
+    else:
+        Base.metadata.create_all(bind=bind)
+    run_migrations(bind)
+
+
+def _init_compact(bind):
+    """
+    حالت compact: جداول ابعاد و fills_compact و view سازگار "fills" به جای جدول fills.
+    اگر جدول fills قدیمی هنوز وجود دارد، ابتدا باید مهاجرت انجام شود.
+    """
+    with bind.begin() as conn:
+        if fills_relation_kind(conn) == "table":
+            raise RuntimeError("FILLS_STORAGE=compact but 'fills' is still the wide table. Run: python compact.py migrate")
+        CompactBase.metadata.create_all(bind=conn)
+        conn.execute(text(FILLS_COMPAT_VIEW_SQL))
+        Base.metadata.create_all(bind=conn, tables=[
+            table for table in Base.metadata.sorted_tables if table.name != "fills"
+        ])
+
@@ -1,116 +1,357 @@
 # collector/discover_traders.py
 
+import os
+import gzip
+import json
+import codecs
+import heapq
+import argparse
 import requests
-from config import LEADERBOARD_API_URL, HEADERS
-from database import Base, engine, SessionLocal, TrackedTrader
-from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timezone
+from config import (
+    LEADERBOARD_API_URL, HEADERS, MAX_TRADERS_TO_TRACK, LEADERBOARD_CHUNK_BYTES,
+    LEADERBOARD_WINDOW, MIN_TRADER_PNL, LEADERBOARD_SNAPSHOT_DIR, LEADERBOARD_SNAPSHOTS_TO_KEEP
+)
+from database import init_db, SessionLocal, TrackedTrader, upsert_insert
+from logs import get_logger
+from metrics import API_REQUEST_SECONDS, API_REQUESTS, DB_QUERY_SECONDS
 
-# -------------------------------------------------
-# 🔽 (جدید) متغیر برای تنظیم تعداد تریدرها 🔽
-# -------------------------------------------------
-# ⭐️ می‌توانید این عدد را به دلخواه تغییر دهید (مثلاً 50، 100 یا 200)
-MAX_TRADERS_TO_TRACK = 5
-# -------------------------------------------------
+log = get_logger("discover_traders")
 
+ROWS_KEY = '"leaderboardRows"'
+WINDOWS = ("day", "week", "month", "allTime")
+STATE_FILE = "fetch_state.json"
+SNAPSHOT_PREFIX = "leaderboard_"
+SNAPSHOT_SUFFIX = ".json.gz"
+_decoder = json.JSONDecoder()
 
-def get_all_time_pnl(performances):
+
+def get_window_pnl(performances, window_name="allTime"):
     """
-    از لیست 'windowPerformances'، سود 'allTime' را استخراج می‌کند.
+    از لیست 'windowPerformances'، سود بازه `window_name` (day/week/month/allTime) را استخراج می‌کند.
     """
     try:
         for window in performances:
-            if window[0] == "allTime":
+            if window[0] == window_name:
                 return float(window[1].get('pnl'))
     except (IndexError, ValueError, TypeError, AttributeError):
         return None
     return None
 
-def fetch_leaderboard():
-    """از API لیدربورد جدید (stats-data) داده‌ها را فراخوانی می‌کند."""
-    print(f"🚀 Fetching leaderboard from: {LEADERBOARD_API_URL}")
+
+def get_all_time_pnl(performances):
+    return get_window_pnl(performances, "allTime")
+
+
+# -------------------------------------------------
+# 🔽 (جدید) خواندن جریانی لیدربورد 🔽
+# -------------------------------------------------
+def iter_leaderboard_rows(chunks):
+    """
+    ردیف‌های آرایه leaderboardRows را یکی‌یکی از تکه‌های بایتی پاسخ برمی‌گرداند،
+    بدون اینکه کل JSON چند مگابایتی در حافظه ساخته شود؛ در هر لحظه فقط یک تکه و یک ردیف در بافر است.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer, position, exhausted = "", 0, False
+
+    def read_more():
+        nonlocal buffer, position, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buffer = buffer[position:] + decoder.decode(b"", final=True)
+        else:
+            buffer = buffer[position:] + decoder.decode(chunk)
+        position = 0
+
+    # ۱. رسیدن به ابتدای آرایه "leaderboardRows": [
+    while True:
+        key_index = buffer.find(ROWS_KEY)
+        if key_index >= 0:
+            bracket_index = buffer.find("[", key_index + len(ROWS_KEY))
+            if bracket_index >= 0:
+                position = bracket_index + 1
+                break
+        if exhausted:
+            raise ValueError("leaderboardRows array not found in response")
+        # انتهای بافر را نگه می‌داریم چون ممکن است کلید بین دو تکه شکسته شده باشد
+        position = key_index if key_index >= 0 else max(0, len(buffer) - len(ROWS_KEY))
+        read_more()
+
+    # ۲. ردیف‌ها: هر بار یک شیء JSON کامل
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position >= len(buffer):
+            if exhausted:
+                raise ValueError("Leaderboard response ended inside leaderboardRows")
+            read_more()
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            row, end = _decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # ردیف هنوز کامل دریافت نشده است
+            if exhausted:
+                raise
+            read_more()
+            continue
+        position = end
+        yield row
+
+
+def select_top_traders(rows, limit=MAX_TRADERS_TO_TRACK, window=LEADERBOARD_WINDOW, min_pnl=MIN_TRADER_PNL):
+    """
+    در حین خواندن، فقط `limit` تریدر برتر (PNL بازه `window` بیشتر از `min_pnl`) را در یک min-heap نگه می‌دارد.
+    خروجی: (لیست (address, pnl) به ترتیب نزولی PNL، تعداد تریدرهای واجد شرایط)
+    """
+    heap = []
+    profitable = 0
+    for trader_data in rows:
+        try:
+            address = trader_data.get('ethAddress')
+            pnl_value = get_window_pnl(trader_data.get('windowPerformances', []), window)
+        except AttributeError:
+            continue
+
+        if not address or pnl_value is None or pnl_value <= min_pnl:
+            continue
+        profitable += 1
+        if len(heap) < limit:
+            heapq.heappush(heap, (pnl_value, address))
+        elif pnl_value > heap[0][0]:
+            heapq.heapreplace(heap, (pnl_value, address))
+
+    top = sorted(heap, reverse=True)
+    return [(address, pnl_value) for pnl_value, address in top], profitable
+
+
+# -------------------------------------------------
+# 🔽 (جدید) snapshotهای فشرده و درخواست شرطی 🔽
+# -------------------------------------------------
+def load_fetch_state(snapshot_dir=LEADERBOARD_SNAPSHOT_DIR):
+    """
+    ETag / Last-Modified آخرین دانلود موفق و نام snapshot مربوط به آن.
+    """
+    try:
+        with open(os.path.join(snapshot_dir, STATE_FILE), encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_fetch_state(snapshot_dir, state):
+    path = os.path.join(snapshot_dir, STATE_FILE)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def list_snapshots(snapshot_dir=LEADERBOARD_SNAPSHOT_DIR):
+    """
+    مسیر snapshotها به ترتیب زمان دانلود (نام فایل شامل زمان UTC است، پس مرتب‌سازی الفبایی کافی است).
+    """
     try:
-        response = requests.get(LEADERBOARD_API_URL, headers=HEADERS, timeout=30)
-        response.raise_for_status()
-        return response.json().get('leaderboardRows', [])
-    
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Error fetching leaderboard: {e}")
+        names = os.listdir(snapshot_dir)
+    except FileNotFoundError:
+        return []
+    return [
+        os.path.join(snapshot_dir, name) for name in sorted(names)
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+    ]
+
+
+def latest_snapshot(snapshot_dir=LEADERBOARD_SNAPSHOT_DIR):
+    snapshots = list_snapshots(snapshot_dir)
+    return snapshots[-1] if snapshots else None
+
+
+def _prune_snapshots(snapshot_dir, keep=LEADERBOARD_SNAPSHOTS_TO_KEEP):
+    for path in list_snapshots(snapshot_dir)[:-keep] if keep > 0 else []:
+        os.remove(path)
+
+
+def iter_snapshot_chunks(path, chunk_size=LEADERBOARD_CHUNK_BYTES):
+    with gzip.open(path, "rb") as snapshot_file:
+        while True:
+            chunk = snapshot_file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def rank_snapshot(path, limit=MAX_TRADERS_TO_TRACK, window=LEADERBOARD_WINDOW, min_pnl=MIN_TRADER_PNL):
+    """
+    رتبه‌بندی دوباره از روی یک snapshot ذخیره شده، بدون دانلود مجدد.
+    """
+    return select_top_traders(iter_leaderboard_rows(iter_snapshot_chunks(path)), limit, window, min_pnl)
+
+
+def _tee(chunks, output_file):
+    for chunk in chunks:
+        output_file.write(chunk)
+        yield chunk
+
+
+def _rank_fallback(path, limit, window, min_pnl, reason):
+    if path is None:
         return None
-    except Exception as e:
-        print(f"❌ Error parsing leaderboard JSON: {e}")
+    try:
+        top_traders, eligible = rank_snapshot(path, limit, window, min_pnl)
+    except (OSError, ValueError) as e:
+        log.error("❌ Could not read leaderboard snapshot", extra={"snapshot": path, "error": str(e)})
         return None
+    log.info("📦 Ranked traders from saved snapshot", extra={"snapshot": os.path.basename(path), "reason": reason})
+    return top_traders, eligible
 
-def update_tracked_traders():
+
+def fetch_leaderboard(limit=MAX_TRADERS_TO_TRACK, window=LEADERBOARD_WINDOW, min_pnl=MIN_TRADER_PNL,
+                      snapshot_dir=LEADERBOARD_SNAPSHOT_DIR):
+    """
+    لیدربورد را با درخواست شرطی (If-None-Match / If-Modified-Since) و به صورت جریانی می‌خواند
+    و همزمان پاسخ را فشرده در یک snapshot جدید ذخیره می‌کند.
+    اگر لیدربورد تغییری نکرده باشد (304) یا دانلود خطا بدهد، رتبه‌بندی از آخرین snapshot انجام می‌شود.
+    خروجی: (تریدرهای برتر، تعداد تریدرهای واجد شرایط) یا None
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    state = load_fetch_state(snapshot_dir)
+    previous = latest_snapshot(snapshot_dir)
+    headers = dict(HEADERS)
+    # اعتبارسنج‌ها فقط وقتی فرستاده می‌شوند که snapshot متناظرشان هنوز روی دیسک باشد
+    if previous and state.get("snapshot") == os.path.basename(previous):
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+
+    log.info("🚀 Fetching leaderboard", extra={"url": LEADERBOARD_API_URL, "conditional": len(headers) > len(HEADERS)})
+    fetched_at = datetime.now(timezone.utc)
+    path = os.path.join(snapshot_dir, f"{SNAPSHOT_PREFIX}{fetched_at:%Y%m%dT%H%M%SZ}{SNAPSHOT_SUFFIX}")
+    tmp_path = f"{path}.tmp"
+    try:
+        with API_REQUEST_SECONDS.time(request_type="leaderboard"):
+            with requests.get(LEADERBOARD_API_URL, headers=headers, timeout=30, stream=True) as response:
+                if response.status_code == 304:
+                    API_REQUESTS.inc(request_type="leaderboard", status="not_modified")
+                    return _rank_fallback(previous, limit, window, min_pnl, reason="not_modified")
+                response.raise_for_status()
+                with gzip.open(tmp_path, "wb", compresslevel=6) as snapshot_file:
+                    chunks = _tee(response.iter_content(chunk_size=LEADERBOARD_CHUNK_BYTES), snapshot_file)
+                    result = select_top_traders(iter_leaderboard_rows(chunks), limit, window, min_pnl)
+                    # بقیه پاسخ (بعد از آرایه) هم باید در snapshot بیاید تا فایل JSON کامل باشد
+                    for _ in chunks:
+                        pass
+        os.replace(tmp_path, path)
+        API_REQUESTS.inc(request_type="leaderboard", status="ok")
+    except requests.exceptions.RequestException as e:
+        API_REQUESTS.inc(request_type="leaderboard", status="http_error")
+        log.error("❌ Error fetching leaderboard", extra={"error": str(e)})
+        return _rank_fallback(previous, limit, window, min_pnl, reason="fetch_failed")
+    except ValueError as e:
+        API_REQUESTS.inc(request_type="leaderboard", status="invalid_json")
+        log.error("❌ Error parsing leaderboard JSON", extra={"error": str(e)})
+        return _rank_fallback(previous, limit, window, min_pnl, reason="fetch_failed")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    _save_fetch_state(snapshot_dir, {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "snapshot": os.path.basename(path),
+        "fetched_at": fetched_at.isoformat(),
+    })
+    _prune_snapshots(snapshot_dir)
+    log.info("💾 Saved leaderboard snapshot", extra={"snapshot": os.path.basename(path), "bytes": os.path.getsize(path)})
+    return result
+
+
+# -------------------------------------------------
+# 🔽 (جدید) به‌روزرسانی تفاضلی tracked_traders 🔽
+# -------------------------------------------------
+def apply_tracked_traders(session, top_traders):
+    """
+    tracked_traders را به لیست جدید می‌رساند: تریدرهای جدید اضافه، PNL تغییرکرده به‌روز و
+    تریدرهای خارج‌شده حذف می‌شوند؛ همه در یک تراکنش، پس خواننده‌ها هیچ‌وقت جدول خالی نمی‌بینند.
+    """
+    current = dict(session.query(TrackedTrader.user_address, TrackedTrader.pnl).all())
+    wanted = dict(top_traders)
+
+    added = [address for address in wanted if address not in current]
+    updated = [address for address in wanted if address in current and current[address] != wanted[address]]
+    retired = [address for address in current if address not in wanted]
+
+    changed = added + updated
+    if changed:
+        stmt = upsert_insert(session, TrackedTrader.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[TrackedTrader.user_address],
+            set_={"pnl": stmt.excluded.pnl},
+        )
+        session.execute(stmt, [{"user_address": address, "pnl": wanted[address]} for address in changed])
+    if retired:
+        session.query(TrackedTrader).filter(
+            TrackedTrader.user_address.in_(retired)
+        ).delete(synchronize_session=False)
+    session.commit()
+    return {"added": len(added), "updated": len(updated), "retired": len(retired), "unchanged": len(wanted) - len(changed)}
+
+
+def update_tracked_traders(limit=MAX_TRADERS_TO_TRACK, window=LEADERBOARD_WINDOW, min_pnl=MIN_TRADER_PNL,
+                           snapshot=None, dry_run=False):
     """
     جدول tracked_traders را با تریدرهای سودده جدید به‌روز می‌کند.
+    اگر `snapshot` داده شود رتبه‌بندی از همان فایل انجام می‌شود و درخواستی به API ارسال نمی‌شود.
     """
-    leaderboard_data = fetch_leaderboard()
-    
-    if not leaderboard_data:
-        print("No leaderboard data fetched. Exiting.")
+    if snapshot:
+        result = _rank_fallback(snapshot, limit, window, min_pnl, reason="requested")
+    else:
+        result = fetch_leaderboard(limit, window, min_pnl)
+
+    if result is None:
+        log.warning("No leaderboard data fetched. Exiting.")
         return
 
-    new_traders_list = []
-    
-    for trader_data in leaderboard_data:
-        try:
-            address = trader_data.get('ethAddress')
-            performances = trader_data.get('windowPerformances', [])
-            pnl_value = get_all_time_pnl(performances)
-
-            # (نکته) اگر خواستید بر اساس حداقل سود فیلتر کنید،
-            # می‌توانید این شرط را تغییر دهید:
-            # if address and pnl_value is not None and pnl_value > 10000:
-            
-            if address and pnl_value is not None and pnl_value > 0:
-                new_traders_list.append(
-                    TrackedTrader(user_address=address, pnl=pnl_value)
-                )
-        except Exception:
-            continue
-    
-    if not new_traders_list:
-        print("🤷 No profitable traders found in the new data.")
+    top_traders, eligible = result
+    if not top_traders:
+        log.warning("🤷 No profitable traders found in the new data.", extra={"window": window, "min_pnl": min_pnl})
+        return
+
+    log.info("✅ Found profitable traders", extra={
+        "traders": eligible, "tracking": len(top_traders), "window": window, "min_pnl": min_pnl})
+
+    if dry_run:
+        for rank, (address, pnl_value) in enumerate(top_traders, start=1):
+            print(f"{rank:>4}. {address}  {pnl_value:,.2f}")
         return
 
-    print(f"✅ Found {len(new_traders_list)} total profitable traders.")
-
-    # -------------------------------------------------
-    # 🔽 (جدید) فیلتر کردن و مرتب‌سازی لیست 🔽
-    # -------------------------------------------------
-    # 1. مرتب‌سازی لیست بر اساس PNL (سود) به صورت نزولی (از زیاد به کم)
-    sorted_traders = sorted(new_traders_list, key=lambda trader: trader.pnl, reverse=True)
-    
-    # 2. برش لیست به تعداد MAX_TRADERS_TO_TRACK
-    filtered_traders_list = sorted_traders[:MAX_TRADERS_TO_TRACK]
-    
-    print(f"Filtering down to top {len(filtered_traders_list)} traders (based on PNL).")
-    # -------------------------------------------------
-
-    # اطمینان از ساخته شدن جدول
-    Base.metadata.create_all(bind=engine)
-    
-    with SessionLocal() as session:
+    with SessionLocal() as session, DB_QUERY_SECONDS.time(query="apply_tracked_traders"):
         try:
-            # 1. پاک کردن لیست قدیمی
-            print("🧹 Clearing old tracked traders...")
-            session.query(TrackedTrader).delete()
-            
-            # 2. اضافه کردن لیست جدید (فیلتر شده)
-            print(f"✨ Adding {len(filtered_traders_list)} new top traders to the database...")
-            # 🔽 (تغییر) از لیست فیلتر شده استفاده می‌کنیم
-            session.add_all(filtered_traders_list)
-            
-            # 3. ذخیره تغییرات
-            session.commit()
-            print(f"🎉 Successfully updated tracked_traders table.")
-            
-        except IntegrityError:
-            print("❌ Database integrity error (e.g., duplicate address). Rolling back.")
-            session.rollback()
-        except Exception as e:
-            print(f"❌ An unexpected database error occurred: {e}")
+            changes = apply_tracked_traders(session, top_traders)
+            log.info("🎉 Successfully updated tracked_traders table.", extra=changes)
+        except Exception:
+            log.exception("❌ An unexpected database error occurred")
             session.rollback()
 
 if __name__ == "__main__":
-    update_tracked_traders()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Refresh tracked_traders from the Hyperliquid leaderboard.")
+    parser.add_argument("--from-snapshot", nargs="?", const="latest", metavar="PATH",
+                        help="Rank from a saved snapshot (default: the latest one) instead of downloading")
+    parser.add_argument("--window", choices=WINDOWS, default=LEADERBOARD_WINDOW, help="PnL window used for ranking")
+    parser.add_argument("--min-pnl", type=float, default=MIN_TRADER_PNL, help="Minimum PnL in the selected window")
+    parser.add_argument("--limit", type=int, default=MAX_TRADERS_TO_TRACK, help="Number of traders to track")
+    parser.add_argument("--dry-run", action="store_true", help="Print the ranking without touching the database")
+    args = parser.parse_args()
+
+    snapshot = args.from_snapshot
+    if snapshot == "latest":
+        snapshot = latest_snapshot()
+        if snapshot is None:
+            parser.error(f"No leaderboard snapshots in {LEADERBOARD_SNAPSHOT_DIR}")
+
+    if not args.dry_run:
+        # اطمینان از ساخته شدن جدول
+        init_db()
+    update_tracked_traders(args.limit, args.window, args.min_pnl, snapshot=snapshot, dry_run=args.dry_run)
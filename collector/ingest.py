@@ -0,0 +1,198 @@
+# collector/ingest.py
+
+from contextlib import contextmanager
+from sqlalchemy import func, text
+from config import INGEST_BATCH_SIZE
+from database import Fill, TraderCursor, COMPACT_STORAGE, is_sqlite, upsert_insert, sql_greatest
+from compact import insert_compact_fills
+from positions import apply_fills_to_positions
+from activity import apply_fills_to_buckets
+from logs import get_logger
+from metrics import DB_QUERY_SECONDS, FILLS_INSERTED
+
+log = get_logger("ingest")
+
+# کلید pg_advisory_lock مانع ingest: تراکنش‌های درج fills قفل اشتراکی و snapshot تحلیل‌گر قفل انحصاری می‌گیرد
+INGEST_BARRIER_LOCK_KEY = 720_260_003
+
+
+def fill_row_from_api(address, fill):
+    """
+    یک fill خام API را به دیکشنری ستون‌های جدول fills تبدیل می‌کند.
+    اگر داده ناقص باشد None برمی‌گرداند.
+    """
+    try:
+        pnl_str = fill.get('closedPnl')
+        direction_str = fill.get('dir', '')
+        tid = fill.get('tid')
+        return {
+            "hash": fill.get('hash'),
+            "oid": fill.get('oid'),
+            "tid": int(tid) if tid is not None else None,
+            "user_address": address,
+            "asset": fill.get('coin'),
+            "price": float(fill.get('px')),
+            "size": float(fill.get('sz')),
+            "direction": direction_str,
+            "is_buy": "Open Long" in direction_str or "Close Short" in direction_str,
+            "pnl": float(pnl_str) if pnl_str else None,
+            "timestamp": int(fill.get('time'))
+        }
+    except (TypeError, ValueError):
+        return None
+
+
+def insert_fills(session, rows):
+    """
+    ردیف‌ها را با یک دستور INSERT ... ON CONFLICT DO NOTHING (executemany) درج می‌کند
+    و جداول positions و activity_buckets را با ردیف‌هایی که واقعاً درج شده‌اند به‌روز می‌کند.
+    تعداد ردیف‌های درج شده را برمی‌گرداند. (commit با فراخواننده است)
+    """
+    if not rows:
+        return 0
+    _hold_ingest_barrier(session)
+    if COMPACT_STORAGE:
+        inserted_rows = insert_compact_fills(session, rows)
+    else:
+        inserted_rows = _insert_wide_fills(session, rows)
+    apply_fills_to_positions(session, inserted_rows)
+    apply_fills_to_buckets(session, inserted_rows)
+    return len(inserted_rows)
+
+
+def _hold_ingest_barrier(session):
+    # تا پایان تراکنش نگه داشته می‌شود (چند بار گرفتن در یک تراکنش مشکلی ندارد)
+    if not is_sqlite(session):
+        session.execute(text("SELECT pg_advisory_xact_lock_shared(:key)"), {"key": INGEST_BARRIER_LOCK_KEY})
+
+
+@contextmanager
+def ingest_barrier(bind):
+    """
+    تا همه تراکنش‌های درج fills که شروع شده‌اند commit (یا rollback) شوند صبر می‌کند و تا پایان بلوک
+    درج جدید را متوقف نگه می‌دارد. snapshotی که داخل بلوک گرفته شود هیچ fill.id کوچک‌تری را
+    در تراکنش باز جا نمی‌گذارد، پس max(id) آن یک watermark مطمئن است (ترتیب id = ترتیب commit).
+    قفل روی اتصال جدا گرفته می‌شود چون اولین دستور تراکنش REPEATABLE READ خودش snapshot را می‌گیرد.
+    """
+    if is_sqlite(bind):
+        yield
+        return
+    with bind.connect() as lock_connection:
+        lock_connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": INGEST_BARRIER_LOCK_KEY})
+        try:
+            yield
+        finally:
+            lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INGEST_BARRIER_LOCK_KEY})
+            lock_connection.commit()
+
+
+def _insert_wide_fills(session, rows):
+    """
+    ردیف‌ها به صورت پارامتر executemany ارسال می‌شوند (نه .values(rows))؛ متن دستور ثابت است و
+    SQLAlchemy آن را یک بار compile و cache می‌کند و insertmanyvalues ردیف‌ها را با RETURNING دسته‌بندی می‌کند.
+    """
+    if is_sqlite(session):
+        rows = _with_sqlite_ids(session, rows)
+    stmt = upsert_insert(session, Fill.__table__).on_conflict_do_nothing(
+        index_elements=["user_address", "tid", "timestamp"]
+    ).returning(
+        Fill.user_address, Fill.asset, Fill.size, Fill.price, Fill.is_buy, Fill.direction, Fill.timestamp
+    )
+    return session.connection().execute(stmt, rows).mappings().all()
+
+
+def _with_sqlite_ids(session, rows):
+    """
+    SQLite برای کلید اصلی ترکیبی (id, timestamp) مقدار خودکار نمی‌سازد؛ id از max(id) ادامه می‌یابد.
+    """
+    next_id = (session.query(func.max(Fill.id)).scalar() or 0) + 1
+    return [dict(row, id=next_id + offset) for offset, row in enumerate(rows)]
+
+
+def upsert_cursors(session, cursors):
+    """
+    cursor چند تریدر را با یک دستور به جدیدترین زمان معامله جلو می‌برد (هرگز به عقب برنمی‌گردد).
+    """
+    if not cursors:
+        return
+    stmt = upsert_insert(session, TraderCursor.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TraderCursor.user_address],
+        # (cursor بدون زمان stream_collector؛ MAX چندآرگومانی SQLite با NULL خودش NULL می‌شود)
+        set_={"last_fill_time": sql_greatest(
+            session, func.coalesce(TraderCursor.last_fill_time, 0), stmt.excluded.last_fill_time
+        )}
+    )
+    session.connection().execute(stmt, [
+        {"user_address": address, "last_fill_time": last_time}
+        for address, last_time in cursors.items()
+    ])
+
+
+def ensure_cursor_rows(session, addresses):
+    """
+    برای تریدرهای دریافت شده از stream یک ردیف cursor بدون زمان می‌سازد (ردیف موجود تغییر نمی‌کند)
+    تا collector برای آن‌ها از max(fills.timestamp) شروع نکند و فاصله قطع اتصال را جا نیندازد.
+    """
+    if not addresses:
+        return
+    stmt = upsert_insert(session, TraderCursor.__table__).on_conflict_do_nothing(
+        index_elements=[TraderCursor.user_address]
+    )
+    session.connection().execute(stmt, [{"user_address": address, "last_fill_time": None} for address in addresses])
+
+
+class FillIngestBuffer:
+    """
+    معاملات دریافت شده از همه تریدرها را جمع می‌کند و در دسته‌های INGEST_BATCH_SIZE تایی
+    (هر دسته یک رفت و برگشت به دیتابیس) همراه با cursorها در یک تراکنش ذخیره می‌کند.
+    """
+
+    def __init__(self, session, batch_size=INGEST_BATCH_SIZE, source="poll"):
+        self.session = session
+        self.batch_size = batch_size
+        # برچسب متریک: "poll" (collector.py) یا "stream" (stream_collector.py)
+        self.source = source
+        # فقط دریافت کامل (poll) cursor را جلو می‌برد؛ stream پس از قطع اتصال ممکن است fillهایی را جا انداخته باشد
+        self.advance_cursors = source == "poll"
+        self.rows = []
+        self.cursors = {}
+        self.total_inserted = 0
+
+    def add(self, address, fills_data):
+        for fill in fills_data or []:
+            row = fill_row_from_api(address, fill)
+            if row is None:
+                continue
+            self.rows.append(row)
+            if row["timestamp"] > self.cursors.get(address, 0):
+                self.cursors[address] = row["timestamp"]
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows and not self.cursors:
+            return 0
+        try:
+            inserted = 0
+            for start in range(0, len(self.rows), self.batch_size):
+                with DB_QUERY_SECONDS.time(query="insert_fills"):
+                    inserted += insert_fills(self.session, self.rows[start:start + self.batch_size])
+            with DB_QUERY_SECONDS.time(query="upsert_cursors"):
+                if self.advance_cursors:
+                    upsert_cursors(self.session, self.cursors)
+                else:
+                    ensure_cursor_rows(self.session, list(self.cursors))
+            with DB_QUERY_SECONDS.time(query="commit"):
+                self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            received = len(self.rows)
+            self.rows = []
+            self.cursors = {}
+        self.total_inserted += inserted
+        FILLS_INSERTED.inc(inserted, source=self.source)
+        log.info("✅ Inserted fill batch", extra={"received": received, "inserted": inserted, "source": self.source})
+        return inserted
@@ -0,0 +1,74 @@
+# collector/logs.py
+
+import sys
+import json
+import logging
+from datetime import datetime, timezone
+from config import LOG_LEVEL, LOG_FORMAT
+
+# ویژگی‌های استاندارد LogRecord؛ هر چیز دیگری (از طریق extra=) فیلد ساخت‌یافته است
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+_configured = False
+
+
+def _extra_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRIBUTES}
+
+
+def _timestamp(record):
+    return datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds")
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    هر رکورد یک خط JSON: {"ts", "level", "logger", "msg", ...فیلدهای extra}
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": _timestamp(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class KeyValueFormatter(logging.Formatter):
+    """
+    قالب خوانا برای کنسول: زمان، سطح، logger، پیام و سپس فیلدهای extra به صورت key=value
+    """
+
+    def format(self, record):
+        line = f"{_timestamp(record)} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        fields = _extra_fields(record)
+        if fields:
+            line += " | " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """
+    handler ریشه را (یک بار) روی stdout تنظیم می‌کند.
+    """
+    global _configured
+    if _configured:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else KeyValueFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # لاگ هر درخواست httpx در سطح INFO برای این سرویس بیش از حد پرحرف است
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    _configured = True
+
+
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(name)
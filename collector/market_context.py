@@ -0,0 +1,137 @@
+# collector/market_context.py
+
+import os
+import json
+import time
+import threading
+import requests
+from config import (
+    API_URL,
+    HEADERS,
+    MARKET_CONTEXT_TTL_SECONDS,
+    MARKET_CONTEXT_CACHE_PATH,
+    MARKET_CONTEXT_COLD_WAIT_SECONDS
+)
+from logs import get_logger
+from metrics import API_REQUEST_SECONDS, API_REQUESTS
+
+log = get_logger("market_context")
+
+
+def _to_float(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_asset_contexts(response_json):
+    """
+    پاسخ metaAndAssetCtxs را (که به صورت [meta, [ctx, ...]] و هم‌ترتیب با universe است)
+    به دیکشنری دارایی ← {mark_px, prev_day_px, change_percent, funding, open_interest, day_ntl_vlm} تبدیل می‌کند.
+    """
+    meta, asset_ctxs = response_json[0], response_json[1]
+    contexts = {}
+    for asset_meta, ctx in zip(meta.get('universe', []), asset_ctxs):
+        asset_name = asset_meta.get('name')
+        if not asset_name:
+            continue
+        mark_px = _to_float(ctx.get('markPx'))
+        prev_px = _to_float(ctx.get('prevDayPx'))
+        change_percent = None
+        if mark_px is not None and prev_px:
+            change_percent = ((mark_px - prev_px) / prev_px) * 100
+        contexts[asset_name] = {
+            "mark_px": mark_px,
+            "prev_day_px": prev_px,
+            "change_percent": change_percent,
+            "funding": _to_float(ctx.get('funding')),
+            "open_interest": _to_float(ctx.get('openInterest')),
+            "day_ntl_vlm": _to_float(ctx.get('dayNtlVlm'))
+        }
+    return contexts
+
+
+class MarketContextService:
+    """
+    داده‌های همه دارایی‌ها را با یک درخواست metaAndAssetCtxs می‌گیرد و در حافظه و دیسک کش می‌کند.
+    اگر کش کهنه باشد، مقدار قبلی فوراً برگردانده می‌شود و به‌روزرسانی در پس‌زمینه انجام می‌شود
+    تا API کند یا خراب هرگز تحلیل‌گر را متوقف نکند.
+    """
+
+    def __init__(self, ttl=MARKET_CONTEXT_TTL_SECONDS, cache_path=MARKET_CONTEXT_CACHE_PATH):
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self._contexts = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def _load_from_disk(self):
+        try:
+            with open(self.cache_path, encoding="utf-8") as cache_file:
+                cached = json.load(cache_file)
+            self._contexts = cached["contexts"]
+            self._fetched_at = float(cached["fetched_at"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save_to_disk(self):
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as cache_file:
+            json.dump({"fetched_at": self._fetched_at, "contexts": self._contexts}, cache_file)
+        os.replace(tmp_path, self.cache_path)
+
+    def refresh(self):
+        """
+        دریافت همزمان (blocking) داده‌ها؛ در صورت خطا کش قبلی دست نخورده می‌ماند.
+        """
+        log.debug("Fetching market context from API...")
+        try:
+            with API_REQUEST_SECONDS.time(request_type="metaAndAssetCtxs"):
+                response = requests.post(API_URL, headers=HEADERS, json={"type": "metaAndAssetCtxs"}, timeout=10)
+            response.raise_for_status()
+            contexts = parse_asset_contexts(response.json())
+        except Exception as e:
+            API_REQUESTS.inc(request_type="metaAndAssetCtxs", status="error")
+            log.error("❌ Error fetching market context", extra={"error": str(e)})
+            return False
+        API_REQUESTS.inc(request_type="metaAndAssetCtxs", status="ok")
+        with self._lock:
+            self._contexts = contexts
+            self._fetched_at = time.time()
+            try:
+                self._save_to_disk()
+            except OSError as e:
+                log.warning("⚠️ Could not write market context cache", extra={"error": str(e)})
+        return True
+
+    def _start_background_refresh(self):
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return self._refresh_thread
+            self._refresh_thread = threading.Thread(target=self.refresh, name="market-context-refresh", daemon=True)
+            self._refresh_thread.start()
+            return self._refresh_thread
+
+    def get_all(self):
+        """
+        همه داده‌های بازار (ممکن است کهنه باشند). فقط وقتی هیچ کشی وجود ندارد، حداکثر
+        MARKET_CONTEXT_COLD_WAIT_SECONDS ثانیه برای اولین دریافت صبر می‌کند.
+        """
+        if self._contexts is None:
+            self._load_from_disk()
+        if time.time() - self._fetched_at >= self.ttl:
+            refresh_thread = self._start_background_refresh()
+            if self._contexts is None:
+                refresh_thread.join(timeout=MARKET_CONTEXT_COLD_WAIT_SECONDS)
+        return self._contexts or {}
+
+    def get(self, asset):
+        return self.get_all().get(asset)
+
+
+market_context_service = MarketContextService()
@@ -0,0 +1,318 @@
+# collector/metrics.py
+
+import os
+import json
+import time
+import bisect
+import asyncio
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_PORT, METRICS_HOST, METRICS_DUMP_PATH, METRICS_DUMP_INTERVAL_SECONDS
+from logs import get_logger
+
+log = get_logger("metrics")
+
+# مرزهای پیش‌فرض هیستوگرام زمان (ثانیه)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.label_names) or any(name not in labels for name in self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _label_text(self, key, extra=None):
+        pairs = list(zip(self.label_names, key)) + (extra or [])
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self._label_text(key), value) for key, value in items]
+
+    def to_dict(self):
+        with self._lock:
+            return [{"labels": dict(zip(self.label_names, key)), "value": value} for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class _Timer:
+    """
+    زمان‌سنج یک span: هم به صورت context manager و هم decorator (sync یا async) قابل استفاده است.
+    """
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+    def __call__(self, function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with _Timer(self.histogram, self.labels):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _Timer(self.histogram, self.labels):
+                return function(*args, **kwargs)
+        return wrapper
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state["counts"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def time(self, **labels):
+        self._key(labels)
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, dict(state, counts=list(state["counts"]))) for key, state in self._values.items()]
+        samples = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", self._label_text(key, [("le", f"{bound:g}")]), cumulative))
+            samples.append((f"{self.name}_bucket", self._label_text(key, [("le", "+Inf")]), state["count"]))
+            samples.append((f"{self.name}_sum", self._label_text(key), state["sum"]))
+            samples.append((f"{self.name}_count", self._label_text(key), state["count"]))
+        return samples
+
+    def to_dict(self):
+        with self._lock:
+            return [
+                {
+                    "labels": dict(zip(self.label_names, key)),
+                    "count": state["count"],
+                    "sum": round(state["sum"], 6),
+                    "avg": round(state["sum"] / state["count"], 6) if state["count"] else None,
+                }
+                for key, state in self._values.items()
+            ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._register(Gauge(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def render_prometheus(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        return {
+            "generated_at": time.time(),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "metrics": {metric.name: metric.to_dict() for metric in list(self._metrics.values())},
+        }
+
+
+REGISTRY = MetricsRegistry()
+
+# -------------------------------------------------
+# متریک‌های سرویس
+# -------------------------------------------------
+API_REQUEST_SECONDS = REGISTRY.histogram(
+    "hl_api_request_seconds", "Latency of one Hyperliquid info API request", ["request_type"])
+API_REQUESTS = REGISTRY.counter(
+    "hl_api_requests_total", "Hyperliquid info API requests by outcome", ["request_type", "status"])
+API_RETRIES = REGISTRY.counter(
+    "hl_api_retries_total", "Hyperliquid info API retries", ["reason"])
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "rate_limiter_wait_seconds", "Time spent waiting for a token bucket", ["limiter"],
+    buckets=(0, 0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60))
+TRADER_FETCH_SECONDS = REGISTRY.histogram(
+    "collector_trader_fetch_seconds", "Time to fetch all new fills of one trader (all pages)", ["mode"])
+FILLS_FETCHED = REGISTRY.counter(
+    "collector_fills_fetched_total", "Fills received from the exchange", ["source"])
+FILLS_INSERTED = REGISTRY.counter(
+    "collector_fills_inserted_total", "Fills actually inserted (after de-duplication)", ["source"])
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_seconds", "Duration of database operations", ["query"])
+ANALYSIS_SECONDS = REGISTRY.histogram(
+    "analyzer_analysis_seconds", "Duration of one analysis", ["analysis"])
+SIGNALS_EMITTED = REGISTRY.counter(
+    "signals_emitted_total", "New signals written to the outbox", ["analysis"])
+TELEGRAM_MESSAGES = REGISTRY.counter(
+    "telegram_messages_total", "Telegram messages by outcome", ["result"])
+TELEGRAM_RETRIES = REGISTRY.counter(
+    "telegram_retries_total", "Telegram send retries", ["reason"])
+TELEGRAM_SEND_SECONDS = REGISTRY.histogram(
+    "telegram_send_seconds", "Latency of one Telegram sendMessage call")
+REPORT_RENDER_SECONDS = REGISTRY.histogram(
+    "report_render_seconds", "Time to produce one report artifact", ["artifact", "result"])
+JOB_RUN_SECONDS = REGISTRY.histogram(
+    "scheduler_job_seconds", "Duration of one scheduler job run", ["job"])
+JOB_RUNS = REGISTRY.counter(
+    "scheduler_job_runs_total", "Scheduler job runs by outcome", ["job", "result"])
+COLLECTION_JOBS = REGISTRY.counter(
+    "collector_jobs_total", "Collection jobs by outcome (claimed, ok, failed, lost_lease)", ["result"])
+COLLECTOR_POLL_DEMAND = REGISTRY.gauge(
+    "collector_poll_demand_per_hour", "Trader polls per hour wanted by the adaptive schedule before budget scaling")
+COLLECTOR_POLL_SCALE = REGISTRY.gauge(
+    "collector_poll_budget_scale", "Factor applied to every poll interval to stay within the request budget")
+DASHBOARD_REQUESTS = REGISTRY.counter(
+    "dashboard_requests_total", "Dashboard API requests by endpoint and HTTP status", ["endpoint", "status"])
+DASHBOARD_CACHE_REFRESH_SECONDS = REGISTRY.histogram(
+    "dashboard_cache_refresh_seconds", "Duration of one dashboard cache refresh", ["mode"])
+
+# -------------------------------------------------
+# خروجی: HTTP /metrics و فایل JSON دوره‌ای
+# -------------------------------------------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = REGISTRY.render_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(REGISTRY.to_dict()), "application/json"
+        else:
+            self.send_error(404)
+            return
+        payload = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    endpoint محلی /metrics (Prometheus) و /metrics.json را در یک thread پس‌زمینه اجرا می‌کند.
+    """
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        log.warning("⚠️ Could not start metrics server", extra={"port": port, "error": str(e)})
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    log.info("📈 Metrics available at /metrics and /metrics.json", extra={"host": host, "port": port})
+    return server
+
+
+def dump_metrics(path=METRICS_DUMP_PATH):
+    if not path:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as dump_file:
+        json.dump(REGISTRY.to_dict(), dump_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def start_metrics_dump(path=METRICS_DUMP_PATH, interval=METRICS_DUMP_INTERVAL_SECONDS):
+    """
+    هر `interval` ثانیه همه متریک‌ها را در فایل JSON می‌نویسد.
+    """
+    if not path or interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                dump_metrics(path)
+            except OSError as e:
+                log.warning("⚠️ Could not write metrics dump", extra={"path": path, "error": str(e)})
+
+    thread = threading.Thread(target=loop, name="metrics-dump", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_metrics_exporters():
+    start_metrics_server()
+    start_metrics_dump()
@@ -0,0 +1,268 @@
+# collector/migrations.py
+
+import sys
+import time
+import argparse
+from sqlalchemy import text, select, insert, inspect, func, case
+from sqlalchemy.schema import CreateIndex
+from config import SIGNAL_MAX_FILL_AGE_MINUTES
+from database import (
+    engine, init_db, SessionLocal, Fill, CompactFill, SchemaMigration,
+    COMPACT_STORAGE, FILLS_TABLE
+)
+from logs import get_logger
+
+log = get_logger("migrations")
+
+# کلید pg_advisory_lock تا چند سرویس که همزمان بالا می‌آیند مهاجرت را دو بار اجرا نکنند
+MIGRATIONS_LOCK_KEY = 720_260_001
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """
+    ثبت یک مهاجرت؛ تابع با یک connection داخل تراکنش فراخوانی می‌شود.
+    مهاجرت‌ها باید idempotent باشند چون روی دیتابیس تازه (ساخته شده با create_all) هم اجرا می‌شوند.
+    """
+    def register(upgrade):
+        MIGRATIONS.append((version, name, upgrade))
+        return upgrade
+    return register
+
+
+def _relkind(conn, name):
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE relname = :name"), {"name": name}).scalar()
+
+
+def _is_table(conn, name):
+    # 'r' جدول معمولی، 'p' جدول پارتیشن‌بندی شده
+    return _relkind(conn, name) in ("r", "p")
+
+
+def _create_model_indexes(conn, model, names):
+    for index in model.__table__.indexes:
+        if index.name in names:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+# -------------------------------------------------
+# مهاجرت‌ها (به ترتیب نسخه؛ نسخه ثبت شده هرگز تغییر نمی‌کند)
+# -------------------------------------------------
+@migration(1, "fills_tid_natural_key")
+def _fills_tid_natural_key(conn):
+    """
+    ستون tid و کلید یکتای (user_address, tid, timestamp)؛ قبلاً در init_db اجرا می‌شد.
+    """
+    if not _is_table(conn, "fills"):
+        return
+    conn.execute(text("ALTER TABLE fills ADD COLUMN IF NOT EXISTS tid BIGINT"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_fills_user_tid_time ON fills (user_address, tid, timestamp)"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS uq_fills_user_tid"))
+
+
+@migration(2, "fills_workload_indexes")
+def _fills_workload_indexes(conn):
+    """
+    ایندکس‌های متناسب با کوئری‌ها: (user_address, timestamp)، partial روی fillهای باز کننده
+    و ایندکس پوشاننده تجمیع پوزیشن‌ها. ایندکس‌های تک‌ستونی بی‌استفاده یا تکراری حذف می‌شوند:
+    id (کلید اصلی پوشش می‌دهد)، user_address (ستون اول ایندکس‌های ترکیبی)، hash، oid و asset.
+    """
+    if _is_table(conn, "fills"):
+        _create_model_indexes(conn, Fill, {"ix_fills_user_time", "ix_fills_open_time", "ix_fills_user_asset_cover"})
+        for index_name in ("ix_fills_id", "ix_fills_hash", "ix_fills_oid", "ix_fills_user_address", "ix_fills_asset"):
+            conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+        conn.execute(text("ANALYZE fills"))
+    if _is_table(conn, "fills_compact"):
+        _create_model_indexes(conn, CompactFill, {
+            "ix_fills_compact_trader_time", "ix_fills_compact_open_time", "ix_fills_compact_trader_asset_cover"
+        })
+        conn.execute(text("ANALYZE fills_compact"))
+
+
+@migration(3, "signal_outbox_claims")
+def _signal_outbox_claims(conn):
+    """
+    ستون claimed_until: ردیف‌ها در یک تراکنش کوتاه برداشته و بیرون از تراکنش ارسال می‌شوند.
+    """
+    if _is_table(conn, "signal_outbox"):
+        conn.execute(text("ALTER TABLE signal_outbox ADD COLUMN IF NOT EXISTS claimed_until BIGINT"))
+
+
+@migration(4, "activity_buckets_drop_open_totals")
+def _activity_buckets_drop_open_totals(conn):
+    """
+    ستون‌های open_volume، open_notional و open_count هیچ‌جا خوانده نمی‌شدند و فقط هزینه درج fills بودند.
+    """
+    if _is_table(conn, "activity_buckets"):
+        for column in ("open_volume", "open_notional", "open_count"):
+            conn.execute(text(f"ALTER TABLE activity_buckets DROP COLUMN IF EXISTS {column}"))
+
+
+# -------------------------------------------------
+# اجرا
+# -------------------------------------------------
+def applied_versions(conn):
+    if not inspect(conn).has_table(SchemaMigration.__tablename__):
+        return {}
+    return dict(conn.execute(select(SchemaMigration.version, SchemaMigration.name)).all())
+
+
+def run_migrations(bind=engine):
+    """
+    مهاجرت‌های اعمال نشده را به ترتیب نسخه اجرا می‌کند؛ هر مهاجرت و ثبت نسخه‌اش در یک تراکنش.
+    تعداد مهاجرت‌های اجرا شده را برمی‌گرداند.
+    """
+    executed = 0
+    with bind.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+        try:
+            applied = applied_versions(conn)
+            conn.commit()
+            for version, name, upgrade in sorted(MIGRATIONS, key=lambda item: item[0]):
+                if version in applied:
+                    continue
+                log.info("🛠️ Applying schema migration", extra={"version": version, "migration": name})
+                started = time.monotonic()
+                with conn.begin():
+                    upgrade(conn)
+                    conn.execute(insert(SchemaMigration).values(
+                        version=version, name=name, applied_at=int(time.time() * 1000)
+                    ))
+                executed += 1
+                log.info("✅ Schema migration applied", extra={
+                    "version": version, "migration": name, "seconds": round(time.monotonic() - started, 2)
+                })
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+            conn.commit()
+    return executed
+
+
+# -------------------------------------------------
+# بررسی پلن کوئری‌ها با EXPLAIN
+# -------------------------------------------------
+# ایندکس‌های قابل قبول هر کوئری در هر چیدمان (استفاده از هر کدام کافی است)
+# آخرین معامله هر تریدر (GROUP BY) از هر ایندکسی که با تریدر شروع شود به یک اندازه سود می‌برد
+EXPECTED_INDEXES = {
+    "signal_fills": {"fills": ("ix_fills_open_time",), "fills_compact": ("ix_fills_compact_open_time",)},
+    "collector_start_times": {
+        "fills": ("ix_fills_user_time", "uq_fills_user_tid_time", "ix_fills_user_asset_cover"),
+        "fills_compact": (
+            "ix_fills_compact_trader_time", "uq_fills_compact_trader_tid_time", "ix_fills_compact_trader_asset_cover"
+        ),
+    },
+    "positions_rebuild": {"fills": ("ix_fills_user_asset_cover",), "fills_compact": ("ix_fills_compact_trader_asset_cover",)},
+}
+
+
+def _workload_queries(session, now_ms):
+    """
+    همان شکل کوئری‌های snapshot (new_trades)، collector (شروع دریافت) و positions (بازسازی).
+    """
+    max_fill_id = session.query(func.max(Fill.id)).scalar() or 0
+    sample_user = session.query(Fill.user_address).limit(1).scalar() or "0x" + "0" * 40
+    cutoff_ms = now_ms - SIGNAL_MAX_FILL_AGE_MINUTES * 60 * 1000
+    return {
+        "signal_fills": session.query(
+            Fill.id, Fill.tid, Fill.user_address, Fill.asset, Fill.direction, Fill.price, Fill.size, Fill.timestamp
+        ).filter(
+            Fill.id > max_fill_id - 1000,
+            Fill.id <= max_fill_id,
+            Fill.timestamp >= cutoff_ms,
+            Fill.direction.like('Open %')
+        ).order_by(Fill.timestamp.desc()),
+        "collector_start_times": session.query(Fill.user_address, func.max(Fill.timestamp)).filter(
+            Fill.user_address.in_([sample_user])
+        ).group_by(Fill.user_address),
+        "positions_rebuild": session.query(
+            Fill.user_address,
+            Fill.asset,
+            func.sum(case((Fill.is_buy, Fill.size), else_=0.0)),
+            func.sum(case((Fill.is_buy, 0.0), else_=Fill.size)),
+            func.sum(case((Fill.is_buy, Fill.size * Fill.price), else_=0.0)),
+            func.sum(case((Fill.is_buy, 0.0), else_=Fill.size * Fill.price)),
+            func.max(Fill.timestamp)
+        ).group_by(Fill.user_address, Fill.asset),
+    }
+
+
+def _plan_scans(plan, scans):
+    """
+    (نوع گره، جدول، ایندکس) همه گره‌های scan پلن را جمع می‌کند.
+    """
+    if "Scan" in plan.get("Node Type", ""):
+        scans.append((plan["Node Type"], plan.get("Relation Name"), plan.get("Index Name")))
+    for child in plan.get("Plans", ()):
+        _plan_scans(child, scans)
+    return scans
+
+
+def _parent_index_names(session):
+    # ایندکس هر پارتیشن نام خودکار دارد؛ نگاشت به ایندکس جدول اصلی
+    return dict(session.execute(text(
+        "SELECT c.relname, p.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE c.relkind = 'i'"
+    )).all())
+
+
+def explain_workload(session, disable_seqscan=False, now_ms=None):
+    """
+    پلن کوئری‌های اصلی را با EXPLAIN می‌گیرد و بررسی می‌کند ایندکس مورد انتظار استفاده شده باشد.
+    disable_seqscan: برای دیتابیس‌های کوچک توسعه که planner در آن‌ها seq scan را ارزان‌تر می‌بیند.
+    خروجی: لیست {"query", "expected", "indexes", "seq_scans", "ok"}
+    """
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    if disable_seqscan:
+        session.execute(text("SET LOCAL enable_seqscan = off"))
+    parents = _parent_index_names(session)
+    results = []
+    for name, query in _workload_queries(session, now_ms).items():
+        compiled = query.statement.compile(
+            dialect=session.get_bind().dialect, compile_kwargs={"render_postcompile": True}
+        )
+        plan = session.connection().exec_driver_sql(
+            "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params
+        ).scalar()[0]["Plan"]
+        scans = _plan_scans(plan, [])
+        indexes = {parents.get(index, index) for _, _, index in scans if index}
+        expected = EXPECTED_INDEXES[name][FILLS_TABLE]
+        results.append({
+            "query": name,
+            "expected": expected,
+            "indexes": sorted(indexes),
+            "seq_scans": sorted({relation for node, relation, _ in scans if node == "Seq Scan"}),
+            "ok": bool(indexes.intersection(expected)),
+        })
+    session.rollback()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations and check index usage.")
+    parser.add_argument(
+        "command", choices=["migrate", "status", "explain"],
+        help="migrate: apply pending migrations | status: list migrations | explain: check workload query plans"
+    )
+    parser.add_argument("--no-seqscan", action="store_true", help="explain: disable seq scans (small dev databases)")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        init_db()
+        log.info("🎉 Schema is up to date", extra={"storage": "compact" if COMPACT_STORAGE else "wide"})
+    elif args.command == "status":
+        with engine.connect() as connection:
+            applied = applied_versions(connection)
+        for version, name, _ in sorted(MIGRATIONS, key=lambda item: item[0]):
+            print(f"{version:>4}  {name:<32} {'applied' if version in applied else 'pending'}")
+    elif args.command == "explain":
+        with SessionLocal() as session:
+            results = explain_workload(session, disable_seqscan=args.no_seqscan)
+        for result in results:
+            status = "✅" if result["ok"] else "❌"
+            print(f"{status} {result['query']:<24} expected={'|'.join(result['expected'])} "
+                  f"used={','.join(result['indexes']) or '-'} seq_scans={','.join(result['seq_scans']) or '-'}")
+        sys.exit(0 if all(result["ok"] for result in results) else 1)
@@ -0,0 +1,132 @@
+# collector/outbox.py
+
+import time
+import asyncio
+from sqlalchemy import or_
+from config import (
+    SIGNAL_OUTBOX_MAX_AGE_MINUTES,
+    SIGNAL_OUTBOX_MAX_ATTEMPTS,
+    SIGNAL_OUTBOX_CLAIM_SECONDS
+)
+from database import init_db, SessionLocal, SignalOutbox, AnalysisWatermark, upsert_insert, sql_greatest
+from telegram_sender import init_bot, TelegramDispatcher
+from logs import get_logger
+from metrics import SIGNALS_EMITTED, DB_QUERY_SECONDS
+
+log = get_logger("outbox")
+
+DELIVERY_BATCH_SIZE = 200
+
+
+def load_watermarks(session):
+    return dict(session.query(AnalysisWatermark.analysis, AnalysisWatermark.last_fill_id).all())
+
+
+def emit_signals(analysis, signals, last_fill_id):
+    """
+    سیگنال‌ها [(dedup_key, message), ...] را در outbox ثبت و watermark تحلیل را جلو می‌برد؛
+    هر دو در یک تراکنش. سیگنال تکراری (dedup_key موجود) نادیده گرفته می‌شود.
+    تعداد سیگنال‌های جدید را برمی‌گرداند.
+    """
+    now_ms = int(time.time() * 1000)
+    with SessionLocal() as session:
+        inserted = 0
+        if signals:
+            stmt = upsert_insert(session, SignalOutbox.__table__).on_conflict_do_nothing(
+                index_elements=["dedup_key"]
+            ).returning(SignalOutbox.id)
+            inserted = len(session.connection().execute(stmt, [
+                {"analysis": analysis, "dedup_key": dedup_key, "message": message, "created_at": now_ms, "attempts": 0}
+                for dedup_key, message in signals
+            ]).all())
+
+        _advance_watermark(session, analysis, last_fill_id)
+        session.commit()
+    SIGNALS_EMITTED.inc(inserted, analysis=analysis)
+    return inserted
+
+
+def _advance_watermark(session, analysis, last_fill_id):
+    watermark = upsert_insert(session, AnalysisWatermark).values(analysis=analysis, last_fill_id=last_fill_id)
+    watermark = watermark.on_conflict_do_update(
+        index_elements=[AnalysisWatermark.analysis],
+        set_={"last_fill_id": sql_greatest(session, AnalysisWatermark.last_fill_id, watermark.excluded.last_fill_id)}
+    )
+    session.execute(watermark)
+
+
+def claim_pending(session, limit=DELIVERY_BATCH_SIZE, now_ms=None):
+    """
+    سیگنال‌های ارسال نشده را در یک تراکنش کوتاه برمی‌دارد: FOR UPDATE SKIP LOCKED تا دو ارسال‌کننده همزمان
+    یک ردیف را برندارند، سپس claimed_until (lease) و attempts ثبت و commit می‌شود.
+    خروجی: [(id, message), ...]
+    """
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    min_created_at = now_ms - SIGNAL_OUTBOX_MAX_AGE_MINUTES * 60 * 1000
+    pending = session.query(SignalOutbox.id, SignalOutbox.message).filter(
+        SignalOutbox.sent_at.is_(None),
+        SignalOutbox.attempts < SIGNAL_OUTBOX_MAX_ATTEMPTS,
+        SignalOutbox.created_at >= min_created_at,
+        or_(SignalOutbox.claimed_until.is_(None), SignalOutbox.claimed_until < now_ms)
+    ).order_by(SignalOutbox.id).limit(limit).with_for_update(skip_locked=True).all()
+    if pending:
+        session.query(SignalOutbox).filter(SignalOutbox.id.in_([signal_id for signal_id, _ in pending])).update({
+            "attempts": SignalOutbox.attempts + 1,
+            "claimed_until": now_ms + SIGNAL_OUTBOX_CLAIM_SECONDS * 1000
+        }, synchronize_session=False)
+    session.commit()
+    return pending
+
+
+def record_delivery(session, claimed_ids, sent_ids, failed_ids, now_ms=None):
+    """
+    نتیجه ارسال را در تراکنش دوم ثبت و lease ردیف‌ها را آزاد می‌کند.
+    """
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    session.query(SignalOutbox).filter(SignalOutbox.id.in_(claimed_ids)).update(
+        {"claimed_until": None}, synchronize_session=False
+    )
+    if sent_ids:
+        session.query(SignalOutbox).filter(SignalOutbox.id.in_(sent_ids)).update(
+            {"sent_at": now_ms, "last_error": None}, synchronize_session=False
+        )
+    if failed_ids:
+        session.query(SignalOutbox).filter(SignalOutbox.id.in_(failed_ids)).update(
+            {"last_error": "telegram send failed"}, synchronize_session=False
+        )
+    session.commit()
+
+
+async def deliver_pending(bot_instance, limit=DELIVERY_BATCH_SIZE):
+    """
+    سیگنال‌های ارسال نشده را برمی‌دارد (claim_pending)، بیرون از هر تراکنشی به صورت پیام‌های خلاصه ارسال
+    و نتیجه را ثبت می‌کند (record_delivery). در طول تلاش‌های مجدد و انتظار flood control
+    هیچ قفل ردیف یا تراکنش بازی نگه داشته نمی‌شود.
+    """
+    if not bot_instance:
+        return 0
+
+    with SessionLocal() as session:
+        with DB_QUERY_SECONDS.time(query="outbox_pending"):
+            pending = claim_pending(session, limit)
+    if not pending:
+        return 0
+
+    dispatcher = TelegramDispatcher(bot_instance)
+    for signal_id, message in pending:
+        dispatcher.add(message, ref=signal_id)
+    sent_ids, failed_ids = await dispatcher.flush()
+
+    with SessionLocal() as session:
+        with DB_QUERY_SECONDS.time(query="outbox_record"):
+            record_delivery(session, [signal_id for signal_id, _ in pending], set(sent_ids), set(failed_ids))
+
+    if failed_ids:
+        log.warning("⚠️ Some signals failed and will be retried", extra={"failed": len(failed_ids)})
+    log.info("📬 Delivered signals from outbox", extra={"sent": len(sent_ids)})
+    return len(sent_ids)
+
+
+if __name__ == "__main__":
+    init_db()
+    asyncio.run(deliver_pending(init_bot()))
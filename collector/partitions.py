@@ -0,0 +1,249 @@
+# collector/partitions.py
+
+import re
+import time
+import argparse
+from datetime import datetime, timezone
+from sqlalchemy import text
+from config import (
+    FILLS_PARTITION_INTERVAL,
+    FILLS_PARTITIONS_AHEAD,
+    FILLS_RETENTION_DAYS,
+    FILLS_RETENTION_MODE
+)
+from database import init_db, SessionLocal, Fill, FILLS_TABLE, COMPACT_STORAGE, COMPACT_SCALE
+from logs import get_logger
+
+log = get_logger("partitions")
+
+# جدول پارتیشن‌بندی شده: fills یا در حالت compact جدول fills_compact
+DEFAULT_PARTITION = f"{FILLS_TABLE}_default"
+_BOUND_PATTERN = re.compile(r"FROM \('?(-?\d+)'?\) TO \('?(-?\d+)'?\)")
+
+
+def _to_ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+def _period_start(dt, interval):
+    if interval == "day":
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_period(dt, interval):
+    if interval == "day":
+        return datetime.fromtimestamp(dt.timestamp() + 86400, tz=timezone.utc)
+    if dt.month == 12:
+        return dt.replace(year=dt.year + 1, month=1)
+    return dt.replace(month=dt.month + 1)
+
+
+def _partition_name(period_start, interval, table=FILLS_TABLE):
+    if interval == "day":
+        return f"{table}_p{period_start:%Y_%m_%d}"
+    return f"{table}_p{period_start:%Y_%m}"
+
+
+def is_partitioned(session, table=FILLS_TABLE):
+    """
+    آیا جدول fills از نوع پارتیشن‌بندی شده است؟ (جداول ساخته شده قبل از این تغییر، heap معمولی هستند)
+    """
+    return session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :table"
+    ), {"table": table}).first() is not None
+
+
+def list_partitions(session, table=FILLS_TABLE):
+    """
+    پارتیشن‌های بازه‌ای fills را به صورت لیست (نام، شروع ms، پایان ms) برمی‌گرداند.
+    """
+    rows = session.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table"
+    ), {"table": table}).all()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_PATTERN.search(bound or "")
+        if match:
+            partitions.append((name, int(match.group(1)), int(match.group(2))))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def _create_partitions(session, start_ms, ahead, interval, table=FILLS_TABLE):
+    now = datetime.now(timezone.utc)
+    start = datetime.fromtimestamp(start_ms / 1000, tz=timezone.utc) if start_ms else now
+    period = _period_start(min(start, now), interval)
+
+    end = _period_start(now, interval)
+    for _ in range(ahead):
+        end = _next_period(end, interval)
+
+    created = 0
+    existing = {name for name, _, _ in list_partitions(session, table)}
+    while period <= end:
+        next_period = _next_period(period, interval)
+        name = _partition_name(period, interval, table)
+        if name not in existing:
+            session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ({_to_ms(period)}) TO ({_to_ms(next_period)})"
+            ))
+            created += 1
+        period = next_period
+    session.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+    return created
+
+
+def ensure_partitions(session, start_ms=None, ahead=FILLS_PARTITIONS_AHEAD, interval=FILLS_PARTITION_INTERVAL):
+    """
+    پارتیشن‌های لازم از start_ms (پیش‌فرض: اکنون) تا `ahead` بازه بعد را می‌سازد،
+    به علاوه یک پارتیشن پیش‌فرض برای ردیف‌هایی که در هیچ بازه‌ای نمی‌افتند.
+    """
+    created = _create_partitions(session, start_ms, ahead, interval)
+    session.commit()
+    return created
+
+
+def _rollup_source(name):
+    """
+    ستون‌های پارتیشن با همان نام‌ها و واحدهای جدول fills (در حالت compact با decode ابعاد و مقیاس).
+    """
+    if not COMPACT_STORAGE:
+        return name
+    return f"""(
+        SELECT '0x' || encode(t.address, 'hex') AS user_address, a.name AS asset, p.timestamp, p.is_buy,
+               p.size::float8 / {COMPACT_SCALE} AS size, p.price::float8 / {COMPACT_SCALE} AS price,
+               p.pnl::float8 / {COMPACT_SCALE} AS pnl
+        FROM {name} p JOIN traders t ON t.id = p.trader_id JOIN assets a ON a.id = p.asset_id
+    ) AS source"""
+
+
+def _rollup_partition(session, name):
+    """
+    محتوای یک پارتیشن را به جدول fill_rollups_daily (user, asset, day) اضافه می‌کند.
+    """
+    session.execute(text(f"""
+        INSERT INTO fill_rollups_daily (
+            user_address, asset, day, buy_volume, sell_volume, weighted_buy_sum,
+            weighted_sell_sum, pnl_sum, fill_count, last_fill_time
+        )
+        SELECT
+            user_address, asset, (timestamp / 86400000) * 86400000 AS day,
+            SUM(CASE WHEN is_buy THEN size ELSE 0 END),
+            SUM(CASE WHEN is_buy THEN 0 ELSE size END),
+            SUM(CASE WHEN is_buy THEN size * price ELSE 0 END),
+            SUM(CASE WHEN is_buy THEN 0 ELSE size * price END),
+            COALESCE(SUM(pnl), 0),
+            COUNT(*),
+            MAX(timestamp)
+        FROM {_rollup_source(name)}
+        GROUP BY user_address, asset, (timestamp / 86400000) * 86400000
+        ON CONFLICT (user_address, asset, day) DO UPDATE SET
+            buy_volume = fill_rollups_daily.buy_volume + EXCLUDED.buy_volume,
+            sell_volume = fill_rollups_daily.sell_volume + EXCLUDED.sell_volume,
+            weighted_buy_sum = fill_rollups_daily.weighted_buy_sum + EXCLUDED.weighted_buy_sum,
+            weighted_sell_sum = fill_rollups_daily.weighted_sell_sum + EXCLUDED.weighted_sell_sum,
+            pnl_sum = fill_rollups_daily.pnl_sum + EXCLUDED.pnl_sum,
+            fill_count = fill_rollups_daily.fill_count + EXCLUDED.fill_count,
+            last_fill_time = GREATEST(fill_rollups_daily.last_fill_time, EXCLUDED.last_fill_time)
+    """))
+
+
+def apply_retention(session, retention_days=FILLS_RETENTION_DAYS, mode=FILLS_RETENTION_MODE):
+    """
+    پارتیشن‌هایی که کاملاً قدیمی‌تر از retention_days هستند را حذف می‌کند.
+    در حالت "rollup" ابتدا تجمیع روزانه آن‌ها ذخیره می‌شود (در همان تراکنش).
+    """
+    if not retention_days or retention_days <= 0:
+        return []
+    cutoff_ms = int((time.time() - retention_days * 86400) * 1000)
+    dropped = []
+    for name, _, upper_ms in list_partitions(session):
+        if upper_ms > cutoff_ms:
+            continue
+        session.execute(text(f"ALTER TABLE {FILLS_TABLE} DETACH PARTITION {name}"))
+        if mode == "rollup":
+            _rollup_partition(session, name)
+        session.execute(text(f"DROP TABLE {name}"))
+        session.commit()
+        dropped.append(name)
+        log.info("🗑️ Dropped fills partition", extra={"partition": name, "retention_mode": mode})
+    return dropped
+
+
+def migrate_to_partitioned(session):
+    """
+    جدول fills قدیمی (heap) را به جدول پارتیشن‌بندی شده منتقل می‌کند:
+    تغییر نام جدول قدیمی، ساخت جدول جدید، ساخت پارتیشن‌ها از قدیمی‌ترین داده، کپی و حذف جدول قدیمی.
+    همه مراحل در یک تراکنش انجام می‌شود.
+    """
+    if is_partitioned(session):
+        log.info("✅ 'fills' is already partitioned.")
+        return False
+    if COMPACT_STORAGE:
+        raise RuntimeError("Partition the wide table first (FILLS_STORAGE=wide), then run: python compact.py migrate")
+
+    log.info("🚚 Migrating 'fills' to a range-partitioned table...")
+    session.execute(text("LOCK TABLE fills IN ACCESS EXCLUSIVE MODE"))
+    session.execute(text("ALTER TABLE fills RENAME TO fills_legacy"))
+    session.execute(text("ALTER SEQUENCE IF EXISTS fills_id_seq RENAME TO fills_legacy_id_seq"))
+    legacy_indexes = session.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'fills_legacy'"
+    )).scalars().all()
+    for index_name in legacy_indexes:
+        session.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_legacy"'))
+
+    Fill.__table__.create(bind=session.connection())
+    min_timestamp = session.execute(text("SELECT MIN(timestamp) FROM fills_legacy")).scalar()
+    _create_partitions(session, min_timestamp, FILLS_PARTITIONS_AHEAD, FILLS_PARTITION_INTERVAL)
+
+    columns = "id, hash, oid, tid, user_address, asset, price, size, is_buy, direction, pnl, timestamp"
+    copied = session.execute(text(
+        f"INSERT INTO fills ({columns}) SELECT {columns} FROM fills_legacy WHERE timestamp IS NOT NULL"
+    )).rowcount
+    session.execute(text(
+        "SELECT setval(pg_get_serial_sequence('fills', 'id'), COALESCE((SELECT MAX(id) FROM fills), 0) + 1, false)"
+    ))
+    session.execute(text("DROP TABLE fills_legacy"))
+    # جدول جدید آمار ندارد؛ بدون ANALYZE تا اجرای autovacuum پلن کوئری‌ها ایندکس‌ها را نادیده می‌گیرد
+    session.execute(text("ANALYZE fills"))
+    session.commit()
+    log.info("🎉 Migrated fills into the partitioned table", extra={"rows": copied})
+    return True
+
+
+def maintain_partitions(session, start_ms=None):
+    """
+    نگهداری دوره‌ای: ساخت پارتیشن‌های پیش رو و اعمال سیاست نگهداری.
+    اگر جدول هنوز مهاجرت نکرده باشد فقط هشدار می‌دهد.
+    """
+    if not is_partitioned(session):
+        log.warning("⚠️ 'fills' is not partitioned yet. Run: python partitions.py migrate")
+        return
+    created = ensure_partitions(session, start_ms=start_ms)
+    if created:
+        log.info("🧱 Created new fills partitions", extra={"created": created})
+    apply_retention(session)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage time partitions of the fills table.")
+    parser.add_argument(
+        "command", choices=["migrate", "maintain", "list"],
+        help="migrate: convert a legacy fills table | maintain: create upcoming partitions and apply retention | list"
+    )
+    args = parser.parse_args()
+
+    init_db()
+    with SessionLocal() as session:
+        if args.command == "migrate":
+            migrate_to_partitioned(session)
+            maintain_partitions(session)
+        elif args.command == "maintain":
+            maintain_partitions(session)
+        else:
+            for name, lower_ms, upper_ms in list_partitions(session):
+                print(f"{name}: [{lower_ms}, {upper_ms})")
@@ -0,0 +1,140 @@
+# collector/positions.py
+
+import argparse
+from collections import defaultdict
+from sqlalchemy import func, case, text, insert
+from database import init_db, SessionLocal, Fill, FillRollup, Position, is_sqlite, upsert_insert, sql_greatest
+from logs import get_logger
+from metrics import DB_QUERY_SECONDS
+
+log = get_logger("positions")
+
+
+def accumulate_fill_rows(rows):
+    """
+    ردیف‌های fill را به مجموع‌های هر (تریدر، دارایی) تبدیل می‌کند.
+    """
+    totals = defaultdict(lambda: {
+        "buy_volume": 0.0, "sell_volume": 0.0, "weighted_buy_sum": 0.0,
+        "weighted_sell_sum": 0.0, "last_fill_time": None
+    })
+    for row in rows:
+        data = totals[(row["user_address"], row["asset"])]
+        if row["is_buy"]:
+            data["buy_volume"] += row["size"]
+            data["weighted_buy_sum"] += row["size"] * row["price"]
+        else:
+            data["sell_volume"] += row["size"]
+            data["weighted_sell_sum"] += row["size"] * row["price"]
+        if data["last_fill_time"] is None or row["timestamp"] > data["last_fill_time"]:
+            data["last_fill_time"] = row["timestamp"]
+    return totals
+
+
+def apply_fills_to_positions(session, inserted_rows):
+    """
+    fillهای تازه درج شده را به جدول positions اضافه می‌کند (در همان تراکنش درج fills).
+    هر کلید فقط یک بار در دستور upsert ظاهر می‌شود.
+    """
+    totals = accumulate_fill_rows(inserted_rows)
+    if not totals:
+        return
+    values = [
+        {
+            "user_address": user, "asset": asset,
+            "buy_volume": data["buy_volume"], "sell_volume": data["sell_volume"],
+            "weighted_buy_sum": data["weighted_buy_sum"], "weighted_sell_sum": data["weighted_sell_sum"],
+            "net_size": data["buy_volume"] - data["sell_volume"],
+            "last_fill_time": data["last_fill_time"]
+        }
+        for (user, asset), data in totals.items()
+    ]
+    stmt = upsert_insert(session, Position.__table__)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Position.user_address, Position.asset],
+        set_={
+            "buy_volume": Position.buy_volume + excluded.buy_volume,
+            "sell_volume": Position.sell_volume + excluded.sell_volume,
+            "weighted_buy_sum": Position.weighted_buy_sum + excluded.weighted_buy_sum,
+            "weighted_sell_sum": Position.weighted_sell_sum + excluded.weighted_sell_sum,
+            "net_size": Position.net_size + excluded.net_size,
+            "last_fill_time": sql_greatest(session, Position.last_fill_time, excluded.last_fill_time)
+        }
+    )
+    session.connection().execute(stmt, values)
+
+
+def rebuild_positions(session):
+    """
+    جدول positions را از روی کل جدول fills (و تجمیع‌های fill_rollups_daily) از نو محاسبه می‌کند.
+    قفل EXCLUSIVE باعث می‌شود درج‌های همزمان تا پایان بازسازی منتظر بمانند و چیزی گم نشود.
+    """
+    if not is_sqlite(session):
+        session.execute(text("LOCK TABLE positions IN EXCLUSIVE MODE"))
+    session.query(Position).delete()
+
+    # داده‌های خام fills به علاوه تجمیع روزانه پارتیشن‌هایی که توسط سیاست نگهداری حذف شده‌اند
+    raw_sums = session.query(
+        Fill.user_address.label("user_address"),
+        Fill.asset.label("asset"),
+        case((Fill.is_buy, Fill.size), else_=0.0).label("buy_volume"),
+        case((Fill.is_buy, 0.0), else_=Fill.size).label("sell_volume"),
+        case((Fill.is_buy, Fill.size * Fill.price), else_=0.0).label("weighted_buy_sum"),
+        case((Fill.is_buy, 0.0), else_=Fill.size * Fill.price).label("weighted_sell_sum"),
+        Fill.timestamp.label("last_fill_time")
+    )
+    rollup_sums = session.query(
+        FillRollup.user_address, FillRollup.asset, FillRollup.buy_volume, FillRollup.sell_volume,
+        FillRollup.weighted_buy_sum, FillRollup.weighted_sell_sum, FillRollup.last_fill_time
+    )
+    combined = raw_sums.union_all(rollup_sums).subquery()
+
+    buy_volume = func.sum(combined.c.buy_volume)
+    sell_volume = func.sum(combined.c.sell_volume)
+    aggregates = session.query(
+        combined.c.user_address,
+        combined.c.asset,
+        buy_volume,
+        sell_volume,
+        func.sum(combined.c.weighted_buy_sum),
+        func.sum(combined.c.weighted_sell_sum),
+        buy_volume - sell_volume,
+        func.max(combined.c.last_fill_time)
+    ).group_by(combined.c.user_address, combined.c.asset)
+
+    session.execute(insert(Position).from_select(
+        ["user_address", "asset", "buy_volume", "sell_volume", "weighted_buy_sum",
+         "weighted_sell_sum", "net_size", "last_fill_time"],
+        aggregates.statement
+    ))
+    session.commit()
+    return session.query(func.count()).select_from(Position).scalar()
+
+
+def ensure_positions_built(session):
+    """
+    اگر جدول positions خالی است ولی fills داده دارد (اولین اجرا پس از ارتقا)، آن را بازسازی می‌کند.
+    """
+    has_positions = session.query(session.query(Position).exists()).scalar()
+    if has_positions:
+        return
+    has_fills = session.query(session.query(Fill).exists()).scalar()
+    if has_fills:
+        log.info("🧮 'positions' table is empty. Rebuilding it from 'fills'...")
+        with DB_QUERY_SECONDS.time(query="rebuild_positions"):
+            count = rebuild_positions(session)
+        log.info("✅ Rebuilt positions", extra={"rows": count})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the materialized positions table.")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: recompute positions from the fills table")
+    args = parser.parse_args()
+
+    init_db()
+    with SessionLocal() as session:
+        if args.command == "rebuild":
+            log.info("🧮 Rebuilding 'positions' from 'fills'...")
+            count = rebuild_positions(session)
+            log.info("🎉 Rebuilt positions", extra={"rows": count})
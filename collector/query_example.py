@@ -0,0 +1,271 @@
+# collector/query_example.py
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, timezone
+from collections import defaultdict
+from prettytable import PrettyTable
+from sqlalchemy import func, case
+from config import QUERY_YIELD_PER, QUERY_TABLE_LIMIT
+from database import SessionLocal, Fill, Position, TrackedTrader
+from analysis_logic import summarize_position, aggregate_sentiment
+from reporting import save_table_as_image, wait_for_reports, OUTPUT_DIR
+from logs import get_logger
+
+log = get_logger("query")
+
+# ستون‌های خروجی هر دستور (ترتیب ستون‌های CSV و جدول)
+COLUMNS = {
+    "fills": ["time", "user", "asset", "direction", "side", "price", "size", "value", "pnl", "tid"],
+    "history": ["time", "user", "asset", "direction", "side", "price", "size", "value", "pnl", "tid", "position_after"],
+    "positions": ["user", "asset", "side", "net_volume", "avg_price", "position_value", "last_fill"],
+    "sentiment": ["asset", "long_traders_raw", "short_traders_raw", "net_value", "sentiment_percent"],
+}
+# نام‌های قدیمی مستندات (all: همه معاملات، open: پوزیشن‌های باز)
+COMMAND_ALIASES = {"all": "fills", "open": "positions"}
+
+RELATIVE_TIME = re.compile(r"^(\d+(?:\.\d+)?)([mhd])$")
+RELATIVE_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+# -------------------------------------------------
+# آرگومان‌ها
+# -------------------------------------------------
+def parse_time(value):
+    """
+    زمان به میلی‌ثانیه: عدد (epoch ms)، نسبی ("90m"، "24h"، "7d" قبل از اکنون) یا ISO 8601 (بدون منطقه زمانی = UTC).
+    """
+    if value.isdigit():
+        return int(value)
+    relative = RELATIVE_TIME.match(value)
+    if relative:
+        return int((time.time() - float(relative.group(1)) * RELATIVE_UNITS[relative.group(2)]) * 1000)
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid time '{value}'. Use epoch ms, 24h/7d or ISO 8601.")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def _format_time(timestamp_ms):
+    if timestamp_ms is None:
+        return None
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _filter_fills(query, args):
+    if args.since is not None:
+        query = query.filter(Fill.timestamp >= args.since)
+    if args.until is not None:
+        query = query.filter(Fill.timestamp < args.until)
+    if args.user:
+        query = query.filter(Fill.user_address.in_(args.user))
+    if args.asset:
+        query = query.filter(Fill.asset.in_(args.asset))
+    return query
+
+
+# -------------------------------------------------
+# منابع ردیف (generator؛ ردیف‌ها از cursor سمت سرور با yield_per خوانده می‌شوند)
+# -------------------------------------------------
+FILL_COLUMNS = (
+    Fill.timestamp, Fill.user_address, Fill.asset, Fill.direction, Fill.is_buy, Fill.price, Fill.size, Fill.pnl, Fill.tid
+)
+
+
+def _fill_record(row):
+    return {
+        "time": _format_time(row.timestamp), "user": row.user_address, "asset": row.asset,
+        "direction": row.direction, "side": "B" if row.is_buy else "S", "price": row.price, "size": row.size,
+        "value": (row.price or 0) * (row.size or 0), "pnl": row.pnl, "tid": row.tid,
+    }
+
+
+def fill_records(session, args):
+    """
+    معاملات خام به ترتیب زمان.
+    """
+    query = _filter_fills(session.query(*FILL_COLUMNS), args).order_by(Fill.timestamp, Fill.id)
+    for row in query.yield_per(QUERY_YIELD_PER):
+        yield _fill_record(row)
+
+
+def _net_sizes_before(session, args):
+    # حجم خالص هر (تریدر، دارایی) پیش از شروع بازه تا ستون position_after از وضعیت واقعی ادامه دهد
+    if args.since is None:
+        return {}
+    query = session.query(
+        Fill.user_address, Fill.asset, func.sum(case((Fill.is_buy, Fill.size), else_=-Fill.size))
+    ).filter(Fill.timestamp < args.since, Fill.user_address.in_(args.user))
+    if args.asset:
+        query = query.filter(Fill.asset.in_(args.asset))
+    return {(user, asset): net_size for user, asset, net_size in query.group_by(Fill.user_address, Fill.asset)}
+
+
+def history_records(session, args):
+    """
+    تاریخچه معاملات تریدر(ها) به ترتیب (تریدر، زمان) با حجم خالص پوزیشن پس از هر معامله.
+    """
+    net_sizes = defaultdict(float, _net_sizes_before(session, args))
+    query = _filter_fills(session.query(*FILL_COLUMNS), args).order_by(Fill.user_address, Fill.timestamp, Fill.id)
+    for row in query.yield_per(QUERY_YIELD_PER):
+        key = (row.user_address, row.asset)
+        net_sizes[key] += row.size if row.is_buy else -row.size
+        record = _fill_record(row)
+        record["position_after"] = net_sizes[key]
+        yield record
+
+
+def position_records(session, args):
+    """
+    پوزیشن‌های باز. بدون فیلتر زمانی از جدول positions خوانده می‌شود؛
+    با --since/--until پوزیشن خالص معاملات داخل بازه در خود دیتابیس تجمیع می‌شود.
+    """
+    if args.since is None and args.until is None:
+        query = session.query(
+            Position.user_address, Position.asset, Position.buy_volume, Position.sell_volume,
+            Position.weighted_buy_sum, Position.weighted_sell_sum, Position.last_fill_time
+        ).filter(func.abs(Position.net_size) > 1e-9)
+        if args.user:
+            query = query.filter(Position.user_address.in_(args.user))
+        if args.asset:
+            query = query.filter(Position.asset.in_(args.asset))
+        query = query.order_by(Position.asset, Position.user_address)
+    else:
+        buy_volume = func.sum(case((Fill.is_buy, Fill.size), else_=0.0))
+        sell_volume = func.sum(case((Fill.is_buy, 0.0), else_=Fill.size))
+        query = _filter_fills(session.query(
+            Fill.user_address,
+            Fill.asset,
+            buy_volume,
+            sell_volume,
+            func.sum(case((Fill.is_buy, Fill.size * Fill.price), else_=0.0)),
+            func.sum(case((Fill.is_buy, 0.0), else_=Fill.size * Fill.price)),
+            func.max(Fill.timestamp)
+        ), args).group_by(Fill.user_address, Fill.asset).having(
+            func.abs(buy_volume - sell_volume) > 1e-9
+        ).order_by(Fill.asset, Fill.user_address)
+
+    for row in query.yield_per(QUERY_YIELD_PER):
+        position = summarize_position(*row[:6])
+        if position is not None:
+            position["last_fill"] = _format_time(row[6])
+            yield position
+
+
+def sentiment_records(session, args):
+    """
+    سنتیمنت هر دارایی از پوزیشن‌های باز (استریم)؛ با --weighted وزن هر تریدر PNL اوست.
+    """
+    weights_map = None
+    if args.weighted:
+        weights_map = {
+            address: pnl for address, pnl in session.query(TrackedTrader.user_address, TrackedTrader.pnl)
+            if pnl and pnl > 0
+        }
+    return aggregate_sentiment(position_records(session, args), weights_map=weights_map)
+
+
+RECORD_SOURCES = {
+    "fills": fill_records,
+    "history": history_records,
+    "positions": position_records,
+    "sentiment": sentiment_records,
+}
+
+
+# -------------------------------------------------
+# خروجی‌ها
+# -------------------------------------------------
+def _table_cell(value):
+    if isinstance(value, float):
+        return f"{value:,.4f}"
+    return "" if value is None else value
+
+
+def write_records(records, columns, output_format, stream, table_limit=QUERY_TABLE_LIMIT):
+    """
+    ردیف‌ها را یکی یکی به CSV یا JSON Lines می‌نویسد (حافظه ثابت).
+    فقط table_limit ردیف اول برای جدول (کنسول/عکس) نگه داشته می‌شود.
+    خروجی: (تعداد ردیف، جدول PrettyTable)
+    """
+    table = PrettyTable(columns)
+    table.align = "l"
+    writer = None
+    if output_format == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(columns)
+    count = 0
+    for record in records:
+        count += 1
+        if writer is not None:
+            writer.writerow([record.get(column) for column in columns])
+        elif output_format == "jsonl":
+            stream.write(json.dumps({column: record.get(column) for column in columns}, ensure_ascii=False) + "\n")
+        if count <= table_limit:
+            table.add_row([_table_cell(record.get(column)) for column in columns])
+    if output_format == "table":
+        stream.write(table.get_string() + "\n")
+        if count > table_limit:
+            stream.write(f"... {count - table_limit} more rows (use --csv or --format jsonl for the full result)\n")
+    return count, table
+
+
+def run_query(args):
+    command = COMMAND_ALIASES.get(args.command, args.command)
+    columns = COLUMNS[command]
+    timestamp_str = datetime.now().strftime('%Y-%m-%d_%H-%M')
+    stream = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        with SessionLocal() as session:
+            records = RECORD_SOURCES[command](session, args)
+            count, table = write_records(records, columns, args.format, stream, table_limit=args.limit)
+    finally:
+        if args.output:
+            stream.close()
+
+    if args.save_image:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        save_table_as_image(table.get_string(), base_filename=f"query_{command}", timestamp_str=timestamp_str, theme=args.theme)
+        wait_for_reports()
+    log.info("✅ Query complete", extra={"command": command, "rows": count, "format": args.format})
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Stream fills, open positions, sentiment or trader history to a table, CSV or JSON Lines."
+    )
+    parser.add_argument(
+        "command", nargs="?", default="positions", choices=["fills", "positions", "sentiment", "history", "all", "open"],
+        help="fills (all): raw fills | positions (open): open positions | sentiment: per-asset sentiment | "
+             "history: a trader's fills with the running net position"
+    )
+    parser.add_argument("--since", type=parse_time, help="Start time: epoch ms, relative (90m, 24h, 7d) or ISO 8601 UTC")
+    parser.add_argument("--until", type=parse_time, help="End time (exclusive), same formats as --since")
+    parser.add_argument("--user", action="append", type=str.lower, help="Trader address (repeatable)")
+    parser.add_argument("--asset", action="append", help="Asset, e.g. BTC (repeatable)")
+    parser.add_argument("--format", choices=["table", "csv", "jsonl"], default="table", help="Output format")
+    parser.add_argument("--csv", action="store_const", dest="format", const="csv", help="Shortcut for --format csv")
+    parser.add_argument("--output", help="Write csv/jsonl/table output to this file instead of stdout")
+    parser.add_argument("--limit", type=int, default=QUERY_TABLE_LIMIT, help="Rows kept for the console table and image")
+    parser.add_argument("--weighted", action="store_true", help="sentiment: weight traders by their PNL")
+    parser.add_argument("--save-image", action="store_true", help=f"Also render the table as a PNG in {OUTPUT_DIR}/")
+    parser.add_argument("--theme", choices=["light", "dark"], default="light", help="Image theme")
+    args = parser.parse_args()
+
+    if args.command == "history" and not args.user:
+        parser.error("history needs at least one --user.")
+    # stdout مخصوص داده است (CSV/JSON Lines)؛ لاگ‌ها به stderr می‌روند
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(sys.stderr)
+    run_query(args)
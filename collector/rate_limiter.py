@@ -0,0 +1,64 @@
+# collector/rate_limiter.py
+
+import time
+import asyncio
+import threading
+from metrics import RATE_LIMIT_WAIT_SECONDS
+
+
+class TokenBucket:
+    """
+    محدودکننده نرخ به روش سطل توکن (Token Bucket).
+    هر درخواست یک توکن مصرف می‌کند و توکن‌ها با نرخ ثابت `rate` در ثانیه پر می‌شوند.
+    یک نمونه می‌تواند بین چند coroutine یا thread مشترک باشد.
+    اگر name داده شود، زمان انتظار هر درخواست در متریک rate_limiter_wait_seconds ثبت می‌شود.
+    """
+
+    def __init__(self, rate, capacity, name=None):
+        self.rate = float(rate)
+        self.name = name
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reserve(self, tokens=1.0):
+        """
+        توکن را رزرو می‌کند (موجودی می‌تواند منفی شود) و مدت انتظار لازم را برمی‌گرداند.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def _record_wait(self, wait_seconds):
+        if self.name:
+            RATE_LIMIT_WAIT_SECONDS.observe(wait_seconds, limiter=self.name)
+
+    def acquire(self, tokens=1.0):
+        wait_seconds = self._reserve(tokens)
+        self._record_wait(wait_seconds)
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+    async def acquire_async(self, tokens=1.0):
+        wait_seconds = self._reserve(tokens)
+        self._record_wait(wait_seconds)
+        if wait_seconds > 0:
+            await asyncio.sleep(wait_seconds)
+
+    def penalize(self, seconds):
+        """
+        پس از خطای 429 سطل را خالی می‌کند تا همه درخواست‌کننده‌ها برای `seconds` ثانیه صبر کنند.
+        چند 429 همزمان روی هم جمع نمی‌شوند: انتظار تا دیرترین مهلت ادامه دارد، نه مجموع آن‌ها.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
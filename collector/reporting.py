@@ -1,71 +1,240 @@
 # collector/reporting.py
 
 import os
+import io
 import csv
+import json
+import shutil
+import hashlib
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from prettytable import PrettyTable
 from PIL import Image, ImageDraw, ImageFont
+from config import REPORT_RENDER_WORKERS, REPORT_SKIP_UNCHANGED
+from logs import get_logger
+from metrics import REPORT_RENDER_SECONDS
+
+log = get_logger("reporting")
 
 OUTPUT_DIR = "results"
+FONT_NAME = "DejaVuSansMono.ttf"
+FONT_SIZE = 15
+IMAGE_PADDING = 25
+MANIFEST_FILENAME = ".render_manifest.json"
+
+# -------------------------------------------------
+# 🔽 (جدید) کش فونت و اندازه کاراکترها 🔽
+# -------------------------------------------------
+@lru_cache(maxsize=None)
+def _load_font(name=FONT_NAME, size=FONT_SIZE):
+    """
+    فونت فقط یک بار از دیسک خوانده می‌شود.
+    """
+    try:
+        return ImageFont.truetype(name, size)
+    except IOError:
+        log.warning("Font not found. Using default font.", extra={"font": name})
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=None)
+def _measure_draw():
+    return ImageDraw.Draw(Image.new('RGB', (1, 1)))
+
+
+@lru_cache(maxsize=4096)
+def _glyph_advance(font, char):
+    return font.getlength(char)
+
+
+@lru_cache(maxsize=None)
+def _line_metrics(font):
+    """
+    (ارتفاع اولین خط، فاصله خطوط) با همان قواعد multiline_text در Pillow.
+    """
+    draw = _measure_draw()
+    first_line_bottom = draw.textbbox((0, 0), "A", font=font)[3]
+    two_lines_bottom = draw.multiline_textbbox((0, 0), "A\nA", font=font)[3]
+    return first_line_bottom, two_lines_bottom - first_line_bottom
+
+
+def measure_text(table_string, font):
+    """
+    اندازه متن چندخطی بدون رسم روی عکس موقت. جدول‌ها با فونت monospace
+    فقط چند کاراکتر متمایز دارند، پس عرض هر خط جمع advance کاراکترهای کش شده است.
+    """
+    lines = table_string.split("\n")
+    width = max((sum(_glyph_advance(font, char) for char in line) for line in lines), default=0)
+    first_line_height, line_spacing = _line_metrics(font)
+    height = first_line_height + (len(lines) - 1) * line_spacing
+    return int(round(width)), int(round(height))
+
+# -------------------------------------------------
+# 🔽 (جدید) تشخیص تغییر محتوا 🔽
+# -------------------------------------------------
+_manifest_lock = threading.Lock()
+
+
+def _content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _read_manifest():
+    try:
+        with open(os.path.join(OUTPUT_DIR, MANIFEST_FILENAME), encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _link_previous(artifact_key, content_hash, filename):
+    """
+    اگر آخرین فایل همین artifact همین محتوا را دارد، به جای ساخت دوباره
+    یک hardlink (در صورت عدم پشتیبانی، کپی) به آن ساخته می‌شود.
+    """
+    if not REPORT_SKIP_UNCHANGED:
+        return False
+    with _manifest_lock:
+        previous = _read_manifest().get(artifact_key)
+    if not previous or previous.get("hash") != content_hash:
+        return False
+    previous_path = previous.get("path")
+    if not previous_path or not os.path.exists(previous_path):
+        return False
+    if os.path.abspath(previous_path) == os.path.abspath(filename):
+        return True
+    try:
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.link(previous_path, filename)
+    except OSError:
+        shutil.copyfile(previous_path, filename)
+    return True
+
+
+def _record_artifact(artifact_key, content_hash, filename):
+    with _manifest_lock:
+        manifest = _read_manifest()
+        manifest[artifact_key] = {"hash": content_hash, "path": filename}
+        manifest_path = os.path.join(OUTPUT_DIR, MANIFEST_FILENAME)
+        temp_path = f"{manifest_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(temp_path, manifest_path)
+
+# -------------------------------------------------
+# 🔽 (جدید) thread pool ساخت خروجی‌ها 🔽
+# -------------------------------------------------
+_render_pool = ThreadPoolExecutor(max_workers=REPORT_RENDER_WORKERS, thread_name_prefix="report")
+_pending_renders = []
+_pending_lock = threading.Lock()
+
+
+def _submit(function, *args, **kwargs):
+    future = _render_pool.submit(function, *args, **kwargs)
+    with _pending_lock:
+        _pending_renders.append(future)
+    return future
+
+
+def wait_for_reports():
+    """
+    منتظر پایان همه خروجی‌های در حال ساخت می‌ماند و تعداد خطاها را برمی‌گرداند.
+    """
+    with _pending_lock:
+        futures = list(_pending_renders)
+        _pending_renders.clear()
+    failures = 0
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            failures += 1
+            log.error("❌ Error rendering report", extra={"error": str(e)})
+    return failures
+
+# -------------------------------------------------
 
 def save_table_as_image(table_string, base_filename, timestamp_str, theme='light'):
     """
     جدول را به عنوان عکس با فونت DejaVuSansMono ذخیره می‌کند.
     """
     filename = os.path.join(OUTPUT_DIR, f"{base_filename}_{timestamp_str}.png")
-    print(f"🖼️  Saving table to {filename} with '{theme}' theme...")
+    content_hash = _content_hash(table_string, theme, FONT_NAME, FONT_SIZE)
+    if _link_previous(f"{base_filename}.png", content_hash, filename):
+        _record_artifact(f"{base_filename}.png", content_hash, filename)
+        log.info("♻️ Table unchanged. Linked to the previous image.", extra={"file": filename})
+        return filename
+
+    with REPORT_RENDER_SECONDS.time(artifact="png", result="rendered"):
+        _render_table_image(table_string, filename, theme)
+    _record_artifact(f"{base_filename}.png", content_hash, filename)
+    log.info("✅ Image saved", extra={"file": filename, "theme": theme})
+    return filename
+
+def _render_table_image(table_string, filename, theme):
     if theme == 'dark':
         bg_color, text_color = '#2c2f33', '#ffffff'
     else:
         bg_color, text_color = '#ffffff', '#000000'
-    
-    try:
-        font = ImageFont.truetype("DejaVuSansMono.ttf", 15)
-    except IOError:
-        print("Warning: 'DejaVuSansMono.ttf' not found. Using default font.")
-        font = ImageFont.load_default()
-    
-    dummy_draw = ImageDraw.Draw(Image.new('RGB', (0, 0)))
-    text_bbox = dummy_draw.multiline_textbbox((0, 0), table_string, font=font)
-    padding = 25
-    img = Image.new('RGB', (text_bbox[2] + 2 * padding, text_bbox[3] + 2 * padding), color=bg_color)
+
+    font = _load_font()
+    text_width, text_height = measure_text(table_string, font)
+    img = Image.new('RGB', (text_width + 2 * IMAGE_PADDING, text_height + 2 * IMAGE_PADDING), color=bg_color)
     draw = ImageDraw.Draw(img)
-    draw.multiline_text((padding, padding), table_string, font=font, fill=text_color)
+    draw.multiline_text((IMAGE_PADDING, IMAGE_PADDING), table_string, font=font, fill=text_color)
     img.save(filename)
-    print(f"✅ Image saved successfully as {filename}")
 
 def save_data_to_csv(header, data_rows, base_filename, timestamp_str):
     """
     داده‌ها را در یک فایل CSV ذخیره می‌کند.
     """
     filename = os.path.join(OUTPUT_DIR, f"{base_filename}_{timestamp_str}.csv")
-    print(f"💾 Saving data to {filename}...")
-    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(header)
-        writer.writerows(data_rows)
-    print(f"✅ Data saved successfully as {filename}")
+    buffer = io.StringIO(newline='')
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    writer.writerows(data_rows)
+    content = buffer.getvalue()
+
+    content_hash = _content_hash(content)
+    if _link_previous(f"{base_filename}.csv", content_hash, filename):
+        _record_artifact(f"{base_filename}.csv", content_hash, filename)
+        log.info("♻️ Data unchanged. Linked to the previous CSV.", extra={"file": filename})
+        return filename
+
+    with REPORT_RENDER_SECONDS.time(artifact="csv", result="written"):
+        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+            csvfile.write(content)
+    _record_artifact(f"{base_filename}.csv", content_hash, filename)
+    log.info("✅ Data saved", extra={"file": filename})
+    return filename
 
-def print_sentiment_table(sorted_sentiment, title, base_filename, timestamp_str, theme='light'):
+def print_sentiment_table(sorted_sentiment, title, base_filename, timestamp_str, theme='light', wait=False):
     """
     جدول خلاصه سنتیمنت را برای کنسول و عکس می‌سازد.
+    خروجی کنسول، عکس و CSV در thread pool ساخته می‌شوند؛ analyzer در پایان wait_for_reports را صدا می‌زند.
     """
-    print(f"\n--- {title} ---")
     header = ["Asset", "Long Traders", "Short Traders", "Net Value ($)", "Sentiment %"]
-    
+
     # جدول عکس (ایموجی)
     image_table = PrettyTable(header)
     image_table.align = "l"
-    
+
     # جدول کنسول (رنگی)
     console_table = PrettyTable(header)
     console_table.align = "l"
-    
+
     for align_col in ["Long Traders", "Short Traders", "Net Value ($)", "Sentiment %"]:
         image_table.align[align_col] = "r"
         console_table.align[align_col] = "r"
-        
+
     csv_rows = [header]
-    
+
     for item in sorted_sentiment:
         net_value_str = f"${item['net_value']:,.2f}"
         sentiment_percent_str = f"{item['sentiment_percent']:.1f}%"
@@ -86,10 +255,13 @@ def print_sentiment_table(sorted_sentiment, title, base_filename, timestamp_str,
             sentiment_str_console = f"{sentiment_percent_str} neutral"
             asset_name_image = f"⚪️ {item['asset']}"
             sentiment_str_image = f"{sentiment_percent_str} neutral"
-            
+
         console_table.add_row([asset_name_console, item["long_traders_raw"], item["short_traders_raw"], net_value_str, sentiment_str_console])
         image_table.add_row([asset_name_image, item["long_traders_raw"], item["short_traders_raw"], net_value_str, sentiment_str_image])
 
-    print(console_table)
-    save_table_as_image(image_table.get_string(), base_filename=base_filename, timestamp_str=timestamp_str, theme=theme)
-    save_data_to_csv(header, csv_rows, base_filename=base_filename, timestamp_str=timestamp_str)
\ No newline at end of file
+    # جدول کنسول یک‌جا چاپ می‌شود تا با خروجی threadهای دیگر قاطی نشود
+    _submit(print, f"\n--- {title} ---\n{console_table.get_string()}")
+    _submit(save_table_as_image, image_table.get_string(), base_filename=base_filename, timestamp_str=timestamp_str, theme=theme)
+    _submit(save_data_to_csv, header, csv_rows, base_filename=base_filename, timestamp_str=timestamp_str)
+    if wait:
+        wait_for_reports()
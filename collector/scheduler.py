@@ -0,0 +1,246 @@
+# collector/scheduler.py
+
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import threading
+from config import (
+    DISCOVER_INTERVAL_SECONDS,
+    COLLECTOR_INTERVAL_SECONDS,
+    COLLECTOR_MIN_POLL_SECONDS,
+    ANALYZER_INTERVAL_SECONDS,
+    ANALYZER_START_OFFSET_SECONDS,
+    OUTBOX_DELIVERY_INTERVAL_SECONDS
+)
+from database import init_db
+import discover_traders
+import collector
+import analyzer
+import outbox
+from telegram_sender import init_bot
+from logs import get_logger
+from metrics import JOB_RUN_SECONDS, JOB_RUNS, dump_metrics, start_metrics_exporters
+
+log = get_logger("scheduler")
+
+
+# -------------------------------------------------
+# Jobها: هر کدام منابع گرم خود را بین اجراها نگه می‌دارند
+# -------------------------------------------------
+class DiscoverJob:
+    async def __call__(self):
+        discover_traders.update_tracked_traders()
+
+
+class CollectorJob:
+    """
+    هر COLLECTOR_MIN_POLL_SECONDS تریدرهای آماده را دریافت می‌کند (نوبت هر تریدر تطبیقی است)
+    و هر COLLECTOR_INTERVAL_SECONDS یک دور کامل (همگام‌سازی صف و نگهداری) اجرا می‌کند.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.last_full_round = None
+
+    async def __call__(self):
+        # کلاینت HTTP در event loop همین job ساخته می‌شود و بین دورها باز می‌ماند
+        if self.client is None and collector.COLLECTOR_FETCH_MODE != "sync":
+            self.client = collector.make_async_client()
+        if self.last_full_round is None or time.monotonic() - self.last_full_round >= COLLECTOR_INTERVAL_SECONDS:
+            self.last_full_round = time.monotonic()
+            await collector.collect_once(client=self.client)
+        else:
+            await collector.collect_due(client=self.client)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+
+class AnalyzerJob:
+    def __init__(self):
+        self.bot = None
+        self.bot_initialized = False
+
+    def _get_bot(self):
+        if not self.bot_initialized:
+            self.bot = init_bot()
+            self.bot_initialized = True
+        return self.bot
+
+    async def __call__(self):
+        await analyzer.main(bot_instance=self._get_bot())
+
+
+class DeliveryJob(AnalyzerJob):
+    """
+    ارسال مجدد سیگنال‌های باقی‌مانده در outbox (پس از خطای تلگرام یا ری‌استارت سرویس).
+    """
+
+    async def __call__(self):
+        await outbox.deliver_pending(self._get_bot())
+
+
+# ترتیب این دیکشنری ترتیب اجرا در حالت --once است
+JOB_FACTORIES = {
+    "discover": (DiscoverJob, DISCOVER_INTERVAL_SECONDS, 0),
+    "collector": (CollectorJob, COLLECTOR_MIN_POLL_SECONDS, 0),
+    "analyzer": (AnalyzerJob, ANALYZER_INTERVAL_SECONDS, ANALYZER_START_OFFSET_SECONDS),
+    "outbox": (DeliveryJob, OUTBOX_DELIVERY_INTERVAL_SECONDS, ANALYZER_START_OFFSET_SECONDS),
+}
+
+
+class JobRunner:
+    """
+    هر job یک thread و event loop اختصاصی و ماندگار دارد؛
+    بنابراین یک job کند، بقیه را متوقف نمی‌کند و کلاینت‌های async بین اجراها معتبر می‌مانند.
+    """
+
+    def __init__(self, name, job, interval, offset=0):
+        self.name = name
+        self.job = job
+        self.interval = interval
+        self.offset = offset
+        self.future = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=f"job-{name}", daemon=True)
+        self.thread.start()
+
+    async def _run(self):
+        started = time.monotonic()
+        log.info(f"🚀 [{self.name}] Run started.", extra={"job": self.name})
+        try:
+            await self.job()
+            result = "ok"
+            log.info(f"✅ [{self.name}] Run finished.", extra={"job": self.name, "seconds": round(time.monotonic() - started, 1)})
+        except Exception:
+            result = "failed"
+            log.exception(f"❌ [{self.name}] Run failed.", extra={"job": self.name, "seconds": round(time.monotonic() - started, 1)})
+        JOB_RUN_SECONDS.observe(time.monotonic() - started, job=self.name)
+        JOB_RUNS.inc(job=self.name, result=result)
+
+    def is_running(self):
+        return self.future is not None and not self.future.done()
+
+    def submit(self):
+        """
+        یک اجرا را شروع می‌کند؛ اگر اجرای قبلی هنوز تمام نشده باشد False برمی‌گرداند.
+        """
+        if self.is_running():
+            return False
+        self.future = asyncio.run_coroutine_threadsafe(self._run(), self.loop)
+        return True
+
+    def wait(self):
+        if self.future is not None:
+            self.future.result()
+
+    def stop(self):
+        close = getattr(self.job, "close", None)
+        if close is not None:
+            asyncio.run_coroutine_threadsafe(close(), self.loop).result(timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=10)
+
+
+def run_once(runners):
+    """
+    حالت cron: هر job یک بار و به ترتیب اجرا می‌شود.
+    """
+    for runner in runners:
+        runner.submit()
+        runner.wait()
+
+
+def run_forever(runners, stop_event):
+    """
+    زمان‌بندی با نرخ ثابت: زمان اجرای بعدی از زمان شروع محاسبه می‌شود (نه پایان کار)،
+    پس اجراها جابجا نمی‌شوند. اگر اجرای قبلی هنوز ادامه دارد، این نوبت رد می‌شود.
+    """
+    start = time.monotonic()
+    next_runs = {runner.name: start + runner.offset for runner in runners}
+
+    while not stop_event.is_set():
+        now = time.monotonic()
+        for runner in runners:
+            due = next_runs[runner.name]
+            if now < due:
+                continue
+            if not runner.submit():
+                JOB_RUNS.inc(job=runner.name, result="skipped")
+                log.warning(f"⏭️  [{runner.name}] Previous run still in progress. Skipping this tick.", extra={"job": runner.name})
+            # نوبت‌های از دست رفته جبران نمی‌شوند؛ به اولین نوبت آینده می‌پریم
+            missed_ticks = int((now - due) // runner.interval) + 1
+            next_runs[runner.name] = due + missed_ticks * runner.interval
+
+        sleep_for = min(next_runs.values()) - time.monotonic()
+        stop_event.wait(timeout=max(0.0, min(sleep_for, 1.0)))
+
+
+def parse_intervals(values):
+    intervals = {}
+    for value in values or []:
+        name, _, seconds = value.partition("=")
+        if name not in JOB_FACTORIES or not seconds:
+            raise argparse.ArgumentTypeError(f"Invalid --interval '{value}'. Use JOB=SECONDS.")
+        intervals[name] = int(seconds)
+    return intervals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run discover_traders, collector and analyzer in one process.")
+    parser.add_argument(
+        "--jobs", default=",".join(JOB_FACTORIES),
+        help=f"Comma-separated jobs to host (default: {','.join(JOB_FACTORIES)})"
+    )
+    parser.add_argument(
+        "--interval", action="append", metavar="JOB=SECONDS",
+        help="Override a job interval, e.g. --interval collector=300 (repeatable)"
+    )
+    parser.add_argument("--once", action="store_true", help="Run each selected job once, in order, then exit (cron mode)")
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.jobs.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in JOB_FACTORIES]
+    if unknown:
+        parser.error(f"Unknown jobs: {', '.join(unknown)}")
+    try:
+        intervals = parse_intervals(args.interval)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    # یک بار در شروع سرویس (نه در هر دور)
+    init_db()
+
+    runners = []
+    for name in JOB_FACTORIES:
+        if name not in selected:
+            continue
+        factory, interval, offset = JOB_FACTORIES[name]
+        runners.append(JobRunner(name, factory(), intervals.get(name, interval), offset=0 if args.once else offset))
+
+    if args.once:
+        run_once(runners)
+        dump_metrics()
+    else:
+        start_metrics_exporters()
+        stop_event = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop_event.set())
+        log.info("🗓️  Scheduler started: " + ", ".join(f"{r.name} every {r.interval}s" for r in runners))
+        run_forever(runners, stop_event)
+        log.info("🛑 Scheduler stopping...")
+        for runner in runners:
+            if runner.is_running():
+                log.info(f"⏳ Waiting for [{runner.name}] to finish...", extra={"job": runner.name})
+                runner.wait()
+        dump_metrics()
+
+    for runner in runners:
+        runner.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+# collector/snapshot.py
+
+import time
+from sqlalchemy import func, text
+from config import SIGNAL_MAX_FILL_AGE_MINUTES
+from database import SessionLocal, Fill, TrackedTrader
+from analysis_logic import get_open_positions
+from outbox import load_watermarks
+from ingest import ingest_barrier
+from activity import window_positions
+from logs import get_logger
+from metrics import DB_QUERY_SECONDS
+
+log = get_logger("snapshot")
+
+# -------------------------------------------------
+# ثبت datasetها: هر dataset یک بار در هر اجرای analyzer بارگذاری می‌شود
+# -------------------------------------------------
+DATASETS = {}
+
+RECENT_ACTIVITY_WINDOW_MS = 24 * 3600 * 1000
+# تحلیل‌هایی که از outbox و watermark استفاده می‌کنند
+SIGNAL_ANALYSES = ("new_trades", "trade_consensus")
+
+
+def dataset(name):
+    """
+    دکوراتور ثبت یک loader با امضای loader(session, snapshot).
+    """
+    def register(loader):
+        DATASETS[name] = loader
+        return loader
+    return register
+
+
+def requires(*dataset_names):
+    """
+    دکوراتور تحلیل‌ها: datasetهای مورد نیاز تحلیل را اعلام می‌کند.
+    """
+    unknown = [name for name in dataset_names if name not in DATASETS]
+    if unknown:
+        raise ValueError(f"Unknown datasets: {', '.join(unknown)}")
+
+    def mark(analysis):
+        analysis.datasets = tuple(dataset_names)
+        return analysis
+    return mark
+
+
+@dataset("trader_pnl")
+def _load_trader_pnl(session, snapshot):
+    """
+    نقشه آدرس ← PNL تریدرهای سودده (برای وزن‌دهی و اجماع).
+    """
+    rows = session.query(TrackedTrader.user_address, TrackedTrader.pnl).all()
+    return {address: pnl for address, pnl in rows if pnl and pnl > 0}
+
+
+@dataset("open_positions")
+def _load_open_positions(session, snapshot):
+    return get_open_positions(session)
+
+
+@dataset("recent_positions_24h")
+def _load_recent_positions(session, snapshot):
+    return window_positions(session, RECENT_ACTIVITY_WINDOW_MS, snapshot.now_ms)
+
+
+@dataset("signal_fills")
+def _load_signal_fills(session, snapshot):
+    """
+    fillهای باز کننده پوزیشن که پس از watermark تحلیل‌های سیگنال درج شده‌اند (جدیدترین اول).
+    خروجی: {"watermarks": {...}, "max_fill_id": ..., "fills": [...]}
+    هر تحلیل با watermark خودش فیلتر می‌کند (filter_new_fills).
+    """
+    watermarks = load_watermarks(session)
+    max_fill_id = session.query(func.max(Fill.id)).scalar() or 0
+    lowest_watermark = min((watermarks.get(name, 0) for name in SIGNAL_ANALYSES), default=0)
+    cutoff_ms = snapshot.now_ms - SIGNAL_MAX_FILL_AGE_MINUTES * 60 * 1000
+    fills = session.query(
+        Fill.id, Fill.tid, Fill.user_address, Fill.asset, Fill.direction, Fill.price, Fill.size, Fill.timestamp
+    ).filter(
+        Fill.id > lowest_watermark,
+        Fill.id <= max_fill_id,
+        Fill.timestamp >= cutoff_ms,
+        Fill.direction.like('Open %')
+    ).order_by(Fill.timestamp.desc()).all()
+    return {"watermarks": watermarks, "max_fill_id": max_fill_id, "fills": fills}
+
+
+def filter_new_fills(signal_fills, analysis):
+    """
+    fillهایی از dataset signal_fills که بعد از watermark این تحلیل درج شده‌اند.
+    """
+    watermark = signal_fills["watermarks"].get(analysis, 0)
+    return [fill for fill in signal_fills["fills"] if fill.id > watermark]
+
+
+class AnalysisSnapshot:
+    """
+    datasetهای مورد نیاز همه تحلیل‌ها را یک بار و در یک تراکنش فقط-خواندنی
+    REPEATABLE READ بارگذاری می‌کند تا همه تحلیل‌ها یک تصویر سازگار از دیتابیس ببینند.
+    """
+
+    def __init__(self, now_ms=None):
+        self.now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        self.data = {}
+
+    @staticmethod
+    def required_by(analyses):
+        names = []
+        for analysis in analyses:
+            for name in getattr(analysis, "datasets", ()):
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def load(self, dataset_names):
+        missing = [name for name in dataset_names if name not in self.data]
+        if not missing:
+            return self
+        with SessionLocal() as session:
+            connection = session.connection(execution_options={
+                "isolation_level": "REPEATABLE READ",
+                "postgresql_readonly": True
+            })
+            # snapshot پس از commit همه درج‌های در جریان گرفته می‌شود (watermark بدون همپوشانی id)
+            with ingest_barrier(session.get_bind()):
+                connection.execute(text("SELECT 1"))
+            for name in missing:
+                with DB_QUERY_SECONDS.time(query=f"dataset:{name}") as timer:
+                    self.data[name] = DATASETS[name](session, self)
+                log.info("📦 Loaded dataset", extra={"dataset": name, "seconds": round(timer.elapsed, 3)})
+            session.rollback()
+        return self
+
+    def __getitem__(self, name):
+        return self.data[name]
@@ -0,0 +1,234 @@
+# collector/stream_collector.py
+
+import json
+import time
+import asyncio
+import argparse
+import websockets
+from config import (
+    HYPERLIQUID_WS_URL,
+    WS_MAX_USERS_PER_CONNECTION,
+    STREAM_FLUSH_INTERVAL_SECONDS,
+    STREAM_FLUSH_MAX_FILLS,
+    STREAM_TRADERS_REFRESH_SECONDS,
+    COLLECTOR_INTERVAL_SECONDS
+)
+from database import init_db, SessionLocal, TrackedTrader
+from ingest import FillIngestBuffer
+from collector import run_maintenance
+from logs import get_logger
+from metrics import FILLS_FETCHED, start_metrics_exporters
+
+log = get_logger("stream_collector")
+
+PING_INTERVAL_SECONDS = 50  # سرور اتصال‌های بی‌صدا را پس از ۶۰ ثانیه می‌بندد
+MAX_RECONNECT_DELAY_SECONDS = 60
+
+
+def _subscription_message(method, user_address):
+    return json.dumps({"method": method, "subscription": {"type": "userFills", "user": user_address}})
+
+
+class UserFillsConnection:
+    """
+    یک اتصال WebSocket که کانال userFills مجموعه‌ای از تریدرها را دنبال می‌کند.
+    پس از قطع اتصال با backoff نمایی دوباره وصل می‌شود و همه اشتراک‌ها را تکرار می‌کند.
+    """
+
+    def __init__(self, name, ws_url, queue, record_file=None):
+        self.name = name
+        self.ws_url = ws_url
+        self.queue = queue
+        self.record_file = record_file
+        self.users = set()
+        self.websocket = None
+
+    async def set_users(self, users):
+        """
+        مجموعه تریدرها را به‌روز می‌کند و در صورت اتصال، فقط تفاوت‌ها را subscribe/unsubscribe می‌کند.
+        """
+        added, removed = users - self.users, self.users - users
+        self.users = set(users)
+        if self.websocket is None:
+            return
+        try:
+            for address in removed:
+                await self.websocket.send(_subscription_message("unsubscribe", address))
+            for address in added:
+                await self.websocket.send(_subscription_message("subscribe", address))
+        except websockets.ConnectionClosed:
+            # حلقه run دوباره وصل می‌شود و همه اشتراک‌ها را از نو می‌فرستد
+            pass
+
+    async def _keepalive(self, websocket):
+        while True:
+            await asyncio.sleep(PING_INTERVAL_SECONDS)
+            await websocket.send(json.dumps({"method": "ping"}))
+
+    def _handle_message(self, raw):
+        message = json.loads(raw)
+        if message.get("channel") != "userFills":
+            return
+        if self.record_file is not None:
+            self.record_file.write(raw if isinstance(raw, str) else raw.decode())
+            self.record_file.write("\n")
+        data = message.get("data") or {}
+        user_address = data.get("user")
+        fills = data.get("fills") or []
+        if user_address and fills:
+            FILLS_FETCHED.inc(len(fills), source="stream")
+            self.queue.put_nowait((user_address, fills))
+
+    async def run(self):
+        delay = 1
+        while True:
+            try:
+                async with websockets.connect(self.ws_url, ping_interval=None, max_size=None) as websocket:
+                    self.websocket = websocket
+                    for address in list(self.users):
+                        await websocket.send(_subscription_message("subscribe", address))
+                    log.info(f"🔌 [{self.name}] Connected.", extra={"connection": self.name, "traders": len(self.users)})
+                    delay = 1
+                    keepalive = asyncio.create_task(self._keepalive(websocket))
+                    try:
+                        async for raw in websocket:
+                            self._handle_message(raw)
+                    finally:
+                        keepalive.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"⚠️ [{self.name}] Connection lost.", extra={"connection": self.name, "error": str(e)})
+            finally:
+                self.websocket = None
+            log.info(f"🔁 [{self.name}] Reconnecting...", extra={"connection": self.name, "delay_seconds": delay})
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY_SECONDS)
+
+
+class StreamCollector:
+    """
+    جمع‌آوری لحظه‌ای fillهای همه TrackedTraderها از طریق WebSocket.
+    fillها در صف جمع و به صورت دسته‌ای (همان مسیر درج collector.py) ذخیره می‌شوند.
+    """
+
+    def __init__(self, ws_url=HYPERLIQUID_WS_URL, users_per_connection=WS_MAX_USERS_PER_CONNECTION, record_file=None):
+        self.ws_url = ws_url
+        self.users_per_connection = users_per_connection
+        self.record_file = record_file
+        self.queue = asyncio.Queue()
+        self.connections = []
+        self.connection_tasks = []
+
+    def _load_tracked_addresses(self):
+        with SessionLocal() as session:
+            return {address for (address,) in session.query(TrackedTrader.user_address).all()}
+
+    async def _apply_tracked_addresses(self, addresses):
+        """
+        تریدرها را بین اتصال‌ها تقسیم می‌کند؛ تریدرهای فعلی روی اتصال قبلی خود می‌مانند.
+        """
+        assignments = [conn.users & addresses for conn in self.connections]
+        assigned = set().union(*assignments) if assignments else set()
+        for address in sorted(addresses - assigned):
+            for users in assignments:
+                if len(users) < self.users_per_connection:
+                    users.add(address)
+                    break
+            else:
+                assignments.append({address})
+
+        for index, users in enumerate(assignments):
+            if index >= len(self.connections):
+                connection = UserFillsConnection(f"ws-{index}", self.ws_url, self.queue, self.record_file)
+                self.connections.append(connection)
+                await connection.set_users(users)
+                self.connection_tasks.append(asyncio.create_task(connection.run()))
+            else:
+                await self.connections[index].set_users(users)
+
+    async def refresh_subscriptions(self):
+        """
+        لیست tracked_traders را دوره‌ای می‌خواند تا تغییرات discover_traders روی اشتراک‌ها اعمال شود.
+        """
+        current = None
+        while True:
+            try:
+                addresses = await asyncio.to_thread(self._load_tracked_addresses)
+                if addresses != current:
+                    await self._apply_tracked_addresses(addresses)
+                    log.info("👥 Tracked traders updated", extra={"traders": len(addresses), "connections": len(self.connections)})
+                    current = addresses
+            except Exception:
+                log.exception("❌ Error refreshing tracked traders")
+            await asyncio.sleep(STREAM_TRADERS_REFRESH_SECONDS)
+
+    def _flush(self, batch):
+        with SessionLocal() as session:
+            buffer = FillIngestBuffer(session, source="stream")
+            for user_address, fills in batch:
+                buffer.add(user_address, fills)
+            buffer.flush()
+            return buffer.total_inserted
+
+    async def write_batches(self):
+        """
+        fillهای صف را هر STREAM_FLUSH_INTERVAL_SECONDS یا پس از STREAM_FLUSH_MAX_FILLS عدد ذخیره می‌کند.
+        ذخیره در thread جدا انجام می‌شود تا دریافت پیام‌ها متوقف نشود.
+        """
+        while True:
+            batch = [await self.queue.get()]
+            fill_count = len(batch[0][1])
+            deadline = time.monotonic() + STREAM_FLUSH_INTERVAL_SECONDS
+            while fill_count < STREAM_FLUSH_MAX_FILLS:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                fill_count += len(item[1])
+            try:
+                inserted = await asyncio.to_thread(self._flush, batch)
+                log.info("📥 Stored streamed fills", extra={"inserted": inserted, "received": fill_count})
+            except Exception:
+                log.exception("❌ Error storing streamed fills", extra={"received": fill_count})
+
+    def _maintain(self):
+        with SessionLocal() as session:
+            run_maintenance(session)
+
+    async def run_maintenance_periodically(self):
+        """
+        همان نگهداری دوره‌ای collector.py (پارتیشن‌های ماه‌های بعد، نگهداری داده، bucketها) هر
+        COLLECTOR_INTERVAL_SECONDS، زیر قفل maintenance_lock تا با collectorها همزمان اجرا نشود.
+        """
+        while True:
+            try:
+                await asyncio.to_thread(self._maintain)
+            except Exception:
+                log.exception("❌ Error running maintenance")
+            await asyncio.sleep(COLLECTOR_INTERVAL_SECONDS)
+
+    async def run(self):
+        await asyncio.gather(self.run_maintenance_periodically(), self.refresh_subscriptions(), self.write_batches())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream tracked traders' fills over WebSocket into the database.")
+    parser.add_argument("--ws-url", default=HYPERLIQUID_WS_URL, help="WebSocket endpoint (e.g. ws://localhost:8765 for ws_replay_server.py)")
+    parser.add_argument("--record", metavar="FILE", help="Append every received userFills message to FILE (JSON Lines) for replay")
+    args = parser.parse_args()
+
+    init_db()
+    start_metrics_exporters()
+    record_file = open(args.record, "a", encoding="utf-8") if args.record else None
+    try:
+        asyncio.run(StreamCollector(ws_url=args.ws_url, record_file=record_file).run())
+    except KeyboardInterrupt:
+        log.info("🛑 Stream collector stopped.")
+    finally:
+        if record_file is not None:
+            record_file.close()
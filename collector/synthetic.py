@@ -0,0 +1,153 @@
+# collector/synthetic.py
+
+import json
+import time
+import random
+import argparse
+from itertools import accumulate
+from collections import defaultdict
+
+# قیمت پایه تقریبی چند دارایی واقعی؛ بقیه دارایی‌ها قیمت تصادفی می‌گیرند
+BASE_PRICES = {"BTC": 60000.0, "ETH": 3000.0, "SOL": 150.0, "HYPE": 25.0, "DOGE": 0.15, "XRP": 0.6}
+
+
+class SyntheticFillGenerator:
+    """
+    تولید fillهای مصنوعی با همان قالب پاسخ userFills صرافی (coin, px, sz, dir, closedPnl, time, tid, ...).
+
+    - فعالیت تریدرها و محبوبیت دارایی‌ها توزیع دم‌بلند (Pareto) دارد.
+    - هر تریدر برای هر دارایی پوزیشن واقعی نگه می‌دارد: Close هرگز بیش از حجم باز بسته نمی‌کند
+      و اگر پوزیشنی نباشد به جای آن Open تولید می‌شود.
+    - قیمت هر دارایی یک random walk است و زمان‌ها با نرخ fills_per_day تا «اکنون» پیش می‌روند.
+    """
+
+    def __init__(self, traders=500, assets=30, fills_per_day=50000, open_ratio=0.6, seed=42, end_ms=None):
+        if not 0 < open_ratio <= 1:
+            raise ValueError("open_ratio must be in (0, 1]")
+        self.random = random.Random(seed)
+        self.trader_count = traders
+        self.fills_per_day = fills_per_day
+        self.open_ratio = open_ratio
+        self.end_ms = end_ms if end_ms is not None else int(time.time() * 1000)
+
+        self.addresses = [f"0x{self.random.getrandbits(160):040x}" for _ in range(traders)]
+        self.assets = list(BASE_PRICES)[:assets] + [f"SYN{i}" for i in range(max(0, assets - len(BASE_PRICES)))]
+        self.prices = {
+            asset: BASE_PRICES.get(asset, round(self.random.lognormvariate(2, 1.5), 4)) for asset in self.assets
+        }
+        self.trader_cum_weights = list(accumulate(self.random.paretovariate(1.2) for _ in self.addresses))
+        self.asset_cum_weights = list(accumulate(self.random.paretovariate(1.0) for _ in self.assets))
+        # هر تریدر روی هر دارایی گرایش Long یا Short دارد
+        self.long_bias = {}
+        # (address, asset) -> حجم علامت‌دار باز و قیمت میانگین ورود
+        self.open_size = defaultdict(float)
+        self.entry_price = {}
+        self.next_tid = self.random.randrange(10 ** 14, 10 ** 15)
+        self.next_oid = self.random.randrange(10 ** 10, 10 ** 11)
+
+    def _step_price(self, asset):
+        price = self.prices[asset] * (1 + self.random.gauss(0, 0.002))
+        self.prices[asset] = max(price, 1e-6)
+        return self.prices[asset]
+
+    def _make_fill(self, address, asset, timestamp):
+        key = (address, asset)
+        if key not in self.long_bias:
+            self.long_bias[key] = self.random.random() < 0.5
+        price = self._step_price(asset)
+        current = self.open_size[key]
+        notional = self.random.lognormvariate(8, 1.5)  # اکثراً چند هزار دلار، با دم بلند
+        size = round(max(notional / price, 1e-4), 4)
+
+        closed_pnl = 0.0
+        if current == 0 or self.random.random() < self.open_ratio:
+            is_long = current > 0 if current != 0 else self.long_bias[key]
+            direction = "Open Long" if is_long else "Open Short"
+            signed = size if is_long else -size
+            previous = abs(current)
+            self.entry_price[key] = (self.entry_price.get(key, price) * previous + price * size) / (previous + size)
+            self.open_size[key] = current + signed
+        else:
+            size = round(min(size, abs(current)), 4) or abs(current)
+            is_long = current > 0
+            direction = "Close Long" if is_long else "Close Short"
+            entry = self.entry_price.get(key, price)
+            closed_pnl = (price - entry) * size if is_long else (entry - price) * size
+            remaining = abs(current) - size
+            if remaining <= 1e-9:
+                self.open_size.pop(key, None)
+                self.entry_price.pop(key, None)
+            else:
+                self.open_size[key] = remaining if is_long else -remaining
+
+        is_buy = direction in ("Open Long", "Close Short")
+        self.next_tid += self.random.randrange(1, 50)
+        self.next_oid += 1
+        return {
+            "coin": asset,
+            "px": f"{price:.6g}",
+            "sz": f"{size:.4f}",
+            "side": "B" if is_buy else "A",
+            "time": timestamp,
+            "dir": direction,
+            "closedPnl": f"{closed_pnl:.6f}",
+            "hash": f"0x{self.random.getrandbits(256):064x}",
+            "oid": self.next_oid,
+            "tid": self.next_tid,
+        }
+
+    def iter_batches(self, total_fills, batch_size=2000):
+        """
+        total_fills معامله به ترتیب زمان تولید می‌کند و در دسته‌های batch_size تایی
+        به صورت {address: [fill, ...]} برمی‌گرداند (همان ورودی FillIngestBuffer.add).
+        """
+        interval_ms = 86_400_000 / max(self.fills_per_day, 1)
+        start_ms = self.end_ms - int(total_fills * interval_ms)
+        batch = defaultdict(list)
+        count = 0
+        for index in range(total_fills):
+            address = self.random.choices(self.addresses, cum_weights=self.trader_cum_weights)[0]
+            asset = self.random.choices(self.assets, cum_weights=self.asset_cum_weights)[0]
+            timestamp = start_ms + int(index * interval_ms) + self.random.randrange(0, max(int(interval_ms), 1))
+            batch[address].append(self._make_fill(address, asset, timestamp))
+            count += 1
+            if count >= batch_size:
+                yield batch
+                batch = defaultdict(list)
+                count = 0
+        if batch:
+            yield batch
+
+
+def write_recording(generator, total_fills, path):
+    """
+    fillها را با قالب ضبط stream_collector.py (JSON Lines پیام‌های userFills) می‌نویسد
+    تا با ws_replay_server.py هم قابل بازپخش باشد.
+    """
+    written = 0
+    with open(path, "w", encoding="utf-8") as output:
+        for batch in generator.iter_batches(total_fills):
+            for address, fills in batch.items():
+                output.write(json.dumps({"channel": "userFills", "data": {"user": address, "fills": fills}}))
+                output.write("\n")
+                written += len(fills)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Hyperliquid fills as a userFills recording.")
+    parser.add_argument("output", help="JSON Lines file to write (replayable with ws_replay_server.py)")
+    parser.add_argument("--fills", type=int, default=10000)
+    parser.add_argument("--traders", type=int, default=500)
+    parser.add_argument("--assets", type=int, default=30)
+    parser.add_argument("--fills-per-day", type=int, default=50000)
+    parser.add_argument("--open-ratio", type=float, default=0.6, help="Probability that a fill opens/increases a position")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    generator = SyntheticFillGenerator(
+        traders=args.traders, assets=args.assets, fills_per_day=args.fills_per_day,
+        open_ratio=args.open_ratio, seed=args.seed
+    )
+    count = write_recording(generator, args.fills, args.output)
+    print(f"🧪 Wrote {count} synthetic fills for {args.traders} traders to {args.output}")
@@ -1,11 +1,25 @@
 # collector/telegram_sender.py
 
 import os
+import re
 import asyncio
+import threading
 import telegram
 from telegram import Bot
 from telegram.constants import ParseMode
-from telegram.error import TelegramError
+from telegram.error import TelegramError, RetryAfter, TimedOut, NetworkError, BadRequest
+from telegram.constants import MessageLimit
+from config import (
+    TELEGRAM_RATE_PER_SEC,
+    TELEGRAM_RATE_BURST,
+    TELEGRAM_SEND_CONCURRENCY,
+    TELEGRAM_MAX_SEND_ATTEMPTS
+)
+from rate_limiter import TokenBucket
+from logs import get_logger
+from metrics import TELEGRAM_MESSAGES, TELEGRAM_RETRIES, TELEGRAM_SEND_SECONDS
+
+log = get_logger("telegram")
 
 # 🔽 (جدید) ماژول Application.builder را وارد می‌کنیم
 from telegram.ext import Application 
@@ -18,12 +32,30 @@ BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
 PROXY_URL = os.environ.get("PROXY_URL")
 
+TELEGRAM_MAX_MESSAGE_LENGTH = MessageLimit.MAX_TEXT_LENGTH  # 4096
+
+# یک محدودکننده نرخ برای هر chat_id در کل پروسه؛ همه dispatcherها (مثلاً هر اجرای deliver_pending)
+# از همان سطل استفاده می‌کنند تا جریمه RetryAfter یکی، ارسال بقیه را هم متوقف کند
+_chat_rate_limiters = {}
+_chat_rate_limiters_lock = threading.Lock()
+
+
+def chat_rate_limiter(chat_id, rate_per_sec=TELEGRAM_RATE_PER_SEC, burst=TELEGRAM_RATE_BURST):
+    """
+    سطل توکن مشترک یک چت را برمی‌گرداند (و اولین بار با rate_per_sec و burst می‌سازد).
+    """
+    with _chat_rate_limiters_lock:
+        limiter = _chat_rate_limiters.get(chat_id)
+        if limiter is None:
+            limiter = _chat_rate_limiters[chat_id] = TokenBucket(rate_per_sec, burst, name="telegram")
+        return limiter
+
 def init_bot():
     """
     یک نمونه Bot با تنظیمات پروکسی با استفاده از Application.builder ایجاد می‌کند.
     """
     if not BOT_TOKEN or not CHAT_ID:
-        print("❌ TELEGRAM_BOT_TOKEN or CHAT_ID not set. Skipping Telegram.")
+        log.warning("❌ TELEGRAM_BOT_TOKEN or CHAT_ID not set. Skipping Telegram.")
         return None
 
     try:
@@ -35,13 +67,13 @@ def init_bot():
         builder = Application.builder().token(BOT_TOKEN)
 
         if PROXY_URL:
-            print(f"Connecting to Telegram via proxy: {PROXY_URL}")
+            log.info("Connecting to Telegram via proxy", extra={"proxy": PROXY_URL})
             # ۲. تنظیم پروکسی با متد مخصوص
             builder.proxy_url(PROXY_URL)
             # (این مورد برای اطمینان است، گرچه ما get_updates را صدا نمی‌زنیم)
             builder.get_updates_proxy_url(PROXY_URL)
         else:
-            print("Connecting to Telegram directly.")
+            log.info("Connecting to Telegram directly.")
         
         # ۳. ساخت اپلیکیشن
         # (build() فقط آبجکت را می‌سازد، آن را اجرا نمی‌کند)
@@ -52,39 +84,277 @@ def init_bot():
         return application.bot
         # -------------------------------------------------
 
-    except Exception as e:
-        print(f"❌ An unexpected error occurred in init_bot: {e}")
+    except Exception:
+        log.exception("❌ An unexpected error occurred in init_bot")
         return None
 
 
+# -------------------------------------------------
+# 🔽 (جدید) escape کردن MarkdownV2 با یک جدول ترجمه 🔽
+# -------------------------------------------------
+# همه کاراکترهای خاص MarkdownV2 طبق مستندات Bot API
+_MARKDOWN_V2_SPECIAL_CHARS = "\\_*[]()~`>#+-=|{}.!"
+_MARKDOWN_V2_TABLE = str.maketrans({char: "\\" + char for char in _MARKDOWN_V2_SPECIAL_CHARS})
+# داخل `code` فقط ` و \ باید escape شوند
+_MARKDOWN_V2_CODE_TABLE = str.maketrans({"`": "\\`", "\\": "\\\\"})
+
+def escape_markdown_v2(text):
+    """
+    متن ساده را برای استفاده در پیام MarkdownV2 (خارج از code) امن می‌کند.
+    """
+    return str(text).translate(_MARKDOWN_V2_TABLE)
+
+def escape_markdown_v2_code(text):
+    """
+    متن را برای قرار گرفتن بین دو بک‌تیک (`...`) امن می‌کند.
+    """
+    return str(text).translate(_MARKDOWN_V2_CODE_TABLE)
+
+
 async def send_telegram_message(bot_instance, message_text):
     """
-    یک پیام متنی را با استفاده از یک نمونه bot موجود ارسال می‌کند.
+    یک پیام MarkdownV2 را با استفاده از یک نمونه bot موجود ارسال می‌کند.
+    متغیرهای داخل پیام باید قبلاً با escape_markdown_v2 / escape_markdown_v2_code امن شده باشند.
     """
     if not message_text or not CHAT_ID or not bot_instance:
         return
     
-    # فرمت‌بندی MarkdownV2 برای تلگرام
-    safe_text = message_text.replace(".", "\.") \
-                            .replace("-", "\-") \
-                            .replace("(", "\(") \
-                            .replace(")", "\)") \
-                            .replace("!", "\!") \
-                            .replace("+", "\+") \
-                            .replace("=", "\=") \
-                            .replace("|", "\|") \
-                            .replace("{", "\{") \
-                            .replace("}", "\}") \
-                            .replace("#", "\#") \
-                            .replace("$", "\$")
     try:
         await bot_instance.send_message(
             chat_id=CHAT_ID,
-            text=safe_text,
+            text=message_text,
             parse_mode=ParseMode.MARKDOWN_V2,
             disable_web_page_preview=True
         )
     except TelegramError as e:
-        print(f"❌ Error sending telegram message: {e}")
-    except Exception as e:
-        print(f"❌ Unexpected error in send_telegram_message: {e}")
\ No newline at end of file
+        TELEGRAM_MESSAGES.inc(result="failed")
+        log.error("❌ Error sending telegram message", extra={"error": str(e)})
+    except Exception:
+        TELEGRAM_MESSAGES.inc(result="failed")
+        log.exception("❌ Unexpected error in send_telegram_message")
+    else:
+        TELEGRAM_MESSAGES.inc(result="sent")
+
+
+# -------------------------------------------------
+# 🔽 (جدید) صف ارسال: ادغام سیگنال‌ها در پیام‌های خلاصه 🔽
+# -------------------------------------------------
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    # در نسخه‌های جدید python-telegram-bot مقدار retry_after از نوع timedelta است
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+# نشانه‌های قالب‌بندی MarkdownV2؛ نشانه‌های چندحرفی اول بررسی می‌شوند
+_MARKDOWN_V2_MARKERS = ("```", "||", "__", "*", "_", "~", "`")
+_MARKDOWN_V2_CODE_MARKERS = ("```", "`")
+# لینک [متن](آدرس) یک واحد تقسیم‌نشدنی است
+_MARKDOWN_V2_LINK = re.compile(r"\[(?:\\.|[^\]\\])*\]\((?:\\.|[^)\\])*\)")
+
+
+def _markdown_v2_cut_points(text):
+    """
+    مرزهایی از متن که یک escape (\\x) یا لینک را نمی‌شکنند، به صورت (موقعیت، entityهای باز در آن نقطه).
+    """
+    points, open_entities, i = [], [], 0
+    while i < len(text):
+        points.append((i, tuple(open_entities)))
+        if text[i] == "\\":
+            i += 2
+            continue
+        if open_entities and open_entities[-1] in _MARKDOWN_V2_CODE_MARKERS:
+            # داخل code/pre فقط نشانه بسته شدن همان بلوک معنا دارد
+            if text.startswith(open_entities[-1], i):
+                i += len(open_entities.pop())
+            else:
+                i += 1
+            continue
+        link = _MARKDOWN_V2_LINK.match(text, i)
+        if link:
+            i = link.end()
+            continue
+        for marker in _MARKDOWN_V2_MARKERS:
+            if text.startswith(marker, i):
+                if marker in open_entities:
+                    open_entities.remove(marker)
+                else:
+                    open_entities.append(marker)
+                i += len(marker)
+                break
+        else:
+            i += 1
+    points.append((len(text), tuple(open_entities)))
+    return points
+
+
+def _reopen_marker(marker):
+    # خط اول بعد از ``` زبان بلوک حساب می‌شود
+    return "```\n" if marker == "```" else marker
+
+
+def _next_cut(text, max_length):
+    """
+    بهترین نقطه تقسیم در max_length کاراکتر اول: به ترتیب اولویت پایان خط، فاصله یا هر نقطه‌ای
+    بیرون از entityها. اگر چنین نقطه‌ای نباشد (مثلاً یک بلوک code بلند)، entityهای باز در پایان
+    تکه بسته و در ابتدای تکه بعد دوباره باز می‌شوند.
+    خروجی: (تکه، باقی‌مانده متن)
+    """
+    best = {}
+    for position, open_entities in _markdown_v2_cut_points(text):
+        closing = "".join(reversed(open_entities))
+        if position == 0 or position + len(closing) > max_length:
+            continue
+        if not open_entities:
+            kind = {"\n": "line", " ": "space"}.get(text[position:position + 1], "plain")
+            best[kind] = position
+        best["forced"] = position
+    for kind in ("line", "space"):
+        if kind in best:
+            return text[:best[kind]], text[best[kind] + 1:]
+    if "plain" in best:
+        return text[:best["plain"]], text[best["plain"]:]
+    if "forced" in best:
+        position = best["forced"]
+        open_entities = dict(_markdown_v2_cut_points(text))[position]
+        closing = "".join(reversed(open_entities))
+        reopening = "".join(_reopen_marker(marker) for marker in open_entities)
+        return text[:position] + closing, reopening + text[position:]
+    # حتی یک escape یا لینک از max_length بلندتر است؛ چاره‌ای جز برش مستقیم نیست
+    return text[:max_length], text[max_length:]
+
+
+def _split_long_message(text, max_length):
+    """
+    پیامی که از حد مجاز طولانی‌تر است را تقسیم می‌کند، ترجیحاً روی مرز خطوط، بدون شکستن
+    escapeها، لینک‌ها یا entityهای MarkdownV2 (*bold*، `code`، ```pre``` و ...).
+    """
+    chunks = []
+    while len(text) > max_length:
+        chunk, text = _next_cut(text, max_length)
+        if chunk:
+            chunks.append(chunk)
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class TelegramDispatcher:
+    """
+    سیگنال‌ها را جمع می‌کند و در قالب پیام‌های خلاصه (تا سقف طول پیام تلگرام) ارسال می‌کند؛
+    با همزمانی محدود، محدودیت نرخ برای هر چت و رعایت RetryAfter.
+    """
+
+    SEPARATOR = "\n\n"
+
+    def __init__(self, bot_instance, chat_id=CHAT_ID, rate_per_sec=TELEGRAM_RATE_PER_SEC,
+                 burst=TELEGRAM_RATE_BURST, concurrency=TELEGRAM_SEND_CONCURRENCY,
+                 max_length=TELEGRAM_MAX_MESSAGE_LENGTH):
+        self.bot = bot_instance
+        self.chat_id = chat_id
+        self.rate_limiter = chat_rate_limiter(chat_id, rate_per_sec, burst)
+        self.concurrency = concurrency
+        self.max_length = max_length
+        self.pending = []
+
+    def add(self, message_text, ref=None):
+        """
+        یک پیام MarkdownV2 (با مقادیر escape شده) را به صف اضافه می‌کند.
+        ref شناسه اختیاری برای گزارش وضعیت ارسال در خروجی flush است.
+        """
+        if message_text:
+            self.pending.append((message_text, ref))
+
+    def _build_digests(self):
+        """
+        پیام‌های صف را به واحدهای ارسال [(لیست متن‌ها، refها), ...] تبدیل می‌کند. هر پیام خلاصه یک متن دارد؛
+        پیام بلندتر از حد مجاز یک واحد با چند تکه است که به ترتیب ارسال می‌شوند.
+        """
+        digests, text, refs = [], "", []
+        for message_text, ref in self.pending:
+            if len(message_text) > self.max_length:
+                if text:
+                    digests.append(([text], refs))
+                    text, refs = "", []
+                digests.append((_split_long_message(message_text, self.max_length), [ref]))
+                continue
+            candidate = f"{text}{self.SEPARATOR}{message_text}" if text else message_text
+            if len(candidate) > self.max_length:
+                digests.append(([text], refs))
+                text, refs = message_text, [ref]
+            else:
+                text = candidate
+                refs.append(ref)
+        if text:
+            digests.append(([text], refs))
+        return digests
+
+    async def _send_digest(self, text):
+        for attempt in range(TELEGRAM_MAX_SEND_ATTEMPTS):
+            await self.rate_limiter.acquire_async()
+            try:
+                with TELEGRAM_SEND_SECONDS.time():
+                    await self.bot.send_message(
+                        chat_id=self.chat_id,
+                        text=text,
+                        parse_mode=ParseMode.MARKDOWN_V2,
+                        disable_web_page_preview=True
+                    )
+                TELEGRAM_MESSAGES.inc(result="sent")
+                return True
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                TELEGRAM_RETRIES.inc(reason="flood_control")
+                log.warning("⚠️ Telegram flood control. Retrying...", extra={
+                    "delay_seconds": round(delay, 1), "attempt": attempt + 1, "max_attempts": TELEGRAM_MAX_SEND_ATTEMPTS})
+                self.rate_limiter.penalize(delay)
+            except BadRequest as e:
+                # BadRequest زیرکلاس NetworkError است ولی با تکرار درست نمی‌شود (مثلاً خطای parse entities)
+                TELEGRAM_MESSAGES.inc(result="failed")
+                log.error("❌ Telegram rejected the message", extra={"error": str(e)})
+                return False
+            except (TimedOut, NetworkError) as e:
+                delay = min(2 ** attempt, 30)
+                TELEGRAM_RETRIES.inc(reason="network")
+                log.warning("⚠️ Telegram network error. Retrying...", extra={"error": str(e), "delay_seconds": delay})
+                await asyncio.sleep(delay)
+            except TelegramError as e:
+                TELEGRAM_MESSAGES.inc(result="failed")
+                log.error("❌ Error sending telegram message", extra={"error": str(e)})
+                return False
+        TELEGRAM_MESSAGES.inc(result="failed")
+        log.error("❌ Telegram message failed after all attempts.", extra={"attempts": TELEGRAM_MAX_SEND_ATTEMPTS})
+        return False
+
+    async def flush(self):
+        """
+        همه پیام‌های صف را ارسال می‌کند و (refهای ارسال شده، refهای ناموفق) را برمی‌گرداند.
+        """
+        if not self.pending:
+            return [], []
+        if not self.bot or not self.chat_id:
+            failed = [ref for _, ref in self.pending]
+            self.pending = []
+            return [], failed
+
+        digests = self._build_digests()
+        message_count = len(self.pending)
+        self.pending = []
+        log.info("📨 Sending Telegram digests", extra={"signals": message_count, "messages": len(digests)})
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(texts):
+            # تکه‌های یک پیام به ترتیب؛ ref فقط وقتی ارسال شده حساب می‌شود که همه تکه‌هایش رفته باشند
+            async with semaphore:
+                for text in texts:
+                    if not await self._send_digest(text):
+                        return False
+                return True
+
+        results = await asyncio.gather(*(send(texts) for texts, _ in digests))
+        sent, failed = [], []
+        for (_, refs), ok in zip(digests, results):
+            (sent if ok else failed).extend(ref for ref in refs if ref is not None)
+        return sent, failed
@@ -0,0 +1,41 @@
+# collector/tests/test_collection_jobs.py
+
+from config import COLLECTOR_MIN_POLL_SECONDS
+from database import CollectionJob, TrackedTrader
+from collection_jobs import sync_jobs, claim_jobs, complete_jobs, failure_backoff_seconds
+
+NOW_MS = 1_700_000_000_000
+
+
+def _run_once(session, failed, now_ms):
+    addresses = claim_jobs(session, "worker-1", limit=10, now_ms=now_ms)
+    # زمان‌بندی عادی هر دو تریدر: یک دقیقه بعد
+    complete_jobs(session, "worker-1", {address: now_ms + 60_000 for address in addresses}, failed, now_ms=now_ms)
+    session.expire_all()
+    return {job.user_address: job for job in session.query(CollectionJob)}
+
+
+def test_failed_jobs_back_off_exponentially_up_to_the_cap(session):
+    session.add_all([TrackedTrader(user_address="0xok"), TrackedTrader(user_address="0xbad")])
+    session.commit()
+    sync_jobs(session, now_ms=NOW_MS)
+
+    now_ms = NOW_MS
+    for attempt in range(1, 12):
+        jobs = _run_once(session, {"0xbad"}, now_ms)
+        assert jobs["0xbad"].failures == attempt
+        assert jobs["0xbad"].next_run_at == max(
+            now_ms + 60_000, now_ms + failure_backoff_seconds(attempt) * 1000
+        )
+        assert jobs["0xok"].failures == 0
+        assert jobs["0xok"].next_run_at == now_ms + 60_000
+        now_ms = jobs["0xbad"].next_run_at
+
+    assert failure_backoff_seconds(1) == COLLECTOR_MIN_POLL_SECONDS
+    assert failure_backoff_seconds(3) == 4 * COLLECTOR_MIN_POLL_SECONDS
+    assert failure_backoff_seconds(1000) == failure_backoff_seconds(11) == 3600
+
+    # اولین دریافت موفق شمارنده را صفر و زمان‌بندی عادی را برمی‌گرداند
+    jobs = _run_once(session, set(), now_ms)
+    assert jobs["0xbad"].failures == 0
+    assert jobs["0xbad"].next_run_at == now_ms + 60_000
@@ -0,0 +1,68 @@
+# collector/tests/test_outbox.py
+
+import time
+from database import SignalOutbox
+from outbox import claim_pending, record_delivery, emit_signals, load_watermarks
+from config import SIGNAL_OUTBOX_CLAIM_SECONDS, SIGNAL_OUTBOX_MAX_ATTEMPTS
+
+
+def _add_signals(session, count, now_ms):
+    for index in range(count):
+        session.add(SignalOutbox(
+            analysis="new_trades", dedup_key=f"test:{index}", message=f"signal {index}", created_at=now_ms, attempts=0
+        ))
+    session.commit()
+
+
+def test_claimed_rows_are_not_claimed_twice(session):
+    now_ms = int(time.time() * 1000)
+    _add_signals(session, 3, now_ms)
+
+    first = claim_pending(session, now_ms=now_ms)
+    assert [message for _, message in first] == ["signal 0", "signal 1", "signal 2"]
+    # ارسال‌کننده دوم در طول lease چیزی برنمی‌دارد
+    assert claim_pending(session, now_ms=now_ms + 1000) == []
+    # پس از انقضای lease (مثلاً crash ارسال‌کننده) ردیف‌ها دوباره قابل برداشت هستند
+    expired = now_ms + SIGNAL_OUTBOX_CLAIM_SECONDS * 1000 + 1
+    assert len(claim_pending(session, now_ms=expired)) == 3
+    assert {row.attempts for row in session.query(SignalOutbox)} == {2}
+
+
+def test_record_delivery_marks_sent_and_releases_failed(session):
+    now_ms = int(time.time() * 1000)
+    _add_signals(session, 3, now_ms)
+    claimed = [signal_id for signal_id, _ in claim_pending(session, now_ms=now_ms)]
+
+    record_delivery(session, claimed, sent_ids={claimed[0]}, failed_ids={claimed[1]}, now_ms=now_ms)
+
+    rows = {row.id: row for row in session.query(SignalOutbox)}
+    assert rows[claimed[0]].sent_at == now_ms and rows[claimed[0]].claimed_until is None
+    assert rows[claimed[1]].sent_at is None and rows[claimed[1]].last_error
+    # ردیف‌های ناموفق یا ارسال‌نشده بلافاصله برای تلاش بعدی برداشته می‌شوند
+    retry = claim_pending(session, now_ms=now_ms + 1000)
+    assert sorted(signal_id for signal_id, _ in retry) == sorted(claimed[1:])
+
+
+def test_rows_past_max_attempts_are_not_claimed(session):
+    now_ms = int(time.time() * 1000)
+    _add_signals(session, 1, now_ms)
+    session.query(SignalOutbox).update({"attempts": SIGNAL_OUTBOX_MAX_ATTEMPTS})
+    session.commit()
+    assert claim_pending(session, now_ms=now_ms) == []
+
+
+def test_emit_signals_is_idempotent_per_dedup_key(session):
+    assert emit_signals("new_trades", [("trade:1", "first"), ("trade:2", "second")], 5) == 2
+    # اجرای دوباره همان بازه (مثلاً پس از crash پیش از commit تحلیل بعدی) سیگنال تکراری نمی‌سازد
+    assert emit_signals("new_trades", [("trade:2", "second again"), ("trade:3", "third")], 7) == 1
+    messages = dict(session.query(SignalOutbox.dedup_key, SignalOutbox.message))
+    assert messages == {"trade:1": "first", "trade:2": "second", "trade:3": "third"}
+
+
+def test_watermark_never_moves_backwards(session):
+    emit_signals("new_trades", [], 10)
+    emit_signals("trade_consensus", [], 3)
+    emit_signals("new_trades", [], 4)
+    assert load_watermarks(session) == {"new_trades": 10, "trade_consensus": 3}
+    emit_signals("new_trades", [("trade:9", "m")], 12)
+    assert load_watermarks(session)["new_trades"] == 12
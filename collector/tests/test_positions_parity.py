@@ -0,0 +1,99 @@
+# collector/tests/test_positions_parity.py
+
+import pytest
+from database import Fill
+from ingest import FillIngestBuffer
+from analysis_logic import get_open_positions, get_materialized_positions
+
+T0 = 1_700_000_000_000
+MINUTE = 60_000
+
+# (تریدر، دارایی، جهت، قیمت، حجم، دقیقه)
+FILLS = [
+    # پوزیشن Long با دو ورود و یک خروج جزئی
+    ("0xaaa", "BTC", "Open Long", 100.0, 1.0, 0),
+    ("0xaaa", "BTC", "Open Long", 110.0, 1.0, 5),
+    ("0xaaa", "BTC", "Close Long", 120.0, 0.5, 30),
+    # پوزیشن کاملاً بسته شده
+    ("0xaaa", "ETH", "Open Long", 10.0, 2.0, 1),
+    ("0xaaa", "ETH", "Close Long", 12.0, 2.0, 40),
+    # Short بسته شده و سپس Long جدید
+    ("0xbbb", "BTC", "Open Short", 100.0, 1.0, 2),
+    ("0xbbb", "BTC", "Close Short", 90.0, 1.0, 20),
+    ("0xbbb", "BTC", "Open Long", 95.0, 3.0, 45),
+    # چرخش پوزیشن از Long به Short با یک fill
+    ("0xbbb", "SOL", "Open Long", 20.0, 2.0, 3),
+    ("0xbbb", "SOL", "Long > Short", 22.0, 5.0, 50),
+    # Short خالص
+    ("0xccc", "ETH", "Open Short", 11.0, 4.0, 10),
+    ("0xccc", "ETH", "Open Short", 13.0, 1.0, 55),
+]
+
+BACKENDS = ["sql", "python", "numpy"]
+
+
+@pytest.fixture
+def fills_session(session):
+    buffer = FillIngestBuffer(session)
+    for tid, (user, asset, direction, price, size, minute) in enumerate(FILLS, start=1):
+        buffer.add(user, [{
+            "coin": asset, "px": str(price), "sz": str(size), "dir": direction,
+            "time": T0 + minute * MINUTE, "tid": tid, "hash": f"0x{tid:064x}", "oid": tid,
+        }])
+    buffer.flush()
+    return session
+
+
+def _normalized(positions):
+    return sorted(
+        (
+            position["user"], position["asset"], position["side"],
+            pytest.approx(position["net_volume"]), pytest.approx(position["avg_price"]),
+            pytest.approx(position["position_value"]),
+        )
+        for position in positions
+    )
+
+
+QUERIES = {
+    "all": lambda query: query,
+    "since_minute_25": lambda query: query.filter(Fill.timestamp >= T0 + 25 * MINUTE),
+    "until_minute_25": lambda query: query.filter(Fill.timestamp < T0 + 25 * MINUTE),
+    "trader_bbb": lambda query: query.filter(Fill.user_address == "0xbbb"),
+}
+
+
+@pytest.mark.parametrize("query_name", sorted(QUERIES))
+def test_backends_agree(fills_session, query_name):
+    fills_query = QUERIES[query_name](fills_session.query(Fill))
+    expected = get_open_positions(fills_session, fills_query, backend="python")
+    assert expected, "fixture should leave open positions for every query"
+    for backend in BACKENDS:
+        assert _normalized(get_open_positions(fills_session, fills_query, backend=backend)) == _normalized(expected), backend
+
+
+def test_default_backend_is_sql_and_matches_python(fills_session):
+    fills_query = fills_session.query(Fill)
+    assert _normalized(get_open_positions(fills_session, fills_query)) == _normalized(
+        get_open_positions(fills_session, fills_query, backend="python")
+    )
+
+
+def test_materialized_positions_match_full_history(fills_session):
+    expected = get_open_positions(fills_session, fills_session.query(Fill), backend="python")
+    assert _normalized(get_materialized_positions(fills_session)) == _normalized(expected)
+
+
+def test_expected_positions(fills_session):
+    positions = {
+        (position["user"], position["asset"]): position
+        for position in get_open_positions(fills_session, fills_session.query(Fill))
+    }
+    # ETH تریدر aaa بسته شده و نباید برگردد
+    assert set(positions) == {("0xaaa", "BTC"), ("0xbbb", "BTC"), ("0xbbb", "SOL"), ("0xccc", "ETH")}
+    assert positions[("0xaaa", "BTC")]["side"] == "Long"
+    assert positions[("0xaaa", "BTC")]["net_volume"] == pytest.approx(1.5)
+    assert positions[("0xaaa", "BTC")]["avg_price"] == pytest.approx(105.0)
+    assert positions[("0xbbb", "SOL")]["side"] == "Short"
+    assert positions[("0xbbb", "SOL")]["net_volume"] == pytest.approx(-3.0)
+    assert positions[("0xccc", "ETH")]["avg_price"] == pytest.approx(11.4)
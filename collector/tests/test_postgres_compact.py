@@ -0,0 +1,80 @@
+# collector/tests/test_postgres_compact.py
+
+import json
+import pytest
+from sqlalchemy import text
+
+# هر ردیف view سازگار باید با ردیف همان id در fills_wide برابر باشد
+MISMATCHED_ROWS_SQL = """
+    SELECT COUNT(*) FROM fills f JOIN fills_wide w ON w.id = f.id
+    WHERE f.user_address <> lower(w.user_address) OR f.asset <> w.asset OR f.hash <> w.hash
+       OR f.timestamp <> w.timestamp OR f.direction <> w.direction OR f.is_buy <> w.is_buy
+       OR abs(f.price - w.price) > 1e-8 OR abs(f.size - w.size) > 1e-8
+"""
+
+INGEST_SCRIPT = (
+    "import time; from database import SessionLocal; from ingest import FillIngestBuffer\n"
+    "with SessionLocal() as session:\n"
+    "    buffer = FillIngestBuffer(session)\n"
+    "    buffer.add('0x' + 'ab' * 20, [{'coin': 'NEWCOIN', 'px': '1.5', 'sz': '2', 'dir': 'Open Long',\n"
+    "        'time': int(time.time() * 1000), 'tid': 999, 'hash': '0x' + 'cd' * 32, 'oid': 1}])\n"
+    "    buffer.flush()\n"
+)
+
+RETENTION_SCRIPT = (
+    "import json; from database import SessionLocal; from partitions import apply_retention\n"
+    "with SessionLocal() as session: print(json.dumps(apply_retention(session, retention_days=30, mode='rollup')))"
+)
+
+
+def _scalar(engine, sql):
+    with engine.connect() as conn:
+        return conn.execute(text(sql)).scalar()
+
+
+def _assert_rollup_keeps_totals(engine, postgres_url, collector_cli, storage):
+    # fillهای حذف شده در fill_rollups_daily جمع می‌شوند؛ مجموع حجم و تعداد تغییر نمی‌کند
+    total_size, total_count = _scalar(engine, "SELECT SUM(size) FROM fills"), _scalar(engine, "SELECT COUNT(*) FROM fills")
+    output = collector_cli(postgres_url, "-c", RETENTION_SCRIPT, storage=storage).stdout
+    assert json.loads(output.strip().splitlines()[-1]), "the oldest partition should be past retention"
+    kept_size = _scalar(engine, "SELECT COALESCE(SUM(size), 0) FROM fills")
+    rolled_size = _scalar(engine, "SELECT SUM(buy_volume + sell_volume) FROM fill_rollups_daily")
+    assert kept_size + rolled_size == pytest.approx(total_size)
+    kept_count = _scalar(engine, "SELECT COUNT(*) FROM fills")
+    assert kept_count + _scalar(engine, "SELECT SUM(fill_count) FROM fill_rollups_daily") == total_count
+
+
+def test_wide_retention_rolls_up_dropped_partitions(postgres_url, baseline_fills, collector_cli):
+    collector_cli(postgres_url, "migrations.py", "migrate")
+    collector_cli(postgres_url, "partitions.py", "migrate")
+    _assert_rollup_keeps_totals(baseline_fills, postgres_url, collector_cli, storage="wide")
+
+
+def test_compact_migration_round_trip(postgres_url, baseline_fills, collector_cli):
+    engine = baseline_fills
+    collector_cli(postgres_url, "migrations.py", "migrate")
+    collector_cli(postgres_url, "partitions.py", "migrate")
+
+    collector_cli(postgres_url, "compact.py", "migrate", storage="compact")
+    # سرویس‌ها پس از مهاجرت با FILLS_STORAGE=compact بالا می‌آیند
+    collector_cli(postgres_url, "migrations.py", "migrate", storage="compact")
+    assert _scalar(engine, "SELECT relkind FROM pg_class WHERE relname = 'fills'") == "v"
+    assert _scalar(engine, "SELECT COUNT(*) FROM fills") == _scalar(engine, "SELECT COUNT(*) FROM fills_wide") == 20000
+    assert _scalar(engine, MISMATCHED_ROWS_SQL) == 0
+
+    sizes = collector_cli(postgres_url, "compact.py", "sizes", storage="compact").stdout
+    assert "fills_compact" in sizes and "rows≈20,000" in sizes
+    assert collector_cli(postgres_url, "migrations.py", "explain", "--no-seqscan", storage="compact").returncode == 0
+
+    # درج جدید از مسیر insert_compact_fills؛ شمارنده id پس از کپی ادامه می‌دهد
+    collector_cli(postgres_url, "-c", INGEST_SCRIPT, storage="compact")
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT id, user_address, asset, price, size, hash FROM fills WHERE tid = 999")).one()
+    assert row.id > 20000
+    assert (row.user_address, row.asset, row.price, row.size, row.hash) == ("0x" + "ab" * 20, "NEWCOIN", 1.5, 2.0, "0x" + "cd" * 32)
+
+    _assert_rollup_keeps_totals(engine, postgres_url, collector_cli, storage="compact")
+
+    collector_cli(postgres_url, "compact.py", "drop-wide", storage="compact")
+    assert _scalar(engine, "SELECT to_regclass('fills_wide')") is None
+    assert _scalar(engine, "SELECT COUNT(*) FROM fills") > 0
@@ -0,0 +1,38 @@
+# collector/tests/test_postgres_dashboard.py
+
+# fill با id کوچک‌تر که دیرتر commit می‌شود نباید پشت max_fill_id کش داشبورد جا بماند
+REFRESH_SCRIPT = (
+    "import time, threading\n"
+    "from database import SessionLocal\n"
+    "from ingest import FillIngestBuffer, insert_fills\n"
+    "from dashboard import DashboardCache\n"
+    "def fill(user, coin, tid):\n"
+    "    return {'coin': coin, 'px': '10', 'sz': '1', 'dir': 'Open Long', 'side': 'B',\n"
+    "            'time': int(time.time() * 1000), 'tid': tid, 'hash': '0x%064x' % tid, 'oid': tid}\n"
+    "cache = DashboardCache(full_reload_seconds=3600)\n"
+    "cache.refresh()\n"
+    "slow = SessionLocal()\n"
+    "buffer = FillIngestBuffer(slow)\n"
+    "buffer.add('0x' + 'aa' * 20, [fill('0x' + 'aa' * 20, 'SLOW', 1)])\n"
+    "insert_fills(slow, buffer.rows)\n"
+    "with SessionLocal() as fast:\n"
+    "    fast_buffer = FillIngestBuffer(fast)\n"
+    "    fast_buffer.add('0x' + 'bb' * 20, [fill('0x' + 'bb' * 20, 'FAST', 2)])\n"
+    "    fast_buffer.flush()\n"
+    "refresher = threading.Thread(target=cache.refresh)\n"
+    "refresher.start()\n"
+    "time.sleep(1)\n"
+    "assert refresher.is_alive(), 'refresh should wait for the in-flight ingest transaction'\n"
+    "slow.commit()\n"
+    "slow.close()\n"
+    "refresher.join(10)\n"
+    "assets = {asset for _, asset in cache.positions}\n"
+    "assert assets == {'SLOW', 'FAST'}, assets\n"
+    "print('ok')\n"
+)
+
+
+def test_refresh_waits_for_in_flight_ingest(postgres_url, collector_cli):
+    collector_cli(postgres_url, "migrations.py", "migrate")
+    collector_cli(postgres_url, "partitions.py", "maintain")
+    assert collector_cli(postgres_url, "-c", REFRESH_SCRIPT).stdout.strip().endswith("ok")
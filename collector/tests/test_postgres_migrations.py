@@ -0,0 +1,56 @@
+# collector/tests/test_postgres_migrations.py
+
+import json
+from sqlalchemy import text
+
+EXPLAIN_SCRIPT = (
+    "import json; from database import SessionLocal; from migrations import explain_workload\n"
+    "with SessionLocal() as session: print(json.dumps(explain_workload(session, disable_seqscan=True)))"
+)
+
+
+def vacuum(engine):
+    # index-only scan ایندکس پوشاننده به visibility map نیاز دارد (در محیط واقعی کار autovacuum)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE fills"))
+
+
+def fills_indexes(engine):
+    with engine.connect() as conn:
+        return set(conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'fills'")).scalars())
+
+
+def explain(collector_cli, database_url, storage="wide"):
+    output = collector_cli(database_url, "-c", EXPLAIN_SCRIPT, storage=storage).stdout
+    return {result["query"]: result for result in json.loads(output.strip().splitlines()[-1])}
+
+
+def test_migrations_upgrade_baseline_schema(postgres_url, baseline_fills, collector_cli):
+    engine = baseline_fills
+
+    collector_cli(postgres_url, "migrations.py", "migrate")
+    status = collector_cli(postgres_url, "migrations.py", "status").stdout
+    assert "pending" not in status
+
+    indexes = fills_indexes(engine)
+    assert {"uq_fills_user_tid_time", "ix_fills_user_time", "ix_fills_open_time", "ix_fills_user_asset_cover"} <= indexes
+    assert not indexes & {"ix_fills_id", "ix_fills_hash", "ix_fills_oid", "ix_fills_user_address", "ix_fills_asset"}
+    # اجرای دوباره کاری انجام نمی‌دهد
+    collector_cli(postgres_url, "migrations.py", "migrate")
+
+    vacuum(engine)
+    results = explain(collector_cli, postgres_url)
+    assert all(result["ok"] for result in results.values()), results
+
+
+def test_workload_uses_indexes_after_partitioning(postgres_url, baseline_fills, collector_cli):
+    engine = baseline_fills
+    collector_cli(postgres_url, "migrations.py", "migrate")
+    collector_cli(postgres_url, "partitions.py", "migrate")
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM fills")).scalar() == 20000
+    vacuum(engine)
+    results = explain(collector_cli, postgres_url)
+    assert all(result["ok"] for result in results.values()), results
+    assert collector_cli(postgres_url, "migrations.py", "explain", "--no-seqscan").returncode == 0
@@ -0,0 +1,29 @@
+# collector/tests/test_rate_limiter.py
+
+import pytest
+from rate_limiter import TokenBucket
+
+
+def test_concurrent_penalties_take_the_latest_deadline():
+    bucket = TokenBucket(rate=2, capacity=10)
+    # هشت 429 همزمان با Retry-After پنج ثانیه: انتظار پنج ثانیه است، نه چهل
+    for _ in range(8):
+        bucket.penalize(5)
+    assert bucket._reserve() == pytest.approx(5.5, abs=0.01)
+
+
+def test_longer_penalty_extends_the_wait():
+    bucket = TokenBucket(rate=2, capacity=10)
+    bucket.penalize(1)
+    bucket.penalize(5)
+    bucket.penalize(1)
+    assert bucket._reserve() == pytest.approx(5.5, abs=0.01)
+
+
+def test_penalty_keeps_existing_reservations():
+    bucket = TokenBucket(rate=1, capacity=1)
+    for _ in range(10):
+        bucket._reserve()
+    # ۹ ثانیه انتظار از قبل رزرو شده؛ جریمه کوتاه‌تر آن را کم نمی‌کند
+    bucket.penalize(2)
+    assert bucket._reserve() == pytest.approx(10.0, abs=0.01)
@@ -0,0 +1,93 @@
+# collector/tests/test_stream_collector.py
+
+import time
+import asyncio
+import websockets
+import stream_collector
+from database import Fill, TrackedTrader
+from ws_replay_server import ReplayServer
+
+TRADERS = ["0x" + char * 40 for char in "abc"]
+FILLS_PER_TRADER = 30
+
+
+def _recorded_fills():
+    now_ms = int(time.time() * 1000)
+    return {
+        address: [
+            {"coin": "BTC", "px": "100", "sz": "1", "dir": "Open Long", "time": now_ms - index * 1000,
+             "tid": trader_index * 1000 + index, "hash": f"0x{trader_index * 1000 + index:064x}", "oid": index}
+            for index in range(FILLS_PER_TRADER)
+        ]
+        for trader_index, address in enumerate(TRADERS)
+    }
+
+
+def _set_tracked(session, addresses):
+    session.query(TrackedTrader).delete()
+    session.add_all(TrackedTrader(user_address=address) for address in addresses)
+    session.commit()
+
+
+def _stored_counts(session):
+    session.expire_all()
+    return {address: session.query(Fill).filter(Fill.user_address == address).count() for address in TRADERS}
+
+
+async def _wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.05)
+
+
+def test_stream_collector_against_replay_server(session, monkeypatch):
+    monkeypatch.setattr(stream_collector, "STREAM_TRADERS_REFRESH_SECONDS", 0.2)
+    monkeypatch.setattr(stream_collector, "STREAM_FLUSH_INTERVAL_SECONDS", 0.2)
+    _set_tracked(session, TRADERS[:2])
+    replay = ReplayServer(_recorded_fills(), delay=0.01, batch_size=10)
+    flushed_batches = []
+
+    async def scenario():
+        async with websockets.serve(replay.handler, "localhost", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            collector = stream_collector.StreamCollector(ws_url=f"ws://localhost:{port}", users_per_connection=10)
+            flush = collector._flush
+            monkeypatch.setattr(collector, "_flush", lambda batch: flushed_batches.append(batch) or flush(batch))
+            tasks = [asyncio.create_task(collector.refresh_subscriptions()), asyncio.create_task(collector.write_batches())]
+            try:
+                # subscribe اولیه: fillهای دو تریدر دنبال شده ذخیره می‌شوند
+                await _wait_for(lambda: _stored_counts(session) == {
+                    TRADERS[0]: FILLS_PER_TRADER, TRADERS[1]: FILLS_PER_TRADER, TRADERS[2]: 0
+                })
+
+                # تغییر tracked_traders: فقط تفاوت subscribe/unsubscribe می‌شود
+                subscribed_before = len(replay.subscriptions)
+                _set_tracked(session, [TRADERS[0], TRADERS[2]])
+                await _wait_for(lambda: _stored_counts(session)[TRADERS[2]] == FILLS_PER_TRADER)
+                assert sorted(replay.subscriptions[subscribed_before:]) == [
+                    ("subscribe", TRADERS[2]), ("unsubscribe", TRADERS[1])
+                ]
+
+                # قطع اتصال از سمت سرور: اتصال دوباره برقرار و همه اشتراک‌ها تکرار می‌شوند
+                subscribed_before = len(replay.subscriptions)
+                for connection in list(server.connections):
+                    await connection.close()
+                await _wait_for(lambda: len(replay.subscriptions) - subscribed_before >= 2)
+                assert sorted(replay.subscriptions[subscribed_before:]) == [
+                    ("subscribe", TRADERS[0]), ("subscribe", TRADERS[2])
+                ]
+                # بازپخش دوباره پس از اتصال مجدد تکراری است و ردیف جدیدی نمی‌سازد
+                await asyncio.sleep(0.5)
+                assert _stored_counts(session) == {
+                    TRADERS[0]: FILLS_PER_TRADER, TRADERS[1]: FILLS_PER_TRADER, TRADERS[2]: FILLS_PER_TRADER
+                }
+            finally:
+                for task in tasks + collector.connection_tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, *collector.connection_tasks, return_exceptions=True)
+
+    asyncio.run(scenario())
+    # پیام‌ها (هر کدام ۱۰ fill) به صورت دسته‌ای ذخیره می‌شوند، نه یک تراکنش برای هر پیام
+    messages = sum(len(batch) for batch in flushed_batches)
+    assert len(flushed_batches) < messages
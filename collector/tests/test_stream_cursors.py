@@ -0,0 +1,50 @@
+# collector/tests/test_stream_cursors.py
+
+import time
+from database import TraderCursor
+from ingest import FillIngestBuffer
+from collector import load_start_times
+
+HOUR_MS = 3600 * 1000
+
+
+def _fill(tid, timestamp):
+    return {"coin": "BTC", "px": "100", "sz": "1", "dir": "Open Long", "time": timestamp, "tid": tid,
+            "hash": f"0x{tid:064x}", "oid": tid}
+
+
+def _cursor(session, address):
+    return session.query(TraderCursor.last_fill_time).filter(TraderCursor.user_address == address).scalar()
+
+
+def test_streamed_fills_do_not_advance_poll_cursor(session):
+    now_ms = int(time.time() * 1000)
+    polled_at = now_ms - 5 * HOUR_MS
+    poll = FillIngestBuffer(session)
+    poll.add("0xaaa", [_fill(1, polled_at)])
+    poll.flush()
+
+    # اتصال WebSocket مدتی قطع بوده و اولین پیام پس از اتصال مجدد fill جدیدتری دارد
+    stream = FillIngestBuffer(session, source="stream")
+    stream.add("0xaaa", [_fill(2, now_ms)])
+    stream.flush()
+
+    assert _cursor(session, "0xaaa") == polled_at
+    # دریافت بعدی از همان cursor ادامه می‌دهد و fillهای بازه قطعی را می‌گیرد
+    assert load_start_times(session, ["0xaaa"])["0xaaa"] == polled_at
+
+
+def test_stream_only_trader_is_polled_from_initial_lookback(session):
+    now_ms = int(time.time() * 1000)
+    stream = FillIngestBuffer(session, source="stream")
+    stream.add("0xbbb", [_fill(3, now_ms)])
+    stream.flush()
+
+    assert session.query(TraderCursor).filter(TraderCursor.user_address == "0xbbb").one().last_fill_time is None
+    # نه از max(fills.timestamp) (که فاصله پیش از آن را جا می‌اندازد) بلکه از بازه پیش‌فرض
+    assert load_start_times(session, ["0xbbb"])["0xbbb"] < now_ms
+
+    poll = FillIngestBuffer(session)
+    poll.add("0xbbb", [_fill(3, now_ms)])
+    poll.flush()
+    assert _cursor(session, "0xbbb") == now_ms
@@ -0,0 +1,93 @@
+# collector/tests/test_telegram_split.py
+
+import asyncio
+import pytest
+from telegram_sender import (
+    TelegramDispatcher,
+    _split_long_message,
+    _markdown_v2_cut_points,
+    escape_markdown_v2
+)
+
+
+def _assert_valid_chunks(chunks, max_length):
+    for chunk in chunks:
+        assert 0 < len(chunk) <= max_length
+        # هیچ تکه‌ای با یک \\ escape نشده تمام نمی‌شود
+        trailing_backslashes = len(chunk) - len(chunk.rstrip("\\"))
+        assert trailing_backslashes % 2 == 0, chunk
+        # همه entityهای باز شده در همان تکه بسته می‌شوند
+        assert _markdown_v2_cut_points(chunk)[-1][1] == (), chunk
+
+
+def test_splits_on_line_boundaries():
+    lines = [f"*Signal {index}* on `BTC` {escape_markdown_v2('1.5 (x)')}" for index in range(20)]
+    text = "\n".join(lines)
+    chunks = _split_long_message(text, 100)
+    _assert_valid_chunks(chunks, 100)
+    assert "\n".join(chunks) == text
+
+
+def test_long_line_is_not_cut_inside_escapes():
+    text = escape_markdown_v2("a.b-c!" * 50)
+    for max_length in (7, 10, 33):
+        chunks = _split_long_message(text, max_length)
+        _assert_valid_chunks(chunks, max_length)
+        assert "".join(chunks) == text
+
+
+def test_long_entities_are_closed_and_reopened():
+    text = "*" + "bold text " * 20 + "*\n```\n" + "code line\n" * 20 + "```"
+    chunks = _split_long_message(text, 50)
+    _assert_valid_chunks(chunks, 50)
+    assert chunks[0].startswith("*") and chunks[1].startswith("*")
+
+
+def test_links_are_kept_whole():
+    link = "[a\\.b](https://example\\.com/x)"
+    text = " ".join([link] * 10)
+    chunks = _split_long_message(text, 70)
+    _assert_valid_chunks(chunks, 70)
+    assert all(chunk.count(link) == len(chunk.split(" ")) for chunk in chunks)
+
+
+class _FakeBot:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        from telegram.error import BadRequest
+        if self.fail_on is not None and self.fail_on in text:
+            raise BadRequest("can't parse entities")
+        self.sent.append(text)
+
+
+@pytest.mark.parametrize("fail_on, expected_sent, expected_failed", [
+    (None, ["short", "long"], []),
+    ("part 3", ["short"], ["long"]),
+])
+def test_ref_is_sent_only_when_all_chunks_are_sent(fail_on, expected_sent, expected_failed):
+    bot = _FakeBot(fail_on=fail_on)
+    dispatcher = TelegramDispatcher(bot, chat_id="1", rate_per_sec=1000, burst=1000, concurrency=4, max_length=40)
+    dispatcher.add("\n".join(f"part {index}" for index in range(10)), ref="long")
+    dispatcher.add("short", ref="short")
+    sent, failed = asyncio.run(dispatcher.flush())
+    assert sorted(sent) == sorted(expected_sent)
+    assert failed == expected_failed
+    # تکه‌های یک پیام به ترتیب ارسال می‌شوند و پس از اولین شکست ادامه نمی‌یابند
+    long_chunks = [text for text in bot.sent if text.startswith("part")]
+    assert long_chunks == sorted(long_chunks)
+    if fail_on:
+        assert not any("part 9" in text for text in bot.sent)
+
+
+def test_dispatchers_share_the_chat_rate_limiter():
+    first = TelegramDispatcher(_FakeBot(), chat_id="shared", rate_per_sec=2, burst=10)
+    # هر deliver_pending یک dispatcher تازه می‌سازد؛ جریمه RetryAfter قبلی باید برای آن هم بماند
+    first.rate_limiter.penalize(5)
+    second = TelegramDispatcher(_FakeBot(), chat_id="shared", rate_per_sec=2, burst=10)
+    assert second.rate_limiter is first.rate_limiter
+    assert second.rate_limiter._reserve() == pytest.approx(5.5, abs=0.01)
+    other_chat = TelegramDispatcher(_FakeBot(), chat_id="other", rate_per_sec=2, burst=10)
+    assert other_chat.rate_limiter._reserve() == 0.0
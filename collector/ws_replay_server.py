@@ -0,0 +1,88 @@
+# collector/ws_replay_server.py
+
+import json
+import asyncio
+import argparse
+from collections import defaultdict
+import websockets
+
+
+def load_recorded_fills(path):
+    """
+    فایل ضبط شده (خروجی stream_collector.py --record) را می‌خواند.
+    هر خط یک پیام userFills است: {"channel": "userFills", "data": {"user": ..., "fills": [...]}}
+    """
+    fills_by_user = defaultdict(list)
+    with open(path, encoding="utf-8") as recorded:
+        for line in recorded:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line).get("data") or {}
+            if data.get("user"):
+                fills_by_user[data["user"]].extend(data.get("fills") or [])
+    return fills_by_user
+
+
+class ReplayServer:
+    """
+    جایگزین محلی WebSocket صرافی برای تست stream_collector.py:
+    پس از هر subscribe، fillهای ضبط شده همان تریدر را با فاصله `delay` ثانیه بازپخش می‌کند.
+    """
+
+    def __init__(self, fills_by_user, delay=0.05, batch_size=20):
+        self.fills_by_user = fills_by_user
+        self.delay = delay
+        self.batch_size = batch_size
+        # (method, user) همه درخواست‌های subscribe/unsubscribe به ترتیب دریافت؛ برای بررسی در تست‌ها
+        self.subscriptions = []
+
+    async def _replay(self, websocket, user_address):
+        fills = self.fills_by_user.get(user_address, [])
+        for start in range(0, len(fills), self.batch_size):
+            await websocket.send(json.dumps({
+                "channel": "userFills",
+                "data": {"user": user_address, "isSnapshot": start == 0, "fills": fills[start:start + self.batch_size]}
+            }))
+            await asyncio.sleep(self.delay)
+
+    async def handler(self, websocket, path=None):
+        replays = []
+        try:
+            async for raw in websocket:
+                message = json.loads(raw)
+                method = message.get("method")
+                if method == "ping":
+                    await websocket.send(json.dumps({"channel": "pong"}))
+                elif method in ("subscribe", "unsubscribe"):
+                    subscription = message.get("subscription") or {}
+                    self.subscriptions.append((method, subscription.get("user")))
+                    await websocket.send(json.dumps({"channel": "subscriptionResponse", "data": message}))
+                    if method == "subscribe" and subscription.get("type") == "userFills":
+                        replays.append(asyncio.create_task(self._replay(websocket, subscription.get("user"))))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for task in replays:
+                task.cancel()
+
+
+async def serve(path, host, port, delay):
+    fills_by_user = load_recorded_fills(path)
+    server = ReplayServer(fills_by_user, delay=delay)
+    print(f"🎞️  Replaying {sum(len(f) for f in fills_by_user.values())} fills for {len(fills_by_user)} traders on ws://{host}:{port}")
+    async with websockets.serve(server.handler, host, port):
+        await asyncio.Future()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local WebSocket stand-in that replays recorded userFills messages.")
+    parser.add_argument("recording", help="JSON Lines file written by stream_collector.py --record")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.05, help="Seconds between replayed messages")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.recording, args.host, args.port, args.delay))
+    except KeyboardInterrupt:
+        pass